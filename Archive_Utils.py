@@ -0,0 +1,135 @@
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from Meniscus_Utils import Mark, ordered_meniscus
+from Pipeline_Utils import FramePacket, render_packet
+
+IMAGE_FORMATS = ('jpg', 'png')
+ARCHIVE_NAME = re.compile(r'\d{8}_\d{6}_\d{3}_\d{6}_[a-z]+\.(jpg|png|json)$')  # Files written by the archiver
+
+
+class FrameArchiver:
+    # Saves the annotated ROI of the frames worth checking later: when a reading changes by more than
+    # threshold ml from the last archived one, when the meniscus is lost and at least every heartbeat
+    # seconds. consider() only compares numbers on the measurement path, drawing, encoding and writing run
+    # in a thread pool. Jobs beyond max_pending are skipped instead of queued, and the oldest images are
+    # deleted when the folder grows over quota_mb. Each image has a JSON file with its readings. Only files
+    # named like the archiver's own count against the quota and are deleted, other files of the folder are kept
+    def __init__(self, folder, marks: Mark, threshold=0.5, heartbeat=600.0, quota_mb=1024, image_format='jpg',
+                 quality=90, workers=2, max_pending=8, line_width=1, font_size=1):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError("Unknown archive image format", image_format)
+        self.folder = folder
+        self.marks = marks
+        self.threshold = threshold
+        self.heartbeat = heartbeat
+        self.quota = quota_mb * 2**20
+        self.extension = '.' + image_format
+        self.params = [cv2.IMWRITE_JPEG_QUALITY, quality] if image_format == 'jpg' else [cv2.IMWRITE_PNG_COMPRESSION, 1]
+        self.max_pending = max_pending
+        self.line_width = line_width
+        self.font_size = font_size
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='archive')
+        self.lock = threading.Lock()
+        self.pending = 0                                        # Jobs submitted and not finished
+        self.last_readings = None                               # Readings of the last archived frame
+        self.last_time = None                                   # Capture time of the last archived frame
+        self.archived = 0                                       # Frames written
+        self.skipped = 0                                        # Triggers dropped because the pool was busy
+        self.evicted = 0                                        # Files deleted by the quota
+        self.failed = 0                                         # Saves that raised, e.g. disk full
+        self.sequence = 0                                       # Number in the file names, two saves never share a name
+        os.makedirs(folder, exist_ok=True)
+        self.files = []                                         # (path, bytes) sorted by name, oldest first
+        for name in sorted(os.listdir(folder)):                 # Names start with the time they were archived
+            path = os.path.join(folder, name)
+            if ARCHIVE_NAME.match(name) and os.path.isfile(path):
+                self.files.append((path, os.path.getsize(path)))
+        self.size = sum(size for _, size in self.files)
+
+    def trigger(self, packet: FramePacket):                     # Reason to archive the packet, None if not needed
+        readings = packet.readings
+        if self.last_readings is None:
+            return 'start'
+        if self.heartbeat and packet.t_capture - self.last_time >= self.heartbeat:
+            return 'heartbeat'
+        had, has = [value is not None for value in self.last_readings], [value is not None for value in readings]
+        if any(h and not n for h, n in zip(had, has)):          # An interface disappeared
+            return 'loss'
+        if any(n and not h for h, n in zip(had, has)):          # An interface appeared
+            return 'found'
+        for old, new in zip(self.last_readings, readings):
+            if old is not None and new is not None and abs(new - old) > self.threshold:
+                return 'change'
+        return None
+
+    def consider(self, packet: FramePacket):                    # Called for every analysed packet, never blocks
+        reason = self.trigger(packet)
+        if reason is None:
+            return None
+        with self.lock:
+            if self.pending >= self.max_pending:                # Disk or encoder cannot keep up
+                self.skipped += 1
+                return None
+            self.pending += 1
+        self.last_readings = list(packet.readings)
+        self.last_time = packet.t_capture
+        self.sequence += 1
+        now = time.time()                                       # Wall clock, t_capture is video time for recordings
+        name = time.strftime('%Y%m%d_%H%M%S', time.localtime(now)) + '_%03d_%06d_' % (int((now % 1) * 1000), self.sequence) + reason
+        self.pool.submit(self.save, packet, name, reason).add_done_callback(self.saved)
+        return reason
+
+    def saved(self, future):                                    # Reports saves that failed, pool exceptions are never raised
+        error = future.exception()
+        if error is not None:
+            with self.lock:
+                self.failed += 1
+            print('Archive write failed: ', error)
+
+    def save(self, packet: FramePacket, name, reason):          # Runs in the pool. Packets are not modified after post
+        try:
+            height, width = packet.image.shape[:2]
+            image = render_packet(packet, self.marks, (width, height), self.line_width, self.font_size)
+            ok, data = cv2.imencode(self.extension, cv2.cvtColor(image, cv2.COLOR_RGB2BGR), self.params)
+            if not ok:
+                return
+            readings, yposition, score = ordered_meniscus(packet.meniscus)     # Top interface first in every field
+            info = json.dumps({'time': packet.t_capture, 'reason': reason, 'readings': readings,
+                               'yposition': [float(y) for y in yposition], 'score': [float(s) for s in score],
+                               'roi': list(packet.roi)})
+            written = [self.write(os.path.join(self.folder, name + self.extension), data.tobytes()),
+                       self.write(os.path.join(self.folder, name + '.json'), info.encode())]
+            with self.lock:
+                for file in written:                            # By name, the pool finishes saves out of order
+                    bisect.insort(self.files, file)
+                self.size += sum(size for _, size in written)
+                self.archived += 1
+                self.evict()
+        finally:
+            with self.lock:
+                self.pending -= 1
+
+    @staticmethod
+    def write(path, data):                                      # Size on disk, what the quota is checked against
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path, os.path.getsize(path)
+
+    def evict(self):                                            # Deletes the oldest files over the quota, lock held
+        while self.size > self.quota and len(self.files) > 2:   # The newest image and JSON file are always kept
+            path, size = self.files.pop(0)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
+            self.evicted += 1
+
+    def close(self):                                            # Waits for the images being written
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,105 @@
+import json
+import os
+import platform
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+
+class StageResult:                                              # Latency samples and memory of one benchmark stage
+    def __init__(self, name, samples_ms, peak_mb, items=1):
+        self.name = name
+        self.samples_ms = np.asarray(samples_ms, dtype=np.float64)
+        self.peak_mb = peak_mb                                  # Peak Python/numpy memory allocated during one pass
+        self.items = items                                      # Frames or boxes handled per sample
+
+    def summary(self):
+        if self.samples_ms.size == 0:
+            return {'samples': 0}
+        p50 = float(np.percentile(self.samples_ms, 50))
+        return {'samples': int(self.samples_ms.size),
+                'p50_ms': round(p50, 4),
+                'p99_ms': round(float(np.percentile(self.samples_ms, 99)), 4),
+                'throughput': round(self.items * 1000.0 / float(np.mean(self.samples_ms)), 2) if np.mean(self.samples_ms) > 0 else 0.0,
+                'peak_mb': round(self.peak_mb, 3)}
+
+
+def run_stage(name, function, inputs, repeat=1, warm_up=2):
+    # Calls function on every input repeat times and returns the per call latencies. Memory is measured in
+    # a separate pass with tracemalloc (which slows the calls down), numpy and OpenCV arrays are included
+    for item in inputs[:warm_up]:
+        function(item)
+    samples = []
+    for _ in range(repeat):
+        for item in inputs:
+            start = time.perf_counter()
+            function(item)
+            samples.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    for item in inputs:
+        function(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return StageResult(name, samples, peak / 2**20)
+
+
+def environment():                                              # Machine description saved with the results
+    return {'python': platform.python_version(), 'opencv': cv2.__version__, 'numpy': np.__version__,
+            'machine': platform.machine(), 'processor': platform.processor(), 'system': platform.system(),
+            'cpus': os.cpu_count()}
+
+
+def save_results(file, results, info):
+    with open(file, 'w') as f:
+        json.dump({'info': info, 'environment': environment(),
+                   'stages': {result.name: result.summary() for result in results}}, f, indent=2)
+
+
+def load_results(file):
+    with open(file, 'r') as f:
+        return json.load(f)
+
+
+def compare(results, baseline, tolerance=0.1, min_ms=0.05):
+    # Compares the results with a saved baseline. A stage regresses when its p50 or p99 latency grows or its
+    # throughput drops by more than tolerance (fraction) and the time per item by more than min_ms, so the
+    # timer noise of microsecond stages is not flagged. Returns (name, metric, baseline, current, change)
+    # rows and the number of regressions
+    rows = []
+    regressions = 0
+    for result in results:
+        current = result.summary()
+        previous = baseline['stages'].get(result.name)
+        if not previous or not previous.get('samples') or not current.get('samples'):
+            continue
+        for metric, higher_is_worse in (('p50_ms', True), ('p99_ms', True), ('throughput', False)):
+            if not previous[metric]:
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            if higher_is_worse:
+                regressed = change > tolerance and current[metric] - previous[metric] > min_ms
+            else:                                               # Items per second, compared as ms per item
+                regressed = change < -tolerance and (not current[metric] or
+                                                     1000 / current[metric] - 1000 / previous[metric] > min_ms)
+            regressions += regressed
+            rows.append((result.name, metric, previous[metric], current[metric], change, regressed))
+    return rows, regressions
+
+
+def print_results(results):
+    print('%-12s %8s %10s %10s %12s %10s' % ('stage', 'samples', 'p50 ms', 'p99 ms', 'items/s', 'peak MB'))
+    for result in results:
+        summary = result.summary()
+        if not summary['samples']:
+            print('%-12s %8s' % (result.name, 'skipped'))
+            continue
+        print('%-12s %8d %10.3f %10.3f %12.1f %10.2f' % (result.name, summary['samples'], summary['p50_ms'],
+                                                        summary['p99_ms'], summary['throughput'], summary['peak_mb']))
+
+
+def print_comparison(rows):
+    print('%-12s %-11s %10s %10s %9s' % ('stage', 'metric', 'baseline', 'current', 'change'))
+    for name, metric, previous, current, change, regressed in rows:
+        print('%-12s %-11s %10.3f %10.3f %+8.1f%% %s' % (name, metric, previous, current, change * 100,
+                                                         'REGRESSION' if regressed else ''))
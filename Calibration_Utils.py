@@ -0,0 +1,57 @@
+import numpy as np
+
+
+class Calibration(object):
+    # Pixel to volume lookup table of a tube. Holds any number of (pixel, ml) marks and precomputes the volume
+    # of every pixel row of the ROI with the lens and parallax corrections already applied, so converting
+    # a reading is a single interpolation. The table is rebuilt only when the marks, the ROI height, the
+    # tube parameters or the lens correction change.
+    def __init__(self):
+        self.key = None                                         # Parameters the current table was built with
+        self.pixels = None                                      # Pixel rows of the table
+        self.lut = None                                         # Volume of each pixel row, None if marks are not usable
+
+    def volumes(self, ys, marks, height):                       # Volumes of sub-pixel positions ys inside the ROI
+        key = (tuple(marks.yposition), tuple(marks.capacity), int(height), marks.distance, marks.tube_diameter,
+               marks.lens_correction)
+        if key != self.key:
+            self.build(marks, int(height))
+            self.key = key
+        if self.lut is None:
+            return None
+        return np.interp(ys, self.pixels, self.lut)
+
+    def build(self, marks, height):
+        count = min(len(marks.yposition), len(marks.capacity))
+        points = sorted(zip(marks.yposition[:count], marks.capacity[:count]))
+        mark_px = np.array([point[0] for point in points], dtype=np.float64)
+        mark_ml = np.array([point[1] for point in points], dtype=np.float64)
+        if count < 2 or np.any(np.diff(mark_px) == 0):          # Two marks at the same pixel cannot be interpolated
+            self.pixels, self.lut = None, None
+            return
+        self.pixels = np.arange(height + 1, dtype=np.float64)   # One extra row covers sub-pixel edges on the last row
+        corrected = position_correction(self.pixels, marks)
+        self.lut = interp_extrapolate(corrected, mark_px, mark_ml)
+
+
+def position_correction(y, marks):                                                  # Correct the yposition on the image
+    tube_diameter = marks.tube_diameter                                             # using the information of diameter of
+    distance = marks.distance                                                       # the tube and the distance from the
+    if marks.lens_correction:                                                       # camera lens. Works on arrays too
+        lens_correction = -2.6e-5 * y**2 + 5.12e-2 * y - 3.31
+    else:                                                                           # Frames already undistorted (Calibration_File)
+        lens_correction = 0.0
+    y_corr = y + lens_correction
+    ypx = (min(marks.yposition) + max(marks.yposition))/2 - y_corr                  # Distance to the center of the scale
+    parallax_corr = ((tube_diameter / 2) * ypx) / distance
+    return y_corr - parallax_corr                                                   # Keep sub-pixel resolution
+
+
+def interp_extrapolate(x, xp, fp):
+    # Piecewise linear interpolation of x over the points (xp, fp), extended linearly outside
+    # them with the first and last segments (the scale goes on past the end marks)
+    y = np.interp(x, xp, fp)
+    below, above = x < xp[0], x > xp[-1]
+    y[below] = fp[0] + (x[below] - xp[0]) * (fp[1] - fp[0]) / (xp[1] - xp[0])
+    y[above] = fp[-1] + (x[above] - xp[-1]) * (fp[-1] - fp[-2]) / (xp[-1] - xp[-2])
+    return y
@@ -1,6 +1,9 @@
+import os
 import cv2
 import numpy as np
 
+ROI_MAPS = 4                                            # ROI maps kept by Undistorter
+
 
 def set_cam_params(cap, x, y, brightness=None, focus=None, auto_focus=False):
     if cap.isOpened():                                  # Sets camera parameters as definition
@@ -36,6 +39,54 @@ def get_cam_calibration(file, width, height):           # gets camera calibratio
     return mtx, new_mtx, dist, roi
 
 
+def save_cam_calibration(file, mtx, dist):              # saves camera calibration parameters in get_cam_calibration format
+    with open(file, 'w') as f:
+        np.savetxt(f, mtx, delimiter=',')
+        np.savetxt(f, np.reshape(dist, (1, -1)), delimiter=',')
+
+
+class Undistorter:
+    # Lens undistortion of the rotated frame ROI with precomputed cv2.remap maps. The maps of the whole frame
+    # are computed once per resolution with initUndistortRectifyMap, rotated 90 degrees like the frames and
+    # cached to disk next to the calibration file. remap() reads the raw (not rotated) camera frame and writes
+    # only the ROI pixels, so undistortion, rotation and crop are a single pass over the ROI
+    def __init__(self, calibration_file):
+        if not os.path.isfile(calibration_file):
+            raise ValueError("Calibration file not found, run Level_Meter_Calibrate.py first", calibration_file)
+        self.file = calibration_file
+        self.maps = None                                        # Float maps of the whole rotated frame
+        self.size = None                                        # (width, height) of the raw frames the maps are for
+        self.roi_maps = {}                                      # Fixed point maps of every ROI used so far
+
+    def remap(self, frame, roi):                                # Undistorted, rotated and cropped ROI of a raw frame
+        height, width = frame.shape[:2]
+        if self.size != (width, height):
+            self.maps = self.frame_maps(width, height)
+            self.size = (width, height)
+            self.roi_maps = {}
+        maps = self.roi_maps.get(roi)
+        if maps is None:
+            x1, x2, y1, y2 = roi
+            maps = cv2.convertMaps(self.maps[0][y1:y2, x1:x2], self.maps[1][y1:y2, x1:x2], cv2.CV_16SC2)
+            if len(self.roi_maps) >= ROI_MAPS:                  # Auto ROI moves the window, keep the newest ones
+                del self.roi_maps[next(iter(self.roi_maps))]
+            self.roi_maps[roi] = maps                           # Fixed point maps remap about twice as fast
+        return cv2.remap(frame, maps[0], maps[1], cv2.INTER_LINEAR)
+
+    def frame_maps(self, width, height):                        # Rotated maps of the whole frame, from disk if cached
+        mtx, new_mtx, dist, _ = get_cam_calibration(self.file, width, height)
+        cache = os.path.splitext(self.file)[0] + '_' + str(width) + 'x' + str(height) + '_maps.npz'
+        if os.path.isfile(cache):
+            cached = np.load(cache)
+            if np.array_equal(cached['mtx'], mtx) and np.array_equal(cached['dist'], dist):
+                return cached['map_x'], cached['map_y']         # Calibration unchanged since the maps were saved
+        map_x, map_y = cv2.initUndistortRectifyMap(mtx, dist, None, new_mtx, (width, height), cv2.CV_32FC1)
+        map_x = cv2.rotate(map_x, cv2.ROTATE_90_CLOCKWISE)      # Pixel (x, y) of the rotated frame takes the value
+        map_y = cv2.rotate(map_y, cv2.ROTATE_90_CLOCKWISE)      # of raw pixel (map_x, map_y)
+        np.savez(cache, map_x=map_x, map_y=map_y, mtx=mtx, dist=dist)
+        return map_x, map_y
+
+
 def print_img_resolution(img):                          # prints the resolution of an image
     width = img.shape[0]
     height = img.shape[1]
@@ -48,3 +99,14 @@ def set_cam_brightness(cap, brightness=None):           # Changes the brightness
         if brightness is not None:
             cap.set(cv2.CAP_PROP_BRIGHTNESS, brightness.get())
     return
+
+
+def percent_roi(img_width, img_height, percent_x, percent_y):
+    # Returns a ROI (x1, x2, y1, y2) centered in an image of img_width x img_height pixels whose size is the
+    # given percentage of the image in x and y. x1 and x2 are the horizontal min and max pixels,
+    # y1 and y2 are the vertical min and max pixels
+    x1 = int((img_width - (img_width * percent_x / 100)) / 2)
+    x2 = int(x1 + (img_width * percent_x / 100))
+    y1 = int((img_height - (img_height * percent_y / 100)) / 2)
+    y2 = int(y1 + (img_height * percent_y / 100))
+    return x1, x2, y1, y2
@@ -0,0 +1,79 @@
+import numpy as np
+
+EDGE_MODES = ('last', 'subpixel')                               # Values accepted by Edge_Mode= in Level_Meter.cfg
+EDGE_AGGREGATES = ('median', 'trimmed', 'mean')                 # Values accepted by Edge_Aggregate=
+
+
+class EdgeDetector(object):
+    # Finds the lower edge of the meniscus inside a bounding box over a band of columns centered in the box.
+    # mode 'last' returns the last white pixel of the binary image in each column, mode 'subpixel' refines it
+    # with the vertical gradient of the grayscale image. Columns are combined with a robust aggregate so
+    # a few columns hitting a bubble, scratch or the tube wall do not move the reading.
+    def __init__(self, mode='last', band=5, aggregate='median', trim=0.2, window=3):
+        if mode not in EDGE_MODES:
+            raise ValueError("Unknown edge mode", mode)
+        if aggregate not in EDGE_AGGREGATES:
+            raise ValueError("Unknown edge aggregate", aggregate)
+        self.mode = mode
+        self.band = band                                        # Number of columns evaluated
+        self.aggregate = aggregate
+        self.trim = trim                                        # Fraction cut from each end by the trimmed mean
+        self.window = window                                    # Rows searched around the binary edge in subpixel mode
+
+    def detect(self, binary, y, gray=None):
+        # binary: thresholded (white meniscus) crop of the bounding box, gray: grayscale crop of the same box.
+        # Returns y (top of the box) plus the position of the lower edge inside the box
+        columns = band_columns(binary.shape[1], self.band)
+        if columns.stop == columns.start:
+            return y
+        rows = last_white(binary[:, columns])
+        valid = rows >= 0                                       # Columns without any white pixel are ignored
+        if not valid.any():
+            return y
+        if self.mode == 'subpixel' and gray is not None:
+            edges = subpixel_edges(gray[:, columns][:, valid], rows[valid], self.window)
+        else:
+            edges = rows[valid].astype(np.float64)
+        return y + aggregate(edges, self.aggregate, self.trim)
+
+
+def band_columns(width, band):                                  # Slice of `band` columns centered in the image
+    band = min(band, width)
+    start = (width - band) // 2
+    return slice(start, start + band)
+
+
+def last_white(binary):
+    # Row of the last white (255) pixel of each column, -1 if a column has none
+    mask = binary == 255
+    last = binary.shape[0] - 1 - np.argmax(mask[::-1], axis=0)
+    return np.where(mask.any(axis=0), last, -1)
+
+
+def subpixel_edges(gray, rows, window=3):
+    # Refines the integer edge of each column to the position of the strongest dark to bright transition
+    # (going down) within +-window rows, interpolated with a parabola through the gradient peak
+    grad = np.diff(gray.astype(np.float32), axis=0)             # grad[k] is the step between rows k and k+1
+    if grad.shape[0] < 3:
+        return rows.astype(np.float64)
+    cols = np.arange(gray.shape[1])
+    offsets = np.arange(-window, window + 1)[:, None]
+    candidates = np.clip(rows[None, :] + offsets, 1, grad.shape[0] - 2)
+    peak = candidates[np.argmax(grad[candidates, cols], axis=0), cols]
+    left, center, right = grad[peak - 1, cols], grad[peak, cols], grad[peak + 1, cols]
+    denom = left - 2 * center + right
+    peaked = denom < 0                                          # Only a maximum has a parabolic vertex to move to
+    delta = np.where(peaked, 0.5 * (left - right) / np.where(peaked, denom, -1.0), 0.0)
+    return peak + np.clip(delta, -0.5, 0.5)                     # peak is the last row before the transition
+
+
+def aggregate(values, method='median', trim=0.2):               # Combines the edges found in each column
+    values = np.sort(values)
+    n = values.size
+    if method == 'median':                                      # np.median costs more than the whole detection
+        return float(values[n // 2]) if n % 2 else float(values[n // 2 - 1] + values[n // 2]) / 2
+    if method == 'trimmed':
+        cut = int(values.size * trim)
+        if values.size - 2 * cut > 0:
+            values = values[cut:values.size - cut]
+    return float(np.mean(values))
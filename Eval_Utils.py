@@ -0,0 +1,111 @@
+import glob
+import os
+import numpy as np
+from Meniscus_Utils import box_detail
+from Paths import *
+
+
+def box_iou(boxes_a, boxes_b):
+    # IoU of every pair of normalized [ymin, xmin, ymax, xmax] boxes, returns a len(a) x len(b) matrix
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    left = np.maximum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    right = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(bottom - top, 0, None) * np.clip(right - left, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.where(union > 0, union, 1.0), 0.0)
+
+
+def match(detections, truths, iou_threshold=0.5):
+    # Greedy matching by score like the VOC/COCO evaluations. detections: (boxes, scores) sorted by score,
+    # returns per detection the index of its true box (-1 for false positives) and its IoU
+    boxes, scores = detections
+    order = np.argsort(-np.asarray(scores))
+    iou = box_iou(np.asarray(boxes)[order], truths)
+    taken = np.zeros(len(truths), bool)
+    matched = np.full(len(order), -1)
+    overlaps = np.zeros(len(order))
+    for rank, index in enumerate(order):
+        if iou.shape[1] == 0:
+            break
+        candidates = np.where(taken, -1.0, iou[rank])
+        best = int(np.argmax(candidates))
+        if candidates[best] >= iou_threshold:
+            taken[best] = True
+            matched[index] = best
+            overlaps[index] = candidates[best]
+    return matched, overlaps
+
+
+def average_precision(results, iou_threshold=0.5):
+    # All point interpolated AP of a single class over a dataset. results: list of ((boxes, scores), truths)
+    scores, hits = [], []
+    total = 0
+    for detections, truths in results:
+        matched, _ = match(detections, truths, iou_threshold)
+        scores += list(detections[1])
+        hits += list(matched >= 0)
+        total += len(truths)
+    if total == 0:
+        return 0.0
+    order = np.argsort(-np.asarray(scores))
+    hits = np.asarray(hits, dtype=np.float64)[order]
+    true_positives = np.cumsum(hits)
+    recall = true_positives / total
+    precision = true_positives / np.arange(1, len(hits) + 1)
+    recall = np.concatenate(([0.0], recall, [1.0]))
+    precision = np.concatenate(([0.0], precision, [0.0]))
+    precision = np.maximum.accumulate(precision[::-1])[::-1]    # Precision envelope
+    steps = np.where(recall[1:] != recall[:-1])[0]
+    return float(np.sum((recall[steps + 1] - recall[steps]) * precision[steps + 1]))
+
+
+def coco_map(results):                                          # AP averaged over IoU 0.50:0.05:0.95
+    return float(np.mean([average_precision(results, threshold) for threshold in np.arange(0.5, 0.96, 0.05)]))
+
+
+def mean_best_iou(results):                                     # Mean over the true boxes of the best detection IoU
+    best = []
+    for (boxes, _), truths in results:
+        iou = box_iou(truths, boxes)
+        best += list(iou.max(axis=1)) if iou.shape[1] else [0.0] * len(truths)
+    return float(np.mean(best)) if best else 0.0
+
+
+def lower_edge(image, box, edge):                               # Lower edge row in pixels found inside a normalized box
+    ymin, xmin, ymax, xmax = box
+    ymin, ymax = int(ymin * image.shape[0]), int(ymax * image.shape[0])
+    xmin, xmax = int(xmin * image.shape[1]), int(xmax * image.shape[1])
+    if ymax <= ymin or xmax <= xmin:
+        return None
+    detail, gray = box_detail(image, ymin, ymax, xmin, xmax)
+    return edge.detect(detail, ymin, gray)
+
+
+def edge_errors(image, detections, truths, edge, iou_threshold=0.5):
+    # Pixel difference between the lower edge found in each matched detection and in its labelled box.
+    # The labels have no edge annotation, the edge found in the true box is the reference
+    boxes, _ = detections
+    matched, _ = match(detections, truths, iou_threshold)
+    errors = []
+    for index, truth in enumerate(matched):
+        if truth < 0:
+            continue
+        detected, reference = lower_edge(image, boxes[index], edge), lower_edge(image, truths[truth], edge)
+        if detected is not None and reference is not None:
+            errors.append(abs(detected - reference))
+    return errors
+
+
+def model_size_mb(backend):                                     # Size on disk of the model files of a backend
+    if backend == 'tflite_fp16':
+        model_files = [files['TFLITE_FP16']]
+    elif backend == 'tflite_int8':
+        model_files = [files['TFLITE_INT8']]
+    else:
+        model_files = glob.glob(files['CHECKPOINT'] + '.*')
+    return sum(os.path.getsize(file) for file in model_files if os.path.isfile(file)) / 2**20
@@ -2,8 +2,9 @@ from os.path import isfile
 
 
 class ConfigParams:                                         # Class that contains program config
-    def __init__(self, cam, res, distance, diam, canvasw, canvash, lw, fs):
-        self.cam = int(cam)
+    def __init__(self, cam, res, distance, diam, canvasw, canvash, lw, fs, backend='tf', threads=4,
+                 host='127.0.0.1', port=64250, batch=1):
+        self.cam = int(cam) if str(cam).isdigit() else cam      # Camera index, video file or "synthetic"
         self.resolution = res
         self.obj_distance = int(distance)
         self.tube_diam = int(diam)
@@ -11,6 +12,45 @@ class ConfigParams:                                         # Class that contain
         self.canvas_height = int(canvash)
         self.line_width = int(lw)
         self.font_size = int(fs)
+        self.backend = backend                                  # Inference backend: tf, tflite_fp16 or tflite_int8
+        self.threads = int(threads)                             # CPU threads used by the TFLite interpreter
+        self.output_host = host                                 # Reading consumer (Labview) address
+        self.output_port = int(port)
+        self.output_batch = int(batch)                          # Max readings coalesced in one socket write
+        self.roi_percent_x = 100                                # Centered ROI size in percent of the rotated frame
+        self.roi_percent_y = 100
+        self.marks_px = []                                      # Mark positions in pixels inside the ROI, min and max at least
+        self.marks_ml = [0, 0]                                  # Capacity of each mark
+        self.tubes = []                                         # Tube= lines, one per tube when several share the frame
+        self.edge_mode = 'last'                                 # Lower edge detection: last white pixel or subpixel
+        self.edge_band = 5                                      # Columns evaluated in the center of the bounding box
+        self.edge_aggregate = 'median'                          # How columns are combined: median, trimmed or mean
+        self.gating = 0                                         # 1 runs the detector only on motion, tracking loss or max age
+        self.gating_motion = 0.5                                # Percent of changed ROI pixels that counts as motion
+        self.gating_max_age = 5.0                               # Max seconds between detector runs
+        self.calibration_file = ''                              # Camera matrix and distortion file, empty for no undistortion
+        self.display_fps = 10.0                                 # Max GUI redraws per second, readings are not throttled
+        self.camera_fourcc = 'MJPG'                             # Camera stream format, empty for the driver default
+        self.camera_buffer = 1                                  # Frames queued by the camera driver
+        self.metrics_host = '127.0.0.1'                         # Prometheus endpoint address
+        self.metrics_port = 0                                   # Prometheus endpoint port, 0 for none
+        self.stats_panel = 0                                    # 1 shows the statistics panel in the GUI
+        self.record_folder = ''                                 # Folder the readings are recorded to, empty for none
+        self.print_readings = 1                                 # 1 prints every reading on stdout
+        self.trend_width = 400                                  # Width of the GUI trend panel in pixels, 0 for none
+        self.trend_fps = 1.0                                    # Max trend redraws per second
+        self.archive_folder = ''                                # Folder of the archived frames, empty for none
+        self.archive_change = 0.5                               # Reading change in ml that archives a frame
+        self.archive_heartbeat = 600.0                          # Max seconds between archived frames, 0 for none
+        self.archive_quota_mb = 1024                            # Oldest archived frames are deleted over this size
+        self.archive_format = 'jpg'                             # jpg or png
+        self.modbus_host = '127.0.0.1'                          # Modbus/TCP server address
+        self.modbus_port = 0                                    # Modbus/TCP server port, 0 for none
+        self.auto_roi = 0                                       # 1 narrows the ROI to a window around the tube
+        self.auto_roi_aspect = 0.375                            # Min width / height of the auto ROI window
+        self.auto_roi_period = 60.0                             # Seconds between tube searches
+        self.stations = []                                      # Station= lines, one per camera of the supervisor
+        self.shared_detector = 1                                # 1 runs one detector process for all stations
 
 
 def get_config(file, cfg_par: ConfigParams):
@@ -23,11 +63,11 @@ def get_config(file, cfg_par: ConfigParams):
             line = line.strip('\n')
             command = line.split("=")
             if command[0] == "Camera":
-                cfg_par.cam = int(command[1])
+                cfg_par.cam = int(command[1]) if command[1].isdigit() else command[1]
             if command[0] == "Resolution":
                 cfg_par.resolution = command[1]
             if command[0] == "Distance_to_object":
-                cfg_par.distance = int(command[1])
+                cfg_par.obj_distance = int(command[1])
             if command[0] == "Tube_diameter":
                 cfg_par.tube_diam = int(command[1])
             if command[0] == "Line_Width":
@@ -38,6 +78,84 @@ def get_config(file, cfg_par: ConfigParams):
                 cfg_par.canvas_width = int(command[1])
             if command[0] == "Canvas_Height":
                 cfg_par.canvas_height = int(command[1])
+            if command[0] == "Backend":
+                cfg_par.backend = command[1]
+            if command[0] == "Threads":
+                cfg_par.threads = int(command[1])
+            if command[0] == "Output_Host":
+                cfg_par.output_host = command[1]
+            if command[0] == "Output_Port":
+                cfg_par.output_port = int(command[1])
+            if command[0] == "Output_Batch":
+                cfg_par.output_batch = int(command[1])
+            if command[0] == "ROI_Percent_X":
+                cfg_par.roi_percent_x = int(command[1])
+            if command[0] == "ROI_Percent_Y":
+                cfg_par.roi_percent_y = int(command[1])
+            if command[0] == "Marks_px":
+                cfg_par.marks_px = to_list(command[1], int)
+            if command[0] == "Marks_ml":
+                cfg_par.marks_ml = to_list(command[1], float)
+            if command[0] == "Tube":
+                cfg_par.tubes.append(command[1])
+            if command[0] == "Edge_Mode":
+                cfg_par.edge_mode = command[1]
+            if command[0] == "Edge_Band":
+                cfg_par.edge_band = int(command[1])
+            if command[0] == "Edge_Aggregate":
+                cfg_par.edge_aggregate = command[1]
+            if command[0] == "Gating":
+                cfg_par.gating = int(command[1])
+            if command[0] == "Gating_Motion":
+                cfg_par.gating_motion = float(command[1])
+            if command[0] == "Gating_Max_Age":
+                cfg_par.gating_max_age = float(command[1])
+            if command[0] == "Calibration_File":
+                cfg_par.calibration_file = command[1]
+            if command[0] == "Display_FPS":
+                cfg_par.display_fps = float(command[1])
+            if command[0] == "Camera_Fourcc":
+                cfg_par.camera_fourcc = command[1]
+            if command[0] == "Camera_Buffer":
+                cfg_par.camera_buffer = int(command[1])
+            if command[0] == "Metrics_Host":
+                cfg_par.metrics_host = command[1]
+            if command[0] == "Metrics_Port":
+                cfg_par.metrics_port = int(command[1])
+            if command[0] == "Stats_Panel":
+                cfg_par.stats_panel = int(command[1])
+            if command[0] == "Record_Folder":
+                cfg_par.record_folder = command[1]
+            if command[0] == "Print_Readings":
+                cfg_par.print_readings = int(command[1])
+            if command[0] == "Trend_Width":
+                cfg_par.trend_width = int(command[1])
+            if command[0] == "Trend_FPS":
+                cfg_par.trend_fps = float(command[1])
+            if command[0] == "Archive_Folder":
+                cfg_par.archive_folder = command[1]
+            if command[0] == "Archive_Change":
+                cfg_par.archive_change = float(command[1])
+            if command[0] == "Archive_Heartbeat":
+                cfg_par.archive_heartbeat = float(command[1])
+            if command[0] == "Archive_Quota_MB":
+                cfg_par.archive_quota_mb = int(command[1])
+            if command[0] == "Archive_Format":
+                cfg_par.archive_format = command[1]
+            if command[0] == "Modbus_Host":
+                cfg_par.modbus_host = command[1]
+            if command[0] == "Modbus_Port":
+                cfg_par.modbus_port = int(command[1])
+            if command[0] == "Auto_ROI":
+                cfg_par.auto_roi = int(command[1])
+            if command[0] == "Auto_ROI_Aspect":
+                cfg_par.auto_roi_aspect = float(command[1])
+            if command[0] == "Auto_ROI_Period":
+                cfg_par.auto_roi_period = float(command[1])
+            if command[0] == "Station":
+                cfg_par.stations.append(command[1])
+            if command[0] == "Shared_Detector":
+                cfg_par.shared_detector = int(command[1])
             f.close()
     else:
         create_config(file, cfg_par)                        # File does not exist, create one with default values
@@ -62,4 +180,88 @@ def create_config(file, cfg_par: ConfigParams):
         f.write(line)
         line = "Canvas_Height=" + str(cfg_par.canvas_height) + '\n'
         f.write(line)
+        line = "Backend=" + str(cfg_par.backend) + '\n'
+        f.write(line)
+        line = "Threads=" + str(cfg_par.threads) + '\n'
+        f.write(line)
+        line = "Output_Host=" + str(cfg_par.output_host) + '\n'
+        f.write(line)
+        line = "Output_Port=" + str(cfg_par.output_port) + '\n'
+        f.write(line)
+        line = "Output_Batch=" + str(cfg_par.output_batch) + '\n'
+        f.write(line)
+        line = "ROI_Percent_X=" + str(cfg_par.roi_percent_x) + '\n'
+        f.write(line)
+        line = "ROI_Percent_Y=" + str(cfg_par.roi_percent_y) + '\n'
+        f.write(line)
+        line = "Marks_px=" + ','.join(map(str, cfg_par.marks_px)) + '\n'
+        f.write(line)
+        line = "Marks_ml=" + ','.join(map(str, cfg_par.marks_ml)) + '\n'
+        f.write(line)
+        line = "Edge_Mode=" + str(cfg_par.edge_mode) + '\n'
+        f.write(line)
+        line = "Edge_Band=" + str(cfg_par.edge_band) + '\n'
+        f.write(line)
+        line = "Edge_Aggregate=" + str(cfg_par.edge_aggregate) + '\n'
+        f.write(line)
+        line = "Gating=" + str(cfg_par.gating) + '\n'
+        f.write(line)
+        line = "Gating_Motion=" + str(cfg_par.gating_motion) + '\n'
+        f.write(line)
+        line = "Gating_Max_Age=" + str(cfg_par.gating_max_age) + '\n'
+        f.write(line)
+        line = "Calibration_File=" + str(cfg_par.calibration_file) + '\n'
+        f.write(line)
+        line = "Display_FPS=" + str(cfg_par.display_fps) + '\n'
+        f.write(line)
+        line = "Camera_Fourcc=" + str(cfg_par.camera_fourcc) + '\n'
+        f.write(line)
+        line = "Camera_Buffer=" + str(cfg_par.camera_buffer) + '\n'
+        f.write(line)
+        line = "Metrics_Host=" + str(cfg_par.metrics_host) + '\n'
+        f.write(line)
+        line = "Metrics_Port=" + str(cfg_par.metrics_port) + '\n'
+        f.write(line)
+        line = "Stats_Panel=" + str(cfg_par.stats_panel) + '\n'
+        f.write(line)
+        line = "Record_Folder=" + str(cfg_par.record_folder) + '\n'
+        f.write(line)
+        line = "Print_Readings=" + str(cfg_par.print_readings) + '\n'
+        f.write(line)
+        line = "Trend_Width=" + str(cfg_par.trend_width) + '\n'
+        f.write(line)
+        line = "Trend_FPS=" + str(cfg_par.trend_fps) + '\n'
+        f.write(line)
+        line = "Archive_Folder=" + str(cfg_par.archive_folder) + '\n'
+        f.write(line)
+        line = "Archive_Change=" + str(cfg_par.archive_change) + '\n'
+        f.write(line)
+        line = "Archive_Heartbeat=" + str(cfg_par.archive_heartbeat) + '\n'
+        f.write(line)
+        line = "Archive_Quota_MB=" + str(cfg_par.archive_quota_mb) + '\n'
+        f.write(line)
+        line = "Archive_Format=" + str(cfg_par.archive_format) + '\n'
+        f.write(line)
+        line = "Modbus_Host=" + str(cfg_par.modbus_host) + '\n'
+        f.write(line)
+        line = "Modbus_Port=" + str(cfg_par.modbus_port) + '\n'
+        f.write(line)
+        line = "Auto_ROI=" + str(cfg_par.auto_roi) + '\n'
+        f.write(line)
+        line = "Auto_ROI_Aspect=" + str(cfg_par.auto_roi_aspect) + '\n'
+        f.write(line)
+        line = "Auto_ROI_Period=" + str(cfg_par.auto_roi_period) + '\n'
+        f.write(line)
+        line = "Shared_Detector=" + str(cfg_par.shared_detector) + '\n'
+        f.write(line)
+        for tube in cfg_par.tubes:
+            line = "Tube=" + tube + '\n'
+            f.write(line)
+        for station in cfg_par.stations:
+            line = "Station=" + station + '\n'
+            f.write(line)
         f.close()
+
+
+def to_list(text, type_):                                   # Converts a comma separated value like "120,980" to a list
+    return [type_(value) for value in text.split(',') if value.strip() != '']
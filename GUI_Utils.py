@@ -1,4 +1,7 @@
 import tkinter as tk
+import numpy as np
+from PIL import Image, ImageTk
+from Trend_Utils import TrendBuffer, decimate
 
 
 def frame_create(parent, text_, row_, col_, colspan_, rowspan_):                        # Creates a frame and puts it on the grid
@@ -32,3 +35,71 @@ def label_create(parent, width_, row_, col_, pad_x, pad_y, label, var: tk.String
     aux_label2.grid(row=row_, column=col_)                                              # Put it in column 1 of the frame
     # var.set('0')                                                                        # Initialize variable
     return aux_label2
+
+
+class CanvasImage:                                                                      # Single image item of a canvas updated in place
+    def __init__(self, canvas: tk.Canvas):
+        self.canvas = canvas
+        self.photo = None                                                               # PhotoImage shown by the canvas item
+        self.item = canvas.create_image(0, 0, anchor=tk.NW)                             # Created once, never one item per frame
+
+    def show(self, img, x, y):                                                          # Shows an RGB array with its top left corner at x, y
+        size = (img.shape[1], img.shape[0])
+        if self.photo is None or (self.photo.width(), self.photo.height()) != size:     # New PhotoImage only when the ROI size changes
+            self.photo = ImageTk.PhotoImage(image=Image.fromarray(img))
+            self.canvas.itemconfigure(self.item, image=self.photo)
+        else:
+            self.photo.paste(Image.fromarray(img))                                      # Copies the pixels into the existing Tk image
+        self.canvas.coords(self.item, x, y)
+
+
+class TrendPlot:                                                                        # Trend of the interface volumes drawn on its own canvas
+    COLORS = ('red', 'blue')                                                            # Same colors as the interfaces in the image
+
+    def __init__(self, parent, width, height):
+        self.width = width
+        self.height = height
+        self.margin = 16                                                                # Room for the labels on top and bottom
+        self.canvas = tk.Canvas(parent, width=width, height=height, bg='white')
+        self.canvas.grid(row=0, column=0)
+        self.lines = [self.canvas.create_line(0, 0, 0, 0, fill=color, state=tk.HIDDEN) for color in self.COLORS]
+        self.top_text = self.canvas.create_text(2, 2, anchor=tk.NW, text='')            # Items are created once, every redraw
+        self.bottom_text = self.canvas.create_text(2, height - 2, anchor=tk.SW, text='')    # only moves their coordinates
+        self.span_text = self.canvas.create_text(width - 2, height - 2, anchor=tk.SE, text='')
+        self.drawn = -1                                                                 # Buffer version on the screen
+
+    def draw(self, trend: TrendBuffer):                                                 # Redraws only when the buffer changed
+        if trend.version == self.drawn or trend.size == 0:
+            return
+        self.drawn = trend.version
+        times, low, high = trend.view()
+        columns, lows, highs = decimate(times, low, high, self.width, times[0], times[-1])
+        if not np.isfinite(lows).any():                                                 # No readings yet, only missing values
+            return
+        bottom, top = float(np.nanmin(lows)), float(np.nanmax(highs))                   # Vertical axis fits the whole run
+        if top - bottom < 1e-6:
+            top, bottom = top + 0.5, bottom - 0.5
+        scale = (self.height - 2 * self.margin) / (top - bottom)
+        for series, line in enumerate(self.lines):
+            valid = np.isfinite(lows[:, series])                                        # Pixel columns without readings are skipped
+            if not valid.any():
+                self.canvas.itemconfigure(line, state=tk.HIDDEN)
+                continue
+            x = np.repeat(columns[valid], 2)
+            y = self.height - self.margin - (np.column_stack((lows[valid, series], highs[valid, series])).ravel() - bottom) * scale
+            points = np.column_stack((x, y)).ravel()
+            if points.size < 4:                                                         # A line needs two points
+                points = np.tile(points, 2)
+            self.canvas.coords(line, *points.tolist())
+            self.canvas.itemconfigure(line, state=tk.NORMAL)
+        self.canvas.itemconfigure(self.top_text, text=str(round(top, 2)) + ' ml')
+        self.canvas.itemconfigure(self.bottom_text, text=str(round(bottom, 2)) + ' ml')
+        self.canvas.itemconfigure(self.span_text, text=span_text(times[-1] - times[0]))
+
+
+def span_text(seconds):                                                                 # Run length shown under the trend
+    if seconds < 120:
+        return str(int(seconds)) + ' s'
+    if seconds < 7200:
+        return str(round(seconds / 60, 1)) + ' min'
+    return str(round(seconds / 3600, 1)) + ' h'
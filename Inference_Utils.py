@@ -0,0 +1,333 @@
+import glob
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import cv2
+import numpy as np
+from Paths import *
+# Tensorflow is imported inside the functions that need it, importing it takes seconds and the GUI window
+# and camera preview must not wait for it (see EngineLoader)
+
+MODEL_INPUT_SIZE = 320                                          # fixed_shape_resizer size in pipeline.config
+MAX_DETECTIONS = 2                                              # meniscus_draw never reads more than 2 boxes
+BACKENDS = ('tf', 'tflite_fp16', 'tflite_int8')                 # Values accepted by Backend= in Level_Meter.cfg
+OUTPUT_NAMES = ('detection_boxes', 'detection_classes', 'detection_scores', 'num_detections')   # TFLite signature outputs
+
+
+class Engine:                                                   # Input shape and latency counters shared by every backend
+    def __init__(self, input_size=MODEL_INPUT_SIZE, max_detections=MAX_DETECTIONS, batch_size=1):
+        self.input_size = input_size
+        self.max_detections = max_detections
+        self.batch_size = batch_size                            # Images per model call, short batches are padded
+        self.latency_ms = 0.0                                   # Latency of the last call
+        self.avg_latency_ms = 0.0                               # Running mean latency over all calls
+        self.calls = 0
+        self.traces = 0                                         # Number of times the graph has been traced
+
+    def update_latency(self, latency_ms):
+        self.latency_ms = latency_ms
+        self.calls += 1
+        self.avg_latency_ms += (latency_ms - self.avg_latency_ms) / self.calls
+
+
+class DetectionEngine(Engine):                                  # Detection model compiled once for a fixed input shape
+    def __init__(self, pipeline_config, checkpoint, max_detections=MAX_DETECTIONS, input_size=MODEL_INPUT_SIZE, batch_size=1,
+                 cache_path=paths['MODEL_CACHE_PATH']):
+        super().__init__(input_size, max_detections, batch_size)
+        # The compiled detect function is saved as a SavedModel keyed on the checkpoint, the pipeline.config and
+        # the input signature, so later starts load it directly and skip model_builder.build and the restore
+        key = model_key(pipeline_config, checkpoint, max_detections, input_size, batch_size)
+        self.cache_dir = os.path.join(cache_path, key) if cache_path else None
+        start = time.perf_counter()
+        loaded = False
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            try:
+                self.load_cached()
+                loaded = True
+            except Exception as error:                          # Broken cache, rebuilt and saved again below
+                print('Warning: model cache not loaded (', error, '), rebuilding')
+                shutil.rmtree(self.cache_dir, ignore_errors=True)
+        if not loaded:
+            self.build(pipeline_config, checkpoint)
+        print('Model loaded in ', round(time.perf_counter() - start, 2), 's')
+        self.warm_up()
+        if self.cache_dir and not os.path.isdir(self.cache_dir):
+            self.save_cached()
+
+    def build(self, pipeline_config, checkpoint):               # Builds the model from pipeline.config and restores the checkpoint
+        import tensorflow as tf
+        from object_detection.builders import model_builder
+        from object_detection.utils import config_util
+        configs = config_util.get_configs_from_pipeline_file(pipeline_config)
+        nms = configs['model'].ssd.post_processing.batch_non_max_suppression
+        nms.max_detections_per_class = self.max_detections      # Cap NMS output to the boxes we actually use,
+        nms.max_total_detections = self.max_detections          # pipeline.config keeps 100 from training
+        self.model = model_builder.build(model_config=configs['model'], is_training=False)
+        ckpt = tf.compat.v2.train.Checkpoint(model=self.model)
+        ckpt.restore(checkpoint).expect_partial()
+        signature = [tf.TensorSpec(shape=[self.batch_size, self.input_size, self.input_size, 3], dtype=tf.uint8)]
+        self._detect = tf.function(self._detect_graph, input_signature=signature)
+
+    def load_cached(self):                                      # Restores the saved detect function, no object_detection import
+        import tensorflow as tf
+        self.model = tf.saved_model.load(self.cache_dir)
+        self._detect = self.model.detect
+
+    def save_cached(self):
+        # Saves the traced detect function. Written to a temporary folder of this process and renamed, so an
+        # interrupted save never leaves a broken cache behind and processes starting together (offline
+        # workers, station processes) do not write into each other's folder. A failed save only costs the
+        # faster start, if another process renamed its folder first this one is dropped
+        import tensorflow as tf
+        module = tf.Module()
+        module.model = self.model
+        module.detect = self._detect
+        cache_path, key = os.path.split(self.cache_dir)
+        temp_dir = None
+        try:
+            os.makedirs(cache_path, exist_ok=True)
+            temp_dir = tempfile.mkdtemp(prefix=key + '.tmp', dir=cache_path)
+            tf.saved_model.save(module, temp_dir)
+            os.replace(temp_dir, self.cache_dir)
+            print('Model cached in ', self.cache_dir)
+        except Exception as error:
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            if not os.path.isdir(self.cache_dir):
+                print('Warning: model cache not saved (', error, ')')
+
+    def _detect_graph(self, image):
+        import tensorflow as tf
+        image = tf.cast(image, tf.float32)
+        image, shapes = self.model.preprocess(image)
+        prediction_dict = self.model.predict(image, shapes)
+        return self.model.postprocess(prediction_dict, shapes)
+
+    def warm_up(self):                                          # Trace and compile the graph before the first frame
+        import tensorflow as tf
+        start = time.perf_counter()
+        self._detect(tf.zeros([self.batch_size, self.input_size, self.input_size, 3], dtype=tf.uint8))
+        self.traces = self.tracing_count()
+        print('Model compiled in ', round(time.perf_counter() - start, 2), 's')
+
+    def tracing_count(self):                                    # Functions restored from the cache are already traced
+        counter = getattr(self._detect, 'experimental_get_tracing_count', None)
+        return counter() if counter else 0
+
+    def detect(self, image):
+        # Runs the compiled graph over an RGB image of any size. Box coordinates are normalized so
+        # they are valid for the original image. Returns the same dict App.update used to build
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images):
+        # Runs the graph over a list of RGB images of any size, batch_size images per call.
+        # Returns one detections dict per image
+        import tensorflow as tf
+        results = []
+        batch = np.zeros((self.batch_size, self.input_size, self.input_size, 3), np.uint8)
+        for first in range(0, len(images), self.batch_size):
+            chunk = images[first:first + self.batch_size]
+            for idx, image in enumerate(chunk):
+                batch[idx] = resize_to_input(image, self.input_size)
+            start = time.perf_counter()
+            detections = self._detect(tf.convert_to_tensor(batch))
+            detections = {key: value.numpy() for key, value in detections.items()}
+            self.update_latency((time.perf_counter() - start) * 1000)
+            for idx in range(len(chunk)):
+                num_detections = int(detections['num_detections'][idx])
+                results.append({'detection_boxes': detections['detection_boxes'][idx, :num_detections],
+                                'detection_scores': detections['detection_scores'][idx, :num_detections],
+                                'detection_classes': detections['detection_classes'][idx, :num_detections].astype(np.int64),
+                                'num_detections': num_detections})
+        traces = self.tracing_count()
+        if traces != self.traces:                               # Should never happen with a fixed signature
+            print('Warning: detection graph retraced (', traces, 'traces)')
+            self.traces = traces
+        return results
+
+
+class TFLiteEngine(Engine):                                     # Same detect() interface backed by a TFLite interpreter
+    def __init__(self, model_file, threads=4):
+        super().__init__(batch_size=1)                          # The TFLite post processing op runs one image at a time
+        if not os.path.isfile(model_file):
+            raise ValueError("TFLite model not found, run Level_Meter_Export.py first", model_file)
+        self.interpreter = interpreter_class()(model_path=model_file, num_threads=threads)   # Multi-threaded CPU (XNNPACK) kernels
+        self.interpreter.allocate_tensors()
+        self.input = self.interpreter.get_input_details()[0]
+        self.input_size = int(self.input['shape'][1])
+        self.model_file = model_file
+        self.boxes, self.classes, self.scores, self.num = self.map_outputs()
+        self.warm_up()
+
+    def map_outputs(self):
+        # Tensor indices of boxes, classes, scores and num_detections. The order of the output tensors and
+        # their "StatefulPartitionedCall:n" names change between converter versions (TF2 exports often
+        # have scores at :0 and classes at :3), so they are mapped by the output names of the SavedModel
+        # signature. Models without a signature fall back to the shapes, boxes are the only 3D output and
+        # num_detections the only 1D one, the other two are guessed from the name suffix and check_outputs()
+        # tells classes from scores on the warm up
+        signatures = self.interpreter.get_signature_list() if hasattr(self.interpreter, 'get_signature_list') else {}
+        for key in signatures:
+            outputs = self.interpreter.get_signature_runner(key).get_output_details()
+            if all(name in outputs for name in OUTPUT_NAMES):
+                self.mapped = True
+                return tuple(outputs[name]['index'] for name in OUTPUT_NAMES)
+        self.mapped = False
+        details = sorted(self.interpreter.get_output_details(), key=lambda d: int(d['name'].split(':')[-1]) if ':' in d['name'] else d['index'])
+        boxes = [d['index'] for d in details if len(d['shape']) == 3][0]
+        num = [d['index'] for d in details if len(d['shape']) == 1][0]
+        classes, scores = [d['index'] for d in details if len(d['shape']) == 2]
+        return boxes, classes, scores, num
+
+    def check_outputs(self):
+        # Without signature names: class ids are whole numbers and scores are not, swap the two 2D outputs
+        # if the guess was wrong. Outputs that cannot be told apart (e.g. all zero) keep the guess with a warning
+        classes, scores = self.interpreter.get_tensor(self.classes), self.interpreter.get_tensor(self.scores)
+        def whole(values):
+            return bool(np.all(values == np.round(values)))
+        if whole(classes) and not whole(scores):
+            return
+        if whole(scores) and not whole(classes):
+            self.classes, self.scores = self.scores, self.classes
+            return
+        print('Warning: TFLite model without signature, classes and scores outputs could not be checked (', self.model_file, ')')
+
+    def warm_up(self):
+        start = time.perf_counter()
+        self.interpreter.set_tensor(self.input['index'], self.to_input(np.zeros((self.input_size, self.input_size, 3), np.uint8)))
+        self.interpreter.invoke()
+        if not self.mapped:
+            self.check_outputs()
+        print('TFLite model loaded in ', round(time.perf_counter() - start, 2), 's')
+
+    def to_input(self, image):
+        image = np.expand_dims(resize_to_input(image, self.input_size), 0)
+        if self.input['dtype'] == np.float32:
+            return normalize_input(image)
+        scale, zero_point = self.input['quantization']          # Fully quantized input
+        return np.clip(np.round(normalize_input(image) / scale + zero_point), np.iinfo(self.input['dtype']).min,
+                       np.iinfo(self.input['dtype']).max).astype(self.input['dtype'])
+
+    def detect(self, image):
+        self.interpreter.set_tensor(self.input['index'], self.to_input(image))
+        start = time.perf_counter()
+        self.interpreter.invoke()
+        self.update_latency((time.perf_counter() - start) * 1000)
+        num_detections = int(self.interpreter.get_tensor(self.num)[0])
+        detections = {'detection_boxes': self.interpreter.get_tensor(self.boxes)[0, :num_detections],
+                      'detection_scores': self.interpreter.get_tensor(self.scores)[0, :num_detections],
+                      'detection_classes': self.interpreter.get_tensor(self.classes)[0, :num_detections].astype(np.int64),
+                      'num_detections': num_detections}
+        return detections
+
+    def detect_batch(self, images):
+        return [self.detect(image) for image in images]
+
+
+class EngineLoader(threading.Thread):
+    # Creates the inference engine in the background so the caller (the GUI) can show the camera preview
+    # while Tensorflow is imported and the model is loaded. engine is None until the model is ready
+    def __init__(self, backend='tf', threads=4, batch_size=1):
+        super().__init__(name='model loader', daemon=True)
+        self.backend = backend
+        self.threads = threads
+        self.batch_size = batch_size
+        self.engine = None
+        self.error = None                                       # Exception raised while loading, if any
+        self.started_at = time.perf_counter()
+        self.load_time = None                                   # Seconds from start() to engine ready
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        super().start()
+
+    def run(self):
+        try:
+            engine = create_engine(self.backend, self.threads, self.batch_size)
+        except Exception as error:
+            self.error = error
+            print('Model loading failed: ', error)
+            return
+        self.load_time = time.perf_counter() - self.started_at
+        self.engine = engine                                    # Published last, readers only check for None
+
+    def ready(self):
+        return self.engine is not None
+
+
+def interpreter_class():                                        # Lighter tflite_runtime if installed, else tf.lite
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+def model_key(pipeline_config, checkpoint, *params):
+    # Hash of the pipeline.config, the checkpoint files and the graph parameters, names the model cache folder
+    digest = hashlib.sha1(repr(params).encode())
+    for file in [pipeline_config] + sorted(glob.glob(checkpoint + '.*')):
+        with open(file, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+    return os.path.basename(checkpoint) + '_' + digest.hexdigest()[:16]
+
+
+def resize_to_input(image, input_size):                         # Resize any ROI crop to the fixed model input
+    if image.shape[0] != input_size or image.shape[1] != input_size:
+        image = cv2.resize(image, (input_size, input_size), interpolation=cv2.INTER_LINEAR)
+    return image.astype(np.uint8, copy=False)
+
+
+def normalize_input(image):                                     # SSD MobileNet preprocessing, [0, 255] to [-1, 1]
+    return image.astype(np.float32) * (2.0 / 255.0) - 1.0
+
+
+def create_engine(backend='tf', threads=4, batch_size=1):       # Returns the inference backend selected in the config file
+    if backend == 'tf':
+        return DetectionEngine(files['PIPELINE_CONFIG'], files['CHECKPOINT'], batch_size=batch_size)
+    if backend == 'tflite_fp16':
+        return TFLiteEngine(files['TFLITE_FP16'], threads)
+    if backend == 'tflite_int8':
+        return TFLiteEngine(files['TFLITE_INT8'], threads)
+    raise ValueError("Unknown inference backend", backend)
+
+
+def export_tflite(record_file=files['TEST_RECORD'], max_detections=MAX_DETECTIONS, samples=100):
+    # Exports the checkpoint to a TFLite compatible SavedModel (SSD post processing as a TFLite op)
+    # and converts it to a float16 and to an int8 quantized model in paths['TFLITE_PATH']. The int8
+    # model is calibrated with images from record_file.
+    import tensorflow as tf
+    from google.protobuf import text_format
+    from object_detection import export_tflite_graph_lib_tf2
+    from object_detection.protos import pipeline_pb2
+    from Record_Utils import read_record
+    pipeline = pipeline_pb2.TrainEvalPipelineConfig()
+    with tf.io.gfile.GFile(files['PIPELINE_CONFIG'], 'r') as f:
+        text_format.Parse(f.read(), pipeline)
+    export_tflite_graph_lib_tf2.export_tflite_model(pipeline, paths['CHECKPOINT_PATH'], paths['TFLITE_PATH'],
+                                                    max_detections, False)
+    saved_model = os.path.join(paths['TFLITE_PATH'], 'saved_model')
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    with open(files['TFLITE_FP16'], 'wb') as f:
+        f.write(converter.convert())
+    print('Saved ', files['TFLITE_FP16'])
+
+    def representative_dataset():                               # Calibration images for the int8 ranges
+        for _, image, _ in read_record(record_file, limit=samples):
+            yield [normalize_input(np.expand_dims(resize_to_input(image, MODEL_INPUT_SIZE), 0))]
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8, tf.lite.OpsSet.TFLITE_BUILTINS]
+    with open(files['TFLITE_INT8'], 'wb') as f:
+        f.write(converter.convert())
+    print('Saved ', files['TFLITE_INT8'])
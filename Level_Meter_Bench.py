@@ -0,0 +1,546 @@
+# LEVEL METER benchmarks
+# Micro-benchmarks of the level meter stages on real data.
+#
+#   python Level_Meter_Bench.py edge        Lower edge detection on the labelled boxes of annotations/test.record,
+#                                           the original per-pixel loop against the vectorised EdgeDetector modes
+#   python Level_Meter_Bench.py gating      Motion gated detection against detecting every frame on a recording,
+#                                           detector invocation ratio and difference of the readings
+#   python Level_Meter_Bench.py soak --hours 4
+#                                           Replays a recording in a loop through the full capture, detection and
+#                                           render path, samples RSS and latency and fails if memory keeps growing
+#   python Level_Meter_Bench.py startup [--cold]
+#                                           Time to first frame and to first reading with the background model
+#                                           loader, --cold deletes the SavedModel cache first
+#   python Level_Meter_Bench.py stages [--save baseline.json] [--compare baseline.json]
+#                                           Every stage on its own (capture, crop, inference, post processing,
+#                                           volume, render) and the full loop on the demo recording and the
+#                                           test.record images. p50/p99 latency, throughput and peak memory,
+#                                           saved as a JSON baseline and compared against a previous one
+#   python Level_Meter_Bench.py link        OutputLink against a local stub server that is stopped and restarted,
+#                                           checks the buffering, drop-oldest and reconnect counters
+#   python Level_Meter_Bench.py autoroi     Manual ROI against the auto ROI window on the demo recording and the
+#                                           synthetic source, pixels per inference and model input resolution, and
+#                                           detection score and rate when an inference backend is installed
+
+import time
+START = time.perf_counter()                                     # Process start, for the startup benchmark
+
+import argparse
+import os
+import cv2
+import numpy as np
+from Edge_Utils import *
+from Meniscus_Utils import box_detail
+from Paths import *
+
+
+def legacy_lower_edge(img, y, index):
+    # detect_lower_edge as it was in Meniscus_Utils before Edge_Utils, kept as the benchmark reference
+    POINTS_TO_AVERAGE = 5
+    center = int(img.shape[1]/2) - int(POINTS_TO_AVERAGE/2)
+    delta = [0] * POINTS_TO_AVERAGE
+    for j in range(POINTS_TO_AVERAGE):
+        center = center + j
+        center_array = img[:, center:center + 1].flatten()
+        for index, value in enumerate(center_array):
+            if value == 255:
+                delta[j] = index
+    avg_delta = int(sum(delta)/POINTS_TO_AVERAGE)
+    return y + avg_delta
+
+
+def box_crops(record_file, limit=None):
+    # Binary and grayscale crops of every labelled box, processed the same way as meniscus_draw
+    from Record_Utils import read_record
+    crops = []
+    for _, image, boxes in read_record(record_file, limit):
+        for ymin, xmin, ymax, xmax in boxes:
+            ymin, ymax = int(ymin * image.shape[0]), int(ymax * image.shape[0])
+            xmin, xmax = int(xmin * image.shape[1]), int(xmax * image.shape[1])
+            if ymax - ymin < 3 or xmax - xmin < 7:
+                continue
+            crops.append(box_detail(image, ymin, ymax, xmin, xmax))
+    return crops
+
+
+def time_calls(function, crops, repeat):                        # Median time per call in microseconds
+    times = []
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [function(detail, gray) for detail, gray in crops]
+        times.append((time.perf_counter() - start) / len(crops) * 1e6)
+    return float(np.median(times)), np.array(results, dtype=np.float64)
+
+
+def bench_edge(args):
+    crops = box_crops(args.record, args.limit)
+    print('Bounding box crops: ', len(crops))
+    legacy_time, legacy = time_calls(lambda detail, gray: legacy_lower_edge(detail, 0, 0), crops, args.repeat)
+    print('%-28s %10s %14s' % ('method', 'us/call', 'mean |diff| px'))
+    print('%-28s %10.1f %14s' % ('legacy loop', legacy_time, '-'))
+    for mode in EDGE_MODES:
+        for method in EDGE_AGGREGATES:
+            detector = EdgeDetector(mode, args.band, method)
+            elapsed, edges = time_calls(lambda detail, gray: detector.detect(detail, 0, gray), crops, args.repeat)
+            print('%-28s %10.1f %14.2f' % (mode + '/' + method, elapsed, np.mean(np.abs(edges - legacy))))
+
+
+def video_frames(video, roi, limit=None):                       # Rotated and cropped RGB frames of a recording with their time
+    from Pipeline_Utils import crop_frame
+    from Source_Utils import open_source
+    vid = open_source(video)
+    if roi is None:
+        roi = (0, vid.height, 0, vid.width)
+    frames = []
+    while limit is None or len(frames) < limit:
+        ret, frame = vid.get_frame()
+        if not ret:
+            break
+        frames.append((vid.position(), crop_frame(frame, roi)))
+    return frames
+
+
+def bench_gating(args):
+    from Level_Meter_CLI import load_config
+    from Inference_Utils import create_engine
+    from Pipeline_Utils import FramePacket, create_edge, create_marks, process_frame
+    from Tracking_Utils import DetectionScheduler
+    cfg = load_config(args.config)
+    engine = create_engine(cfg.backend, cfg.threads)
+    frames = video_frames(args.video, None, args.limit)
+    marks, edge = create_marks(cfg), create_edge(cfg)
+    clock_time = [0.0]
+    scheduler = DetectionScheduler(engine.detect, motion_threshold=cfg.gating_motion, max_age=cfg.gating_max_age,
+                                   clock=lambda: clock_time[0])
+    results = {}
+    for name, detect in (('always', engine.detect), ('gated', scheduler)):
+        positions = []
+        start = time.perf_counter()
+        for t, frame in frames:
+            clock_time[0] = t
+            packet = process_frame(detect, FramePacket(frame, None), marks, edge=edge)
+            positions.append(sorted(y for y in packet.meniscus.yposition if y != 0))
+        results[name] = (positions, time.perf_counter() - start)
+    diffs = [abs(a - b) for always, gated in zip(results['always'][0], results['gated'][0])
+             if len(always) == len(gated) for a, b in zip(always, gated)]
+    mismatched = sum(len(a) != len(b) for a, b in zip(results['always'][0], results['gated'][0]))
+    print('Frames: ', len(frames))
+    print('Detector invocation ratio: ', round(scheduler.invocation_ratio(), 3), scheduler.reasons)
+    print('Time always / gated (s): ', round(results['always'][1], 2), '/', round(results['gated'][1], 2))
+    if diffs:
+        print('Lower edge difference (px) mean / max: ', round(float(np.mean(diffs)), 2), '/', round(float(np.max(diffs)), 2))
+    print('Frames with a different number of meniscus: ', mismatched)
+
+
+def bench_soak(args):
+    # Runs crop, detection, post processing and rendering on a looped recording for args.hours and prints one
+    # line per args.interval seconds with RSS and latency percentiles. RSS growth is the slope of a line fitted
+    # to the samples after the first 10% (warm up), the run fails when it is above args.max_growth MB/hour.
+    # --gui shows the frames on a Tk canvas through CanvasImage, like the GUI does
+    from PIL import Image
+    from Level_Meter_CLI import load_config
+    from Metrics_Utils import rss_mb
+    from Inference_Utils import create_engine
+    from Pipeline_Utils import FramePacket, create_edge, create_marks, crop_frame, process_frame, render_packet
+    from Source_Utils import open_source
+    cfg = load_config(args.config)
+    engine = create_engine(cfg.backend, cfg.threads)
+    marks, edge = create_marks(cfg), create_edge(cfg)
+    vid = open_source(args.video, loop=True)                    # Recording replayed in a loop, or synthetic frames
+    width, height = vid.width, vid.height
+    roi = (0, height, 0, width)
+    size = (int(height * cfg.canvas_height / width), cfg.canvas_height)
+    if args.gui:
+        import tkinter as tk
+        from GUI_Utils import CanvasImage
+        window = tk.Tk()
+        canvas = tk.Canvas(window, width=size[0], height=size[1])
+        canvas.pack()
+        view = CanvasImage(canvas)
+        show = lambda img: (view.show(img, 0, 0), window.update())
+    else:
+        shown = Image.new('RGB', size)                          # Headless stand in of the persistent canvas image
+        show = lambda img: shown.paste(Image.fromarray(img))
+    samples, latencies = [], []
+    frames = 0
+    start = time.monotonic()
+    next_sample = start
+    while time.monotonic() - start < args.hours * 3600:
+        ret, frame = vid.get_frame()
+        if not ret:
+            break
+        packet = FramePacket(None, roi)
+        packet.frame = crop_frame(frame, roi)
+        process_frame(engine.detect, packet, marks, edge=edge)
+        show(render_packet(packet, marks, size, cfg.line_width, cfg.font_size))
+        packet.stamp('render')
+        latencies.append(packet.latency_ms('render'))
+        frames += 1
+        now = time.monotonic()
+        if now >= next_sample:
+            samples.append(((now - start) / 3600, rss_mb()))
+            if latencies:
+                print('%8.3f h %8d frames  RSS %8.1f MB  latency p50 %6.1f ms  p99 %6.1f ms' %
+                      (samples[-1][0], frames, samples[-1][1], np.percentile(latencies, 50), np.percentile(latencies, 99)))
+            latencies = []
+            next_sample = now + args.interval
+    samples.append(((time.monotonic() - start) / 3600, rss_mb()))
+    steady = np.array(samples[len(samples) // 10:])
+    growth = np.polyfit(steady[:, 0], steady[:, 1], 1)[0] if len(steady) >= 3 and np.ptp(steady[:, 0]) > 0 else 0.0
+    print('Frames: ', frames, ' RSS first / last / max (MB): ', round(samples[0][1], 1), '/', round(samples[-1][1], 1), '/',
+          round(max(rss for _, rss in samples), 1))
+    print('RSS growth after warm up: ', round(growth, 2), 'MB/hour (limit ', args.max_growth, ')')
+    if growth > args.max_growth:
+        raise SystemExit('Memory keeps growing during the soak test')
+
+
+def bench_startup(args):
+    # Starts the capture and inference threads like the GUI does, with the model loading in the background,
+    # and reports the seconds from process start to the first frame and to the first reading
+    import shutil
+    from Level_Meter_CLI import load_config
+    from Inference_Utils import EngineLoader
+    from Pipeline_Utils import CaptureThread, InferenceWorker, LatestQueue, create_edge, create_marks
+    cfg = load_config(args.config)
+    if args.cold:
+        shutil.rmtree(paths['MODEL_CACHE_PATH'], ignore_errors=True)
+    cached = os.path.isdir(paths['MODEL_CACHE_PATH']) and len(os.listdir(paths['MODEL_CACHE_PATH'])) > 0
+    loader = EngineLoader(cfg.backend, cfg.threads)
+    loader.start()
+    from Source_Utils import open_source
+    vid = open_source(args.source, list(map(int, str(cfg.resolution).split('x'))), cfg.camera_fourcc, cfg.camera_buffer,
+                      realtime=True)
+    frames, results = LatestQueue(), LatestQueue()
+    capture = CaptureThread(vid, frames, lambda: (0, vid.height, 0, vid.width))
+    worker = InferenceWorker(lambda image: loader.engine.detect(image), frames, results, create_marks(cfg),
+                             edge=create_edge(cfg), ready=loader.ready)
+    capture.start()
+    worker.start()
+    first_frame = first_reading = None
+    while first_reading is None and time.perf_counter() - START < args.timeout:
+        if loader.error is not None and first_frame is not None:        # No reading will ever come
+            break
+        packet = results.get_nowait()
+        if packet is None:
+            time.sleep(0.005)
+            continue
+        if first_frame is None:
+            first_frame = time.perf_counter() - START
+        if not packet.loading:
+            first_reading = time.perf_counter() - START
+    capture.stop()
+    worker.stop()
+    capture.join(1.0)                                           # Threads must leave cv2 before the interpreter exits
+    worker.join(1.0)
+    print('Backend: ', cfg.backend, ' SavedModel cache: ', 'hit' if cached else 'miss')
+    print('Time to first frame (s):   ', round(first_frame, 2) if first_frame is not None else '-')
+    print('Time to first reading (s): ', round(first_reading, 2) if first_reading is not None else '-')
+    if loader.load_time is not None:
+        print('Model loaded in (s):       ', round(loader.load_time, 2))
+    if loader.error is not None:
+        print('Model loading failed: ', loader.error)
+
+
+def bench_stages(args):
+    from Bench_Utils import StageResult, compare, load_results, print_comparison, print_results, run_stage, save_results
+    from Camera_Utils import percent_roi
+    from Level_Meter_CLI import load_config
+    from Meniscus_Utils import Meniscus, calculate_volumes, meniscus_draw
+    from Pipeline_Utils import FramePacket, create_edge, create_marks, create_undistort, crop_frame, pass_through, process_detections, render_packet
+    from Source_Utils import open_source
+    cfg = load_config(args.config)
+    results = []
+
+    vid = open_source(args.video, loop=True)                    # Capture: grab, decode and RGB conversion
+    count = args.frames or (int(vid.vid.get(cv2.CAP_PROP_FRAME_COUNT)) if vid.vid is not None else 300)   # Synthetic has no count
+    results.append(run_stage('capture', lambda _: vid.get_frame(), list(range(count)), warm_up=0))
+    vid = open_source(args.video)
+    frames = []
+    while len(frames) < count:
+        ret, frame = vid.get_frame()
+        if not ret:
+            break
+        frames.append(frame.copy())                             # Sources reuse their buffer
+    height, width = frames[0].shape[:2]
+    roi = percent_roi(height, width, cfg.roi_percent_x, cfg.roi_percent_y)
+    undistort = create_undistort(cfg)
+    results.append(run_stage('crop', lambda frame: crop_frame(frame, roi, undistort), frames, args.repeat))
+    crops = [crop_frame(frame, roi, undistort) for frame in frames]
+
+    marks, edge = create_marks(cfg), create_edge(cfg)
+    roi_height = roi[3] - roi[2]
+    if len(marks.yposition) < 2:                                # Volumes need marks, use a scale over the whole ROI
+        marks.yposition, marks.capacity = [int(roi_height * 0.1), int(roi_height * 0.9)], [10.0, 0.0]
+    engine = None
+    try:
+        from Inference_Utils import create_engine
+        engine = create_engine(cfg.backend, cfg.threads)
+    except (ImportError, ValueError) as error:
+        print('Inference stages skipped: ', error)
+    if engine is not None:
+        results.append(run_stage('inference', engine.detect, crops, args.repeat))
+        detections = [engine.detect(crop) for crop in crops]
+        inputs = list(zip(crops, detections))
+        results.append(run_stage('post', lambda item: process_detections(FramePacket(item[0], roi), item[1], marks, edge=edge),
+                                 inputs, args.repeat))
+        packets = [process_detections(FramePacket(crop, roi), detection, marks, edge=edge) for crop, detection in inputs]
+    else:
+        results.append(StageResult('inference', [], 0.0))
+        results.append(StageResult('post', [], 0.0))
+        packets = [pass_through(FramePacket(crop, roi)) for crop in crops]
+
+    levels = np.linspace(roi_height * 0.05, roi_height * 0.95, len(packets) * 2).reshape(-1, 2)
+    meniscus_list = []                                          # Same positions for every run, two interfaces each
+    for top, bottom in levels:
+        meniscus = Meniscus()
+        meniscus.yposition = [float(top), float(bottom)]
+        meniscus_list.append(meniscus)
+    results.append(run_stage('volume', lambda meniscus: calculate_volumes(meniscus, marks, roi_height), meniscus_list, args.repeat))
+
+    size = (int((roi[1] - roi[0]) * cfg.canvas_height / roi_height), cfg.canvas_height)
+    results.append(run_stage('render', lambda packet: render_packet(packet, marks, size, cfg.line_width, cfg.font_size),
+                             packets, args.repeat))
+
+    try:                                                        # Labelled test images, post processing on the true boxes
+        from Record_Utils import read_record
+        record = [(image, boxes) for _, image, boxes in read_record(args.record, args.record_limit)]
+    except (ImportError, OSError) as error:
+        record = []
+        print('test.record stages skipped: ', error)
+    if record:
+        scores = np.ones(2, np.float32)
+        results.append(run_stage('post_record', lambda item: meniscus_draw(item[0], item[1][:2], scores[:len(item[1][:2])], marks,
+                                                                         max_boxes=2, min_score_thresh=0.5, edge=edge),
+                                 record, args.repeat))
+        if engine is not None:
+            results.append(run_stage('inf_record', lambda item: engine.detect(item[0]), record, args.repeat))
+
+    if engine is not None:                                      # Full loop, one frame at a time like the CLI
+        loop_vid = open_source(args.video, loop=True)
+
+        def full_loop(_):
+            ret, frame = loop_vid.get_frame()
+            packet = FramePacket(crop_frame(frame, roi, undistort), roi)
+            process_detections(packet, engine.detect(packet.frame), marks, edge=edge)
+            return render_packet(packet, marks, size, cfg.line_width, cfg.font_size)
+        results.append(run_stage('e2e', full_loop, list(range(count)), warm_up=2))
+    else:
+        results.append(StageResult('e2e', [], 0.0))
+
+    print('Frames: ', len(frames), ' ROI: ', roi, ' backend: ', cfg.backend)
+    print_results(results)
+    e2e = results[-1].summary()
+    if e2e['samples']:
+        print('End to end: ', e2e['throughput'], 'fps')
+    info = {'video': args.video, 'frames': len(frames), 'roi': roi, 'backend': cfg.backend, 'record_images': len(record)}
+    if args.save:
+        save_results(args.save, results, info)
+        print('Saved ', args.save)
+    if args.compare:
+        rows, regressions = compare(results, load_results(args.compare), args.tolerance, args.min_ms)
+        print_comparison(rows)
+        if regressions:
+            raise SystemExit(str(regressions) + ' regressions against ' + args.compare)
+
+
+class StubServer:                                               # Local stand in of the Labview reading consumer
+    def __init__(self, port=0):
+        import socket
+        import threading
+        self.lines = []
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', port))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.clients = []
+        threading.Thread(target=self.serve, daemon=True).start()
+
+    def serve(self):
+        data = b''
+        try:
+            client, _ = self.listener.accept()
+        except OSError:                                         # Stopped before the link connected
+            return
+        self.clients.append(client)
+        while True:
+            try:
+                chunk = client.recv(4096)
+            except OSError:
+                return
+            if not chunk:
+                return
+            data += chunk
+            *lines, data = data.split(b'\r\n')
+            self.lines += [line.decode() for line in lines]
+
+    def stop(self):                                             # Closes the listener and the connection, like a crash
+        import socket
+        for sock in self.clients + [self.listener]:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)                 # close() alone does not wake the blocked recv
+            except OSError:
+                pass
+            sock.close()
+
+
+def bench_link(args):
+    # Sends readings through an OutputLink while a stub server is running, stopped and started again on the
+    # same port. The link must buffer while the server is down, drop the oldest readings over args.buffer,
+    # reconnect once and deliver the newest readings in order. Exits with an error if a check fails
+    from Output_Utils import OutputLink
+
+    def wait(condition, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    checks = []
+    server = StubServer()
+    link = OutputLink('127.0.0.1', server.port, max_buffer=args.buffer, min_backoff=0.05, max_backoff=0.2)
+    link.start()
+    checks.append(('connected', wait(lambda: link.connected)))
+    for index in range(args.readings):                          # One at a time, a burst would overflow the small buffer
+        link.send_readings([index, 0.0])
+        wait(lambda: len(server.lines) > index, 1.0)
+    checks.append(('readings delivered while connected', server.lines == ['%d,0.0' % index for index in range(args.readings)]))
+    checks.append(('no reconnect before the server stops', link.reconnects == 0 and link.dropped == 0))
+    server.stop()
+    checks.append(('peer close detected', wait(lambda: not link.connected)))
+    for index in range(args.readings, args.readings + args.outage):
+        link.send_readings([index, 0.0])
+    dropped = max(0, args.outage - args.buffer)
+    checks.append(('oldest readings dropped over the buffer', link.dropped == dropped and len(link.buffer) == args.outage - dropped))
+    failures = link.connect_failures
+    time.sleep(0.5)
+    checks.append(('reconnect attempts while down', link.connect_failures > failures))
+    restarted = StubServer(server.port)
+    checks.append(('reconnected once', wait(lambda: link.reconnects == 1 and link.connected)))
+    expected = ['%d,0.0' % index for index in range(args.readings + dropped, args.readings + args.outage)]
+    checks.append(('newest readings delivered in order', wait(lambda: restarted.lines == expected)))
+    link.close()
+    restarted.stop()
+    print('Stats: ', link.stats())
+    for name, ok in checks:
+        print('PASS' if ok else 'FAIL', ' ', name)
+    if not all(ok for _, ok in checks):
+        raise SystemExit('OutputLink check failed')
+
+
+def bench_autoroi(args):
+    from Camera_Utils import percent_roi
+    from Level_Meter_CLI import load_config
+    from Locate_Utils import TubeLocator
+    from Pipeline_Utils import FramePacket, create_edge, create_marks, create_undistort, locate_frame, process_frame
+    from Source_Utils import open_source
+    cfg = load_config(args.config)
+    undistort = create_undistort(cfg)
+    marks, edge = create_marks(cfg), create_edge(cfg)
+    engine = None
+    try:
+        from Inference_Utils import create_engine
+        engine = create_engine(cfg.backend, cfg.threads)
+    except (ImportError, ValueError) as error:
+        print('Detection comparison skipped: ', error)
+    for source in args.source:
+        vid = open_source(source)
+        clock_time = [0.0]
+        locator = TubeLocator(cfg.auto_roi_aspect, period=cfg.auto_roi_period, clock=lambda: clock_time[0])
+        stats = {'manual': [], 'auto': []}                      # (pixels, input px per ROI px, top score, found)
+        search_time = []
+        roi = None
+        while len(stats['auto']) < args.limit:
+            ret, frame = vid.get_frame()
+            if not ret:
+                break
+            if roi is None:
+                height, width = frame.shape[:2]
+                roi = percent_roi(height, width, cfg.roi_percent_x, cfg.roi_percent_y)
+            clock_time[0] = vid.position() if vid.is_file else time.monotonic()
+            due = locator.due(roi)
+            start = time.perf_counter()
+            auto_roi, auto_crop = locate_frame(frame, roi, undistort, locator)
+            if due:
+                search_time.append(time.perf_counter() - start)
+            for name, (used_roi, crop) in (('manual', locate_frame(frame, roi, undistort)), ('auto', (auto_roi, auto_crop))):
+                score, found = 0.0, False
+                if engine is not None:
+                    packet = process_frame(engine.detect, FramePacket(crop, used_roi), marks, edge=edge)
+                    score, found = float(max(packet.meniscus.score)), any(packet.meniscus.yposition)
+                    if name == 'auto':
+                        locator.observe(packet)
+                stats[name].append((crop.shape[0] * crop.shape[1], 320 / crop.shape[1], score, found))
+        if not stats['auto']:
+            print(source, ': no frames')
+            continue
+        manual, auto = np.array(stats['manual']), np.array(stats['auto'])
+        print(source, ': ', len(auto), ' frames, ROI ', roi, ', window ', locator.crop_roi(roi), ', ', locator.searches,
+              ' searches of ', round(float(np.median(search_time)) * 1000, 1), ' ms', sep='')
+        print('  Pixels per inference manual / auto: ', int(manual[:, 0].mean()), '/', int(auto[:, 0].mean()),
+              ' (', round((1 - auto[:, 0].mean() / manual[:, 0].mean()) * 100, 1), '% fewer)', sep='')
+        print('  Model input px per ROI px, horizontal: ', round(float(manual[:, 1].mean()), 3), '/',
+              round(float(auto[:, 1].mean()), 3))
+        if engine is not None:
+            print('  Mean top score manual / auto: ', round(float(manual[:, 2].mean()), 3), '/', round(float(auto[:, 2].mean()), 3))
+            print('  Detection rate manual / auto: ', round(float(manual[:, 3].mean()), 3), '/', round(float(auto[:, 3].mean()), 3))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Level meter benchmarks')
+    sub = parser.add_subparsers(dest='stage', required=True)
+    edge = sub.add_parser('edge', help='lower edge detection micro-benchmark')
+    edge.add_argument('--record', default=files['TEST_RECORD'])
+    edge.add_argument('--limit', type=int, default=None, help='max images read from the record')
+    edge.add_argument('--band', type=int, default=5, help='columns evaluated by EdgeDetector')
+    edge.add_argument('--repeat', type=int, default=5)
+    edge.set_defaults(run=bench_edge)
+    gating = sub.add_parser('gating', help='motion gated detection against always detect')
+    gating.add_argument('--video', default=os.path.join('demos', 'test_tube_reading_3.mp4'))
+    gating.add_argument('--config', default='Level_Meter.cfg')
+    gating.add_argument('--limit', type=int, default=None, help='max frames read from the video')
+    gating.set_defaults(run=bench_gating)
+    soak = sub.add_parser('soak', help='memory and latency over hours of replay')
+    soak.add_argument('--video', default=os.path.join('demos', 'test_tube_reading_3.mp4'))
+    soak.add_argument('--config', default='Level_Meter.cfg')
+    soak.add_argument('--hours', type=float, default=2.0)
+    soak.add_argument('--interval', type=float, default=60.0, help='seconds between RSS and latency samples')
+    soak.add_argument('--max-growth', type=float, default=5.0, help='max RSS growth in MB/hour')
+    soak.add_argument('--gui', action='store_true', help='show the frames on a Tk canvas')
+    soak.set_defaults(run=bench_soak)
+    startup = sub.add_parser('startup', help='time to first frame and first reading')
+    startup.add_argument('--source', default=os.path.join('demos', 'test_tube_reading_3.mp4'), help='camera index, video file or synthetic')
+    startup.add_argument('--config', default='Level_Meter.cfg')
+    startup.add_argument('--cold', action='store_true', help='delete the SavedModel cache before starting')
+    startup.add_argument('--timeout', type=float, default=300.0)
+    startup.set_defaults(run=bench_startup)
+    stages = sub.add_parser('stages', help='latency, throughput and memory of every stage against a baseline')
+    stages.add_argument('--video', default=os.path.join('demos', 'test_tube_reading_3.mp4'))
+    stages.add_argument('--record', default=files['TEST_RECORD'])
+    stages.add_argument('--record-limit', type=int, default=None, help='max images read from the record')
+    stages.add_argument('--config', default='Level_Meter.cfg')
+    stages.add_argument('--frames', type=int, default=0, help='frames of the video used (0 = all)')
+    stages.add_argument('--repeat', type=int, default=3, help='passes over the frames of every stage')
+    stages.add_argument('--save', help='write the results to this JSON baseline')
+    stages.add_argument('--compare', help='compare against this JSON baseline, exit with an error on regressions')
+    stages.add_argument('--tolerance', type=float, default=0.25, help='allowed change before a regression is flagged')
+    stages.add_argument('--min-ms', type=float, default=0.05, help='smaller latency changes are never regressions (timer noise)')
+    stages.set_defaults(run=bench_stages)
+    link = sub.add_parser('link', help='OutputLink buffering and reconnects against a local stub server')
+    link.add_argument('--readings', type=int, default=10, help='readings sent while the server is up')
+    link.add_argument('--outage', type=int, default=20, help='readings sent while the server is down')
+    link.add_argument('--buffer', type=int, default=5, help='max readings buffered by the link')
+    link.set_defaults(run=bench_link)
+    autoroi = sub.add_parser('autoroi', help='manual ROI against the auto ROI window')
+    autoroi.add_argument('--source', nargs='+', default=[os.path.join('demos', 'test_tube_reading_3.mp4'), 'synthetic'],
+                         help='video files, camera indexes or synthetic')
+    autoroi.add_argument('--config', default='Level_Meter.cfg')
+    autoroi.add_argument('--limit', type=int, default=300, help='max frames read from each source')
+    autoroi.set_defaults(run=bench_autoroi)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    arguments.run(arguments)
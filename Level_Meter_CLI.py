@@ -0,0 +1,191 @@
+# LEVEL METER command line runner
+# Runs the level meter without a GUI on a USB camera, a recorded video file or a generated tube ("synthetic",
+# no camera needed). Marks, ROI and tube volumes
+# are taken from the config file (see README.md), readings are written to stdout and optionally to a CSV
+# file, to a record folder (see Store_Utils.ReadingStore to read it back), to the Labview socket and to
+# Modbus/TCP pollers.
+# Video files are processed as fast as the inference backend allows (--realtime plays them at their frame
+# rate like a camera), the achieved throughput is reported at the end of the run.
+#
+# Examples:
+#   python Level_Meter_CLI.py 0
+#   python Level_Meter_CLI.py demos/test_tube_reading_3.mp4 --csv readings.csv --quiet
+#   python Level_Meter_CLI.py synthetic:1280x720 --realtime --max-frames 600
+#   python Level_Meter_CLI.py 0 --record runs/separation_48h --quiet
+#   python Level_Meter_CLI.py long_test.mp4 --offline --every 1 --workers 4 --batch 8 --csv readings.csv
+
+import argparse
+import csv
+import time
+from Camera_Utils import *
+from File_Utils import *
+from Inference_Utils import *
+from Metrics_Utils import *
+from Offline_Utils import analyse_video
+from Output_Utils import *
+from Pipeline_Utils import *
+from Source_Utils import *
+from Store_Utils import ReadingRecorder
+
+CONFIG_FILE = "Level_Meter.cfg"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Headless level meter for cameras and recorded videos')
+    parser.add_argument('source', help='camera index, video file or synthetic[:WIDTHxHEIGHT]')
+    parser.add_argument('--config', default=CONFIG_FILE, help='config file with marks, ROI and tube volumes')
+    parser.add_argument('--csv', help='write readings to this CSV file')
+    parser.add_argument('--record', help='record readings to this folder (default Record_Folder of the config)')
+    parser.add_argument('--socket', action='store_true', help='send readings to Output_Host:Output_Port')
+    parser.add_argument('--quiet', action='store_true', help='do not print every reading on stdout (Print_Readings=0)')
+    parser.add_argument('--offline', action='store_true', help='analyse a video file in a pool of worker processes')
+    parser.add_argument('--workers', type=int, default=0, help='offline worker processes (0 = one per core)')
+    parser.add_argument('--batch', type=int, default=8, help='offline frames per detector call')
+    parser.add_argument('--every', type=float, default=0.0, help='offline seconds of video between analysed frames (0 = all)')
+    parser.add_argument('--realtime', action='store_true', help='play files and synthetic frames at their frame rate')
+    parser.add_argument('--loop', action='store_true', help='restart the video file at the end')
+    parser.add_argument('--max-frames', type=int, default=0, help='stop after this many frames (0 = no limit)')
+    return parser.parse_args()
+
+
+def load_config(file):
+    cfg = ConfigParams(0, '1920x1080', 200, 6, 400, 670, 1, 1)  # Same defaults as Level_Meter_GUI.py
+    return get_config(file, cfg)
+
+
+def run(args):
+    cfg = load_config(args.config)
+    vid = open_source(args.source, list(map(int, str(cfg.resolution).split('x'))), cfg.camera_fourcc, cfg.camera_buffer,
+                      args.realtime, args.loop)
+    tubes = create_tubes(cfg, (vid.height, vid.width))          # Several tubes in one frame, detected in one batch
+    engine = create_engine(cfg.backend, cfg.threads, batch_size=max(1, len(tubes)))
+    if tubes:
+        roi = (0, vid.height, 0, vid.width)                     # Whole rotated frame, tubes have their own ROI
+    else:
+        roi = percent_roi(vid.height, vid.width, cfg.roi_percent_x, cfg.roi_percent_y)    # Frames are rotated 90 degrees
+    marks = create_marks(cfg)
+    edge = create_edge(cfg)
+    undistort = create_undistort(cfg)                           # None unless Calibration_File is set
+    locator = create_locator(cfg, tubes)                        # None unless Auto_ROI=1
+    clock = vid.position if vid.is_file else time.monotonic     # Gating max age in video time for recordings
+    detect, scheduler = create_detect(engine.detect, cfg, clock)  # Motion gated detection when Gating=1 (single ROI)
+    links = {}                                                  # Output link per channel (TCP port)
+    if args.socket:
+        channels = [tube.channel for tube in tubes if tube.channel] if tubes else [cfg.output_port]
+        links = {channel: OutputLink(cfg.output_host, channel, batch=cfg.output_batch) for channel in channels}
+    for link in links.values():
+        link.start()
+    record_folder = args.record or cfg.record_folder
+    recorder = ReadingRecorder(record_folder, [tube.name for tube in tubes] or ['']) if record_folder else None
+    if recorder is not None:
+        recorder.start()
+    quiet = args.quiet or not cfg.print_readings
+    archiver = create_archiver(cfg, marks)                      # None without Archive_Folder
+    modbus = create_modbus(cfg, marks, tubes)                   # None without Modbus_Port
+    if modbus is not None:
+        modbus.start()
+    registry = Registry()
+    register_pipeline(registry, scheduler=scheduler, engine=lambda: engine, links=links, recorder=recorder,
+                      archiver=archiver, modbus=modbus, locator=locator)
+    registry.counter('level_meter_frames_processed_total', 'Frames through detection and post processing', lambda: frames)
+    metrics = MetricsServer(registry, cfg.metrics_host, cfg.metrics_port) if cfg.metrics_port else None
+    if metrics is not None:
+        metrics.start()
+    csv_file = open(args.csv, 'w', newline='') if args.csv else None
+    writer = csv.writer(csv_file) if csv_file else None
+    if writer:
+        writer.writerow(['frame', 'time', 'tube', 'intf1', 'intf2'])
+
+    frames = 0
+    start = time.perf_counter()
+    try:
+        while args.max_frames == 0 or frames < args.max_frames:
+            ret, frame = vid.get_frame()
+            if not ret:
+                if vid.is_file:                                 # End of the recording
+                    break
+                continue
+            packet = FramePacket(None, roi)
+            if vid.is_file:
+                packet.t_capture = vid.position()               # Tag file readings with the video time
+            packet.roi, packet.frame = locate_frame(frame, roi, undistort, locator)
+            packet.stamp('crop')
+            if tubes:
+                process_tubes(engine.detect_batch, packet, tubes, edge=edge)
+                results = [(tube.name, tube.channel, readings) for tube, _, readings in packet.tube_results]
+            else:
+                process_frame(detect, packet, marks, edge=edge)
+                results = [('', cfg.output_port, packet.readings)]
+            frames += 1
+            registry.observe_packet(packet)
+            if recorder is not None:
+                recorder.add_packet(packet)
+            if archiver is not None:
+                archiver.consider(packet)
+            if modbus is not None:
+                modbus.update(packet)
+            if locator is not None:
+                locator.observe(packet)
+            for name, channel, readings in results:
+                if not quiet:
+                    print('Readings' + (' ' + name if name else '') + ': ', readings, ' Time: ', round(packet.t_capture, 3))
+                if writer:
+                    writer.writerow([frames, round(packet.t_capture, 3), name, readings[0], readings[1]])
+                if channel in links:
+                    links[channel].send_readings(readings)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.perf_counter() - start
+    if csv_file:
+        csv_file.close()
+    for link in links.values():
+        link.close()
+    if recorder is not None:
+        recorder.close()
+        print('Recorded ', recorder.written, ' readings to ', record_folder)
+    if archiver is not None:
+        archiver.close()
+        print('Archived ', archiver.archived, ' frames (', archiver.skipped, ' skipped, ', archiver.failed, ' failed) to ', cfg.archive_folder)
+    if modbus is not None:
+        modbus.close()
+    if metrics is not None:
+        metrics.close()
+    print('Processed ', frames, ' frames in ', round(elapsed, 2), 's (', round(frames / elapsed, 2) if elapsed else 0,
+          'fps, inference ', round(engine.avg_latency_ms, 1), 'ms)')
+    if scheduler is not None:
+        print('Detector invocation ratio: ', round(scheduler.invocation_ratio(), 3), scheduler.reasons)
+    if locator is not None:
+        print('Auto ROI window ', locator.crop_roi(roi), ' of ROI ', roi, ', ', round(locator.pixels_saved() * 100, 1),
+              '% fewer pixels per inference, ', locator.searches, ' searches')
+
+
+def run_offline(args):
+    cfg = load_config(args.config)
+    vid = open_source(args.source)
+    if not isinstance(vid, FileSource):
+        raise ValueError("Offline analysis needs a video file", args.source)
+    roi = percent_roi(vid.height, vid.width, cfg.roi_percent_x, cfg.roi_percent_y)
+    del vid
+    start = time.perf_counter()
+    rows = analyse_video(args.source, roi, create_marks(cfg), edge=create_edge(cfg), calibration=cfg.calibration_file,
+                         backend=cfg.backend, workers=args.workers or None,
+                         batch_size=args.batch, every=args.every,
+                         on_progress=None if args.quiet else lambda done, total: print('Ranges done: ', done, '/', total))
+    elapsed = time.perf_counter() - start
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'time', 'intf1', 'intf2', 'ypos1', 'ypos2', 'score1', 'score2'])
+            writer.writerows(rows)
+    elif not args.quiet:
+        for row in rows:
+            print('Readings: ', row[2:4], ' Time: ', row[1])
+    print('Analysed ', len(rows), ' frames in ', round(elapsed, 2), 's (', round(len(rows) / elapsed, 2) if elapsed else 0, 'fps)')
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    if arguments.offline:
+        run_offline(arguments)
+    else:
+        run(arguments)
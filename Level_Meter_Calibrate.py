@@ -0,0 +1,101 @@
+# LEVEL METER camera calibration
+# Builds the camera calibration file used by Calibration_File= in Level_Meter.cfg from pictures of a printed
+# checkerboard. The source can be a folder of images, a recorded video or a camera index. For videos and
+# cameras one frame every --every seconds is used, so the board should be moved and tilted slowly over the
+# whole field of view. The camera must use the same resolution as Resolution= in Level_Meter.cfg.
+#
+# Examples:
+#   python Level_Meter_Calibrate.py calibration_images --board 9x6 --square 10
+#   python Level_Meter_Calibrate.py checkerboard.mp4 --every 0.5 --output camera_calibration.csv
+#   python Level_Meter_Calibrate.py 0 --frames 25
+
+import argparse
+import glob
+import os
+import cv2
+import numpy as np
+from Camera_Utils import *
+from Source_Utils import open_source
+
+IMAGE_TYPES = ('*.png', '*.jpg', '*.jpeg', '*.bmp')
+CORNER_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Camera calibration from checkerboard images or video')
+    parser.add_argument('source', help='folder of images, video file or camera index')
+    parser.add_argument('--board', default='9x6', help='inner corners of the checkerboard, columns x rows')
+    parser.add_argument('--square', type=float, default=1.0, help='size of a checkerboard square (any unit)')
+    parser.add_argument('--output', default='camera_calibration.csv', help='calibration file to write')
+    parser.add_argument('--every', type=float, default=1.0, help='seconds between frames taken from a video or camera')
+    parser.add_argument('--frames', type=int, default=20, help='stop after this many views of the board')
+    parser.add_argument('--resolution', default='1920x1080', help='camera resolution, same as Level_Meter.cfg')
+    return parser.parse_args()
+
+
+def source_frames(source, every, resolution):                   # Yields BGR frames of the calibration source
+    if os.path.isdir(source):
+        for pattern in IMAGE_TYPES:
+            for file in sorted(glob.glob(os.path.join(source, pattern))):
+                yield cv2.imread(file)
+        return
+    vid = open_source(source, resolution)                       # Camera with the same settings as the level meter
+    last = None
+    while vid.grab():
+        now = vid.position()                                    # Video time for files, clock time for cameras
+        if last is None or now - last >= every:                 # Frames in between are never decoded
+            ret, frame = vid.retrieve()
+            if not ret:
+                break
+            last = now
+            yield cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+    vid.release()
+
+
+def board_points(board, square):                                # Corner coordinates on the board plane (z = 0)
+    columns, rows = board
+    points = np.zeros((columns * rows, 3), np.float32)
+    points[:, :2] = np.mgrid[0:columns, 0:rows].T.reshape(-1, 2) * square
+    return points
+
+
+def find_corners(frame, board):                                 # Sub-pixel corners of the board, None if not found
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    found, corners = cv2.findChessboardCorners(gray, board, cv2.CALIB_CB_ADAPTIVE_THRESH + cv2.CALIB_CB_NORMALIZE_IMAGE)
+    if not found:
+        return None
+    return cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), CORNER_CRITERIA)
+
+
+def calibrate(args):
+    board = tuple(int(value) for value in args.board.split('x'))
+    resolution = [int(value) for value in args.resolution.split('x')]
+    points = board_points(board, args.square)
+    object_points, image_points = [], []
+    size = None
+    for frame in source_frames(args.source, args.every, resolution):
+        if frame is None:
+            continue
+        if size is None:
+            size = (frame.shape[1], frame.shape[0])
+        elif size != (frame.shape[1], frame.shape[0]):
+            raise ValueError("All calibration images must have the same resolution", (frame.shape[1], frame.shape[0]))
+        corners = find_corners(frame, board)
+        if corners is None:
+            continue
+        object_points.append(points)
+        image_points.append(corners)
+        print('Board views: ', len(image_points))
+        if len(image_points) >= args.frames:
+            break
+    if len(image_points) < 3:
+        raise ValueError("Not enough views of the checkerboard to calibrate", len(image_points))
+    error, mtx, dist, _, _ = cv2.calibrateCamera(object_points, image_points, size, None, None)
+    save_cam_calibration(args.output, mtx, dist)
+    print('Calibration of ', size[0], 'x', size[1], ' from ', len(image_points), ' views, RMS reprojection error ',
+          round(error, 3), 'px')
+    print('Saved ', args.output, ', set Calibration_File=' + args.output + ' in Level_Meter.cfg')
+
+
+if __name__ == "__main__":
+    calibrate(parse_args())
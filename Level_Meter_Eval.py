@@ -0,0 +1,90 @@
+# LEVEL METER evaluation
+# Runs the inference backends over the labelled images of annotations/test.record and prints one table with
+# their accuracy and speed: box mAP at IoU 0.5 and averaged over IoU 0.5:0.95, mean IoU of the labelled boxes,
+# lower edge error in pixels (edge found in the detected box against the edge found in the labelled box, with
+# the Edge_ settings of the config file), latency per image and model size.
+#
+# Examples:
+#   python Level_Meter_Eval.py
+#   python Level_Meter_Eval.py --backends tf,tflite_int8 --threads 2 --json eval.json
+
+import argparse
+import json
+import time
+import numpy as np
+from Eval_Utils import *
+from Inference_Utils import BACKENDS, create_engine
+from Level_Meter_CLI import load_config
+from Paths import *
+from Pipeline_Utils import create_edge
+from Record_Utils import read_record
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Accuracy and latency of the inference backends on test.record')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='comma separated backends to evaluate')
+    parser.add_argument('--record', default=files['TEST_RECORD'])
+    parser.add_argument('--limit', type=int, default=None, help='max images read from the record')
+    parser.add_argument('--config', default='Level_Meter.cfg', help='config file with the Edge_ settings')
+    parser.add_argument('--threads', type=int, default=4, help='TFLite interpreter threads')
+    parser.add_argument('--score', type=float, default=0.2, help='min score of a detection, same as the meter')
+    parser.add_argument('--json', help='also write the table to this JSON file')
+    return parser.parse_args()
+
+
+def evaluate(engine, record, edge, min_score):                  # Metrics of one engine over the record images
+    results, latencies, errors = [], [], []
+    for image, truths in record:
+        start = time.perf_counter()
+        detections = engine.detect(image)
+        latencies.append((time.perf_counter() - start) * 1000)
+        keep = detections['detection_scores'] > min_score
+        found = (detections['detection_boxes'][keep], detections['detection_scores'][keep])
+        results.append((found, truths))
+        errors += edge_errors(image, found, truths, edge)
+    labelled = sum(len(truths) for _, truths in results)
+    found_boxes = sum(int(np.sum(match(found, truths)[0] >= 0)) for found, truths in results)
+    return {'map50': round(average_precision(results, 0.5), 4),
+            'map50_95': round(coco_map(results), 4),
+            'mean_iou': round(mean_best_iou(results), 4),
+            'edge_error_px': round(float(np.mean(errors)), 3) if errors else None,
+            'edge_error_p95_px': round(float(np.percentile(errors, 95)), 3) if errors else None,
+            'missed': labelled - found_boxes,
+            'latency_p50_ms': round(float(np.percentile(latencies, 50)), 2),
+            'latency_p99_ms': round(float(np.percentile(latencies, 99)), 2)}
+
+
+def print_table(rows):
+    header = ('backend', 'size MB', 'p50 ms', 'p99 ms', 'mAP.5', 'mAP.5:.95', 'IoU', 'edge px', 'edge p95', 'missed')
+    print('%-12s %8s %8s %8s %7s %10s %6s %8s %9s %7s' % header)
+    for backend, row in rows.items():
+        if 'error' in row:
+            print('%-12s %s' % (backend, row['error']))
+            continue
+        print('%-12s %8.1f %8.2f %8.2f %7.3f %10.3f %6.3f %8s %9s %7d' % (
+            backend, row['size_mb'], row['latency_p50_ms'], row['latency_p99_ms'], row['map50'], row['map50_95'],
+            row['mean_iou'], row['edge_error_px'], row['edge_error_p95_px'], row['missed']))
+
+
+def main(args):
+    cfg = load_config(args.config)
+    edge = create_edge(cfg)
+    record = [(image, boxes) for _, image, boxes in read_record(args.record, args.limit)]
+    print('Images: ', len(record), ' labelled boxes: ', sum(len(boxes) for _, boxes in record))
+    rows = {}
+    for backend in args.backends.split(','):
+        try:
+            engine = create_engine(backend, args.threads)
+        except ValueError as error:                             # TFLite model not exported yet
+            rows[backend] = {'error': str(error.args[0])}
+            continue
+        engine.detect(record[0][0])                             # Warm up outside the timing
+        rows[backend] = dict(evaluate(engine, record, edge, args.score), size_mb=round(model_size_mb(backend), 2))
+    print_table(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'images': len(record), 'backends': rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -0,0 +1,8 @@
+# Exports the trained checkpoint (ckpt-21) to float16 and int8 quantized TFLite models in
+# paths['TFLITE_PATH'], so Level_Meter.cfg can select them with Backend=tflite_fp16 or Backend=tflite_int8.
+# The int8 model is calibrated with the images in annotations/test.record.
+
+from Inference_Utils import export_tflite
+
+if __name__ == "__main__":
+    export_tflite()
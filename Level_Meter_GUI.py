@@ -9,6 +9,9 @@
 # The program then prints the calculated volumes on command line so these values can be picked up by
 # another application (Labview in my case).
 
+import time
+START = time.perf_counter()                     # Process start, for the time to first frame and first reading
+
 from tkinter import *
 from PIL import Image, ImageTk
 from Camera_Utils import *
@@ -17,11 +20,12 @@ from GUI_Utils import *
 from File_Utils import *
 from Paths import *
 import os
-import socket
-import tensorflow as tf
-from object_detection.utils import label_map_util
-from object_detection.builders import model_builder
-from object_detection.utils import config_util
+from Output_Utils import *
+from Pipeline_Utils import *
+from Source_Utils import *
+from Inference_Utils import *
+from Metrics_Utils import *
+from Store_Utils import ReadingRecorder
 
 # Default Parameters that will be used unless specified in CONFIG_FILE
 CONFIG_FILE = "Level_Meter.cfg"
@@ -36,22 +40,19 @@ FONT_SIZE = 1
 HOST = '127.0.0.1'  # The server's hostname or IP address
 PORT = 64250  # The port used by the server
 
-# Load category index
-category_index = label_map_util.create_category_index_from_labelmap(files['LABELMAP'])
-# Load pipeline config and build a detection model
-configs = config_util.get_configs_from_pipeline_file(files['PIPELINE_CONFIG'])
-detection_model = model_builder.build(model_config=configs['model'], is_training=False)
-# Restore checkpoint
-ckpt = tf.compat.v2.train.Checkpoint(model=detection_model)
-ckpt.restore(os.path.join(paths['CHECKPOINT_PATH'], 'ckpt-21')).expect_partial()
+loader = None                                   # Loads the inference backend in the background, started in __main__
+
+
+def detect_fn(image):                           # Runs the compiled detector over an RGB image of any size
+    return loader.engine.detect(image)
+
 
+def detect_batch_fn(images):                    # Runs the detector over several images (multi tube mode)
+    return loader.engine.detect_batch(images)
 
-# @tf.function
-def detect_fn(image):
-    image, shapes = detection_model.preprocess(image)
-    prediction_dict = detection_model.predict(image, shapes)
-    detections_ = detection_model.postprocess(prediction_dict, shapes)
-    return detections_
+
+def capture_time(t):                            # Formats a capture timestamp with milliseconds
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)) + '.%03d' % int((t % 1) * 1000)
 
 
 class App:
@@ -62,19 +63,25 @@ class App:
         self.cfg = cfg_par
         self.video_source = self.cfg.cam
         self.resolution = tk.StringVar()                                    # This var is declared here because the resolution
-        self.resolution.set(cfg_par.resolution)                             # is needed by MyVideoCapture function
-        self.vid = MyVideoCapture(video_source=self.video_source, res_list=self.res_to_list())
+        self.resolution.set(cfg_par.resolution)                             # is needed by open_source function
+        self.vid = open_source(self.video_source, self.res_to_list(), self.cfg.camera_fourcc, self.cfg.camera_buffer,
+                               realtime=True, loop=True)            # Camera, or a recording/synthetic tube played like one
         self.x1, self.x2, self.y1, self.y2 = 0, int(self.vid.height), 0, int(self.vid.width)
+        self.roi = (self.x1, self.x2, self.y1, self.y2)                     # Read by the capture thread as one tuple
+        self.full_roi = self.roi                                            # Whole rotated frame
+        self.tubes = create_tubes(self.cfg, (self.x2, self.y2))             # Several tubes in the frame, from Tube= config lines
         self.origin_x = 0
         self.origin_y = 0
         self.meniscus = Meniscus()
-        self.static_mark = Mark([0, 0], self.cfg.obj_distance, self.cfg.tube_diam)
+        self.static_mark = Mark(list(self.cfg.marks_ml), self.cfg.obj_distance, self.cfg.tube_diam)   # All the calibration points
+        self.static_mark.lens_correction = not self.cfg.calibration_file    # Frames are undistorted with Calibration_File
 
         # Tkinter window definitions
         # Image Canvas
         self.canvas = tk.Canvas(window, width=self.cfg.canvas_width, height=self.cfg.canvas_height)
         self.canvas.bind("<Button-1>", self.click_callback)
         self.canvas.grid(row=0, column=0, rowspan=4)
+        self.canvas_image = CanvasImage(self.canvas)                        # One canvas item updated in place every redraw
 
         # Camera Frame
         self.cam_frame = frame_create(window, text_="Camera", row_=0, col_=1, colspan_=2, rowspan_=1)
@@ -124,59 +131,204 @@ class App:
         label_create(self.reading_frame, width_=15, row_=0, col_=1, pad_x=1, pad_y=8, label="Interface1 (ml)", var=self.intf1)
         self.intf2 = tk.StringVar()
         label_create(self.reading_frame, width_=15, row_=1, col_=1, pad_x=1, pad_y=8, label="Interface2 (ml)", var=self.intf2)
-
-        self.delay = 100
-        self.update()
+        self.latency = tk.StringVar()
+        label_create(self.reading_frame, width_=15, row_=2, col_=1, pad_x=1, pad_y=8, label="Inference (ms)", var=self.latency)
+        self.detector_ratio = tk.StringVar()
+        label_create(self.reading_frame, width_=15, row_=3, col_=1, pad_x=1, pad_y=8, label="Detector ratio", var=self.detector_ratio)
+
+        self.percent_x.set(self.cfg.roi_percent_x)                          # Start with the ROI, marks and volumes
+        self.percent_y.set(self.cfg.roi_percent_y)                          # saved in the config file
+        self.min_vol_var.set(self.cfg.marks_ml[0])
+        self.max_vol_var.set(self.cfg.marks_ml[-1])                         # Widgets show the first and last marks,
+        if len(self.cfg.marks_px) >= 2:                                     # intermediate marks come from the config file
+            self.static_mark.yposition = list(self.cfg.marks_px)
+            self.min_pos_var.set(self.cfg.marks_px[0])
+            self.max_pos_var.set(self.cfg.marks_px[-1])
+
+        # Capture -> inference -> render pipeline. Capture and inference run on their own threads and pass
+        # only the latest frame forward, so the Tk loop never waits for the camera or the detector
+        self.frames = LatestQueue()
+        self.results = LatestQueue()
+        self.locator = create_locator(self.cfg, self.tubes)                 # Auto ROI window around the tube, Auto_ROI=1
+        self.capture = CaptureThread(self.vid, self.frames, self.capture_roi, create_undistort(self.cfg), self.locator)
+        detect, self.scheduler = create_detect(detect_fn, self.cfg)         # Motion gated detection when Gating=1
+        self.worker = InferenceWorker(detect, self.frames, self.results, self.static_mark, max_boxes=2, min_score_thresh=0.2,
+                                      tubes=self.tubes, detect_batch=detect_batch_fn, edge=create_edge(self.cfg), ready=loader.ready)
+        self.link = OutputLink(self.cfg.output_host, self.cfg.output_port, batch=self.cfg.output_batch)
+        self.tube_links = {tube.channel: OutputLink(self.cfg.output_host, tube.channel, batch=self.cfg.output_batch)
+                           for tube in self.tubes if tube.channel}          # One output link per tube channel
+        self.recorder = None
+        if self.cfg.record_folder:                                          # Durable record of every reading
+            self.recorder = ReadingRecorder(self.cfg.record_folder, [tube.name for tube in self.tubes] or [''])
+        self.archiver = create_archiver(self.cfg, self.static_mark)         # Annotated frames of reading changes
+        self.modbus = create_modbus(self.cfg, self.static_mark, self.tubes)   # Readings for PLC pollers, marks writable
+        self.marks_changed = 0                                              # Mark writes of the Modbus server shown so far
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        # Instrumentation, always on. Served in Prometheus format when Metrics_Port is set
+        self.registry = Registry()
+        register_pipeline(self.registry, self.capture, self.worker, self.frames, self.results, self.scheduler,
+                          engine=lambda: loader.engine, links={**self.tube_links, self.cfg.output_port: self.link},
+                          recorder=self.recorder, archiver=self.archiver, modbus=self.modbus,
+                          locator=self.locator)
+        self.metrics = MetricsServer(self.registry, self.cfg.metrics_host, self.cfg.metrics_port) if self.cfg.metrics_port else None
+        self.stats = None
+        if self.cfg.stats_panel:                                            # Optional statistics panel under the controls
+            self.stats_frame = frame_create(window, text_="Statistics", row_=4, col_=0, colspan_=3, rowspan_=1)
+            self.stats = {}
+            for index, name in enumerate(('Captured (fps)', 'Processed (fps)', 'Dropped', 'Inference p50 (ms)',
+                                          'Latency p99 (ms)', 'Memory (MB)', 'Socket', 'Sent')):
+                self.stats[name] = tk.StringVar()
+                label_create(self.stats_frame, width_=15, row_=index // 2, col_=1 + 2 * (index % 2), pad_x=1, pad_y=2,
+                             label=name, var=self.stats[name])
+            self.stats_time, self.stats_counts = time.monotonic(), (0, 0)
+
+        self.trend = None
+        if self.cfg.trend_width > 0:                                        # Trend of both interfaces next to the controls
+            self.trend_frame = frame_create(window, text_="Volume Trend", row_=0, col_=3, colspan_=1, rowspan_=4)
+            self.trend = TrendBuffer()                                      # Preallocated, whole run in fixed memory
+            self.trend_plot = TrendPlot(self.trend_frame, self.cfg.trend_width, self.cfg.canvas_height - 30)
+            self.trend_period = 1.0 / self.cfg.trend_fps if self.cfg.trend_fps > 0 else 0.0
+            self.last_trend = 0.0
+
+        self.delay = 30                                                     # Render poll period in ms
+        self.display_period = 1.0 / self.cfg.display_fps if self.cfg.display_fps > 0 else 0.0
+        self.last_draw = 0.0                                                # Monotonic time of the last redraw
+        self.pending = None                                                 # Newest packet not drawn yet
+        self.first_frame = None                                             # Seconds from START to the first frame shown
+        self.first_reading = None                                           # and to the first frame analysed by the model
         self.update_roi()
+        self.capture.start()
+        self.worker.start()
+        self.link.start()
+        for link in self.tube_links.values():
+            link.start()
+        if self.recorder is not None:
+            self.recorder.start()
+        if self.modbus is not None:
+            self.modbus.start()
+            print('Modbus/TCP on ' + self.cfg.modbus_host + ':' + str(self.modbus.port))
+        if self.metrics is not None:
+            self.metrics.start()
+            print('Metrics on http://' + self.cfg.metrics_host + ':' + str(self.metrics.port) + '/metrics')
+        self.render()
         self.window.mainloop()
 
-    def update(self):                           # This Function executes every self.delay
-        ret, frame = self.vid.get_frame()                           # Get the frame from the camera
-        if ret:
-            frame = cv2.rotate(frame, cv2.ROTATE_90_CLOCKWISE)      # Rotate image
-            image_np = np.array(frame)
-            image_np = image_np[self.y1:self.y2, self.x1:self.x2]   # Crop Image according to ROI control values
-            image_np_with_detections = image_np.copy()
-
-            input_tensor = tf.convert_to_tensor(np.expand_dims(image_np, 0),
-                                                dtype=tf.float32)   # Convert image to Tensor
-            detections = detect_fn(input_tensor)
-            num_detections = int(detections.pop('num_detections'))
-            detections = {key: value[0, :num_detections].numpy() for key, value in detections.items()}
-            detections['num_detections'] = num_detections
-            # detection_classes should be ints.
-            detections['detection_classes'] = detections['detection_classes'].astype(np.int64)
-            # detect objects in image_np_with_detections, return a Meniscus class with the information
-            image_np_with_detections, self.meniscus = meniscus_draw(image_np_with_detections,
-                                                                    detections['detection_boxes'],
-                                                                    detections['detection_scores'],
-                                                                    self.static_mark,
-                                                                    max_boxes=2,
-                                                                    min_score_thresh=0.2)
-
-            self.order_intf()                               # Order interfaces so the one on top goes first and not according confidence
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:            #Open socket and try to send to Labview
-                s.connect((HOST, PORT))
-                joined_readings = self.intf1.get() + ',' + self.intf2.get() + "\r\n"
-                s.sendall(bytes(joined_readings, 'ascii'))
-                s.close()
-
-            print('Readings: ', self.meniscus.reading)      # Print on Command Line of another program (Labview) to capture it
-
-            image_np_with_detections = cv2.resize(image_np_with_detections, self.fit_img_to_canvas())                       # Resize image to fit the height in the canvas
-            draw_levels(image_np_with_detections, self.meniscus, self.cfg.canvas_height, self.vid.width, self.cfg.line_width, self.cfg.font_size)      # Draw line and text at the meniscus lower edge
-            draw_marks(image_np_with_detections, self.static_mark, self.cfg.canvas_height, self.vid.width, self.cfg.line_width, self.cfg.font_size)    # Draw the marks that limit the volume calculation
-            draw_center_lines(image_np_with_detections, self.cfg.line_width)                                                         # Draw centered reference lines
-
-            self.photo = ImageTk.PhotoImage(image=Image.fromarray(image_np_with_detections))  # Create photo from array
-            self.canvas.create_image(self.origin_x, self.origin_y, image=self.photo, anchor=tk.NW)  # Set image to center of canvas
-        self.window.after(self.delay, self.update)                      # Repeat after self.delay
+    def render(self):                           # Tk callback, publishes every new reading and redraws at most display_fps
+        packet = self.results.get_nowait()                          # None if the pipeline has nothing new
+        if packet is not None:
+            self.startup_times(packet)
+            self.meniscus = packet.meniscus
+            if packet.loading:                                          # Preview only, no readings until the model is ready
+                self.latency.set('Model error' if loader.error else 'Model loading')
+            else:
+                self.latency.set(round(loader.engine.latency_ms, 1))
+                self.publish(packet)
+            if self.scheduler is not None:
+                self.detector_ratio.set(round(self.scheduler.invocation_ratio(), 3))
+            self.order_intf(packet.readings)                # Order interfaces so the one on top goes first and not according confidence
+            if self.pending is not None:                                # Replaced before it was drawn
+                self.registry.observe_packet(self.pending)
+            self.pending = packet
+        now = time.monotonic()
+        if self.pending is not None and now - self.last_draw >= self.display_period:
+            self.draw(self.pending)
+            self.registry.observe_packet(self.pending)
+            self.pending = None
+            self.last_draw = now
+        if self.modbus is not None and self.modbus.marks_changed != self.marks_changed:
+            self.show_marks()                                           # Marks written by a Modbus client
+        if self.trend is not None and now - self.last_trend >= self.trend_period:
+            self.trend_plot.draw(self.trend)                                # Nothing is redrawn without new readings
+            self.last_trend = now
+        if self.stats is not None and now - self.stats_time >= 1.0:
+            self.update_stats(now)
+        self.window.after(self.delay, self.render)                      # Repeat after self.delay
+
+    def update_stats(self, now):                                        # Refreshes the statistics panel once per second
+        counts = (self.capture.grabbed, self.worker.processed)
+        elapsed = now - self.stats_time
+        self.stats['Captured (fps)'].set(round((counts[0] - self.stats_counts[0]) / elapsed, 1))
+        self.stats['Processed (fps)'].set(round((counts[1] - self.stats_counts[1]) / elapsed, 1))
+        self.stats['Dropped'].set(self.capture.skipped + self.frames.dropped + self.results.dropped)
+        self.stats['Inference p50 (ms)'].set(round(self.registry.histogram(
+            'level_meter_stage_latency_ms', STAGE_HELP, stage='inference').quantile(0.5), 1))
+        self.stats['Latency p99 (ms)'].set(round(self.registry.histogram(
+            'level_meter_frame_latency_ms', 'Time from capture to the end of the last stage').quantile(0.99), 1))
+        self.stats['Memory (MB)'].set(round(rss_mb(), 1))
+        link = self.link.stats()
+        self.stats['Socket'].set('connected' if link['connected'] else 'down (' + str(link['connect_failures']) + ' failures)')
+        self.stats['Sent'].set(link['sent'])
+        self.stats_time, self.stats_counts = now, counts
+
+    def show_marks(self):                                               # Shows the first and last marks in the widgets
+        self.marks_changed = self.modbus.marks_changed
+        positions, capacities = list(self.static_mark.yposition), list(self.static_mark.capacity)
+        self.min_pos_var.set(positions[0])
+        self.max_pos_var.set(positions[-1])
+        self.min_vol_var.set(capacities[0])
+        self.max_vol_var.set(capacities[-1])
+
+    def startup_times(self, packet):                                    # Prints the startup times once
+        if self.first_frame is None:
+            self.first_frame = time.perf_counter() - START
+            print('First frame after ', round(self.first_frame, 2), 's')
+        if self.first_reading is None and not packet.loading:
+            self.first_reading = time.perf_counter() - START
+            print('First reading after ', round(self.first_reading, 2), 's (model loaded in ', round(loader.load_time, 2), 's)')
+
+    def publish(self, packet):                                          # Sends, records and prints the readings of every analysed frame
+        if self.recorder is not None:
+            self.recorder.add_packet(packet)
+        if self.trend is not None:                                      # First tube only in multi tube mode
+            self.trend.append(packet.t_capture, packet.readings)
+        if self.archiver is not None:                                   # Images are drawn and written in the archive pool
+            self.archiver.consider(packet)
+        if self.modbus is not None:                                     # Swaps the register block, never waits for pollers
+            self.modbus.update(packet)
+        if self.locator is not None:                                    # Searches the tube again when detections fall off
+            self.locator.observe(packet)
+        if packet.tube_results:
+            for tube, meniscus, readings in packet.tube_results:
+                if tube.channel:
+                    self.tube_links[tube.channel].send_readings(readings)
+                if self.cfg.print_readings:
+                    print('Readings ' + tube.name + ': ', meniscus.reading, ' Captured: ', capture_time(packet.t_capture))
+        else:
+            self.link.send_readings(packet.readings)        # Queued, sent to Labview by the output link thread
+            if self.cfg.print_readings:                     # Print on Command Line of another program (Labview) to capture it
+                print('Readings: ', self.meniscus.reading, ' Captured: ', capture_time(packet.t_capture))
+
+    def draw(self, packet):                                             # Resizes to the canvas, draws the overlays and shows the frame
+        size = self.fit_img_to_canvas(packet.roi)
+        image = render_packet(packet, self.static_mark, size, self.cfg.line_width, self.cfg.font_size)
+        self.canvas_image.show(image, (self.cfg.canvas_width - size[0]) / 2, self.origin_y)    # Centered, auto ROI changes the width
+        packet.stamp('render')
+
+    def capture_roi(self):                                              # ROI the capture thread crops the frames to
+        return self.full_roi if self.tubes else self.roi
+
+    def close(self):                                                    # Stop pipeline threads before closing the window
+        self.capture.stop()
+        self.worker.stop()
+        self.link.close()
+        for link in self.tube_links.values():
+            link.close()
+        if self.recorder is not None:
+            self.recorder.close()                                       # Writes the readings not flushed yet
+        if self.archiver is not None:
+            self.archiver.close()
+        if self.modbus is not None:
+            self.modbus.close()
+        if self.metrics is not None:
+            self.metrics.close()
+        self.window.destroy()
 
     def set_brightness(self, *args):
-        self.vid.vid.set(cv2.CAP_PROP_BRIGHTNESS, self.brightness.get())  # Sets cam Brightness using the IntVar.get()
+        self.vid.set(cv2.CAP_PROP_BRIGHTNESS, self.brightness.get())  # Sets cam Brightness using the IntVar.get()
 
     def set_focus(self, *args):
-        self.vid.vid.set(cv2.CAP_PROP_FOCUS, self.focus.get())  # Sets cam Focus using the IntVar.get()
+        self.vid.set(cv2.CAP_PROP_FOCUS, self.focus.get())  # Sets cam Focus using the IntVar.get()
 
     def res_to_list(self):                                              # Converts the stringVar from the Combo box in a
         res_list = str(self.resolution.get()).split('x')                # format like '1280x720' to an integer list like [1280, 720]
@@ -184,16 +336,15 @@ class App:
         return res_list                                                 # and need a list of integers
 
     def update_roi(self, *args):                                                    # When a ROI Scale widget changes its value, this function
-        self.x1 = int((self.vid.height - (self.vid.height * self.percent_x.get() / 100)) / 2)  # updates the ROI so when the image is displayed inside
-        self.x2 = int(self.x1 + (self.vid.height * self.percent_x.get() / 100))     # the canvas it is cropped to the size specified by
-        self.y1 = int((self.vid.width - (self.vid.width * self.percent_y.get() / 100)) / 2)  # percentages in x and y of the camera resolution
-        self.y2 = int(self.y1 + (self.vid.width * self.percent_y.get() / 100))      # x1 and x2 are the horizontal max and min pixels
-        img_x, img_y = self.fit_img_to_canvas()                                     # y1 and y2 are the vertical max and min pixels
+        self.roi = percent_roi(self.vid.height, self.vid.width, self.percent_x.get(), self.percent_y.get())  # updates the ROI so when the image is displayed
+        self.x1, self.x2, self.y1, self.y2 = self.roi                               # inside the canvas it is cropped to the size specified by percentages
+        img_x, img_y = self.fit_img_to_canvas(self.capture_roi())                   # in x and y of the camera resolution (rotated 90 degrees)
         self.origin_x = (self.cfg.canvas_width - img_x) / 2                                  # Origin values are calculated so the image can be
         self.origin_y = (self.cfg.canvas_height - img_y) / 2                                 # positioned in the center of the canvas
 
-    def fit_img_to_canvas(self):                                                    # Returns pixels wide and high for the cv2.resize image function
-        scale_x = int((self.x2 - self.x1) * (self.cfg.canvas_height / (self.y2 - self.y1)))  # Proportionally resize x and y of image
+    def fit_img_to_canvas(self, roi=None):                                          # Returns pixels wide and high for the cv2.resize image function
+        x1, x2, y1, y2 = self.roi if roi is None else roi                           # ROI the frame was cropped with
+        scale_x = int((x2 - x1) * (self.cfg.canvas_height / (y2 - y1)))             # Proportionally resize x and y of image
         scale_y = int(self.cfg.canvas_height)                                                # to fit the height of canvas
         return scale_x, scale_y
 
@@ -201,9 +352,10 @@ class App:
         y = int(event.y * (self.y2 - self.y1) / self.cfg.canvas_height)  # mouse click position
         if len(self.static_mark.yposition) < 2:             # If less than two marks in the array, append.
             self.static_mark.yposition.append(y)            # Append the mark position to the array
-        else:                                               # If there are 2 mark in the array...
+        else:                                               # If there are 2 or more marks in the array...
             self.static_mark.yposition = []                 # clean the array and start appending again
             self.static_mark.yposition.append(y)
+            self.static_mark.capacity = [self.min_vol_var.get(), self.max_vol_var.get()]    # Back to a two point scale
         if len(self.static_mark.yposition) == 1:
             self.min_pos_var.set(self.static_mark.yposition[0])
         if len(self.static_mark.yposition) == 2:
@@ -215,26 +367,19 @@ class App:
         self.static_mark.capacity[0] = self.min_vol_var.get()
 
     def change_vol_max(self, *args):                        # Callback when the max_vol_var widget value changes
-        self.static_mark.capacity[1] = self.max_vol_var.get()
+        self.static_mark.capacity[-1] = self.max_vol_var.get()
 
     def change_pos_min(self, *args):                        # Callback when the min_pos_var widget value changes
         if len(self.static_mark.yposition) > 0:
             self.static_mark.yposition[0] = self.min_pos_var.get()
 
     def change_pos_max(self, *args):                        # Callback when the max_pos_var widget value changes
-        if len(self.static_mark.yposition) == 2:
-            self.static_mark.yposition[1] = self.max_pos_var.get()
-
-    def order_intf(self):
-        # Readings are ordered in array by confidence, reorder so intf1 is the meniscus on top and intf2 is bottom
-        if any(x is None for x in self.meniscus.reading):   # If any of the readings is None
-            self.intf1.set(self.meniscus.reading[0])        # The first one can be the only one with value
-            self.intf2.set(self.meniscus.reading[1])        # Second one is None for sure
-        else:                                               # Image has its origin position (0, 0) on top left corner
-            idx = self.meniscus.yposition.index(min(self.meniscus.yposition))  # Index of the reading that is on top
-            self.intf1.set(self.meniscus.reading[idx])      # and update the intf1 indicator StringVar
-            idx = self.meniscus.yposition.index(max(self.meniscus.yposition))  # Index of the reading that is at bottom
-            self.intf2.set(self.meniscus.reading[idx])      # Update indicator StringVar
+        if len(self.static_mark.yposition) >= 2:
+            self.static_mark.yposition[-1] = self.max_pos_var.get()
+
+    def order_intf(self, readings):                         # Readings come ordered by order_readings, intf1 is the
+        self.intf1.set(readings[0])                         # meniscus on top and intf2 is bottom
+        self.intf2.set(readings[1])
 
     # OLD Code section (used to allow user to change resolution, but that caused hardware problems with USB camera
     # Resolution cannot be changed on the fly, close app, change Level_Meter.cfg file and start app again.
@@ -252,36 +397,11 @@ class App:
     #     print('Resolution: ', self.vid.width, 'x', self.vid.height)     # Print returned resolution
 
 
-class MyVideoCapture:
-    def __init__(self, video_source=0, res_list=None):
-        if res_list is None:                                # Assign default value to res_list
-            res_list = [800, 600]                           # to avoid mutable default values
-        self.vid = cv2.VideoCapture(video_source, cv2.CAP_DSHOW)     # Open the video source
-        if not self.vid.isOpened():                         # If not opened raise error
-            raise ValueError("Unable to open video source", video_source)
-        w, h, _, _, _ = set_cam_params(self.vid, res_list[0], res_list[1], 100, 50, False)  # Set camera parameters
-        self.width, self.height = int(w), int(h)            # Camera resolution
-        print('Resolution: ', self.width, 'x', self.height)     # Print Resolution
-
-    def get_frame(self):
-        if self.vid.isOpened():                             # If stream is open, read a frame
-            ret, frame = self.vid.read()
-            if ret:
-                return ret, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  # If read succeeds, convert to RGB and return
-            else:
-                return ret, None                            # If read fails or stream is closed return False and None for the frame
-        else:
-            return False, None                              # If video feed is not open
-
-    def __del__(self):                                      # If program closes, release the camera
-        if self.vid.isOpened():
-            print('Closing video feed...')
-            self.vid.release()
-
-
 if __name__ == "__main__":
-    cfg_params = ConfigParams(DEFAULT_CAM, RESOLUTIONS, DISTANCE, TUBE_DIAM, CANVAS_WIDTH, CANVAS_HEIGHT, LINE_WIDTH, FONT_SIZE)
+    cfg_params = ConfigParams(DEFAULT_CAM, RESOLUTIONS, DISTANCE, TUBE_DIAM, CANVAS_WIDTH, CANVAS_HEIGHT, LINE_WIDTH, FONT_SIZE,
+                              host=HOST, port=PORT)
     cfg_params = get_config(CONFIG_FILE, cfg_params)
-
+    loader = EngineLoader(cfg_params.backend, cfg_params.threads, batch_size=max(1, len(cfg_params.tubes)))  # Full TF graph or TFLite interpreter,
+    loader.start()                                                                                          # loaded while the preview runs
 
     App(tk.Tk(), "Level Meter", cfg_params)
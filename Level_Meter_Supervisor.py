@@ -0,0 +1,203 @@
+# LEVEL METER supervisor
+# Runs a rig of several cameras from one program. Every camera (a Station= line of the config file, see
+# README.md) is captured and measured by its own worker process, and with Shared_Detector=1 a single detector
+# process loads the model once and serves all of them in batches. Frames stay in shared memory, crashed or
+# hung workers are restarted. This process aggregates the readings of every camera: stdout, CSV, record
+# folder, Labview sockets, Modbus/TCP (one register block per station) and metrics, and with --gui shows
+# all cameras in one window.
+#
+# Examples:
+#   python Level_Meter_Supervisor.py --gui
+#   python Level_Meter_Supervisor.py --station A,0 --station B,1,Level_Meter_B.cfg --socket --quiet
+#   python Level_Meter_Supervisor.py --station A,synthetic --station B,demos/test_tube_reading_3.mp4 --seconds 60
+
+import argparse
+import csv
+import time
+from File_Utils import *
+from Level_Meter_CLI import load_config
+from Meniscus_Utils import Meniscus
+from Metrics_Utils import *
+from Output_Utils import *
+from Pipeline_Utils import create_marks
+from Store_Utils import ReadingRecorder
+from Supervisor_Utils import *
+
+CONFIG_FILE = "Level_Meter.cfg"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Level meter for several cameras, one worker process per camera')
+    parser.add_argument('--config', default=CONFIG_FILE, help='config file with the Station= lines')
+    parser.add_argument('--station', action='append', default=[], help='name,source[,config] added to the Station= lines')
+    parser.add_argument('--gui', action='store_true', help='show every camera in one window')
+    parser.add_argument('--csv', help='write readings to this CSV file')
+    parser.add_argument('--record', help='record readings to this folder (default Record_Folder of the config)')
+    parser.add_argument('--socket', action='store_true', help='send the readings of each station to its Output_Port')
+    parser.add_argument('--quiet', action='store_true', help='do not print every reading on stdout (Print_Readings=0)')
+    parser.add_argument('--own-detectors', action='store_true', help='one model per station process (Shared_Detector=0)')
+    parser.add_argument('--loop', action='store_true', help='restart video files at the end')
+    parser.add_argument('--seconds', type=float, default=0.0, help='stop after this many seconds (0 = no limit)')
+    return parser.parse_args()
+
+
+class Outputs:
+    # Aggregating output layer, every reading of every station goes through publish() in this process
+    def __init__(self, cfg, stations, args):
+        self.stations = stations
+        self.quiet = args.quiet or not cfg.print_readings
+        self.station_cfg = [load_config(station.config_file) for station in stations]
+        self.marks = [create_marks(station_cfg) for station_cfg in self.station_cfg]
+        self.links = {}                                         # Output link per (host, port), stations may share one
+        self.channels = [None] * len(stations)
+        if args.socket:
+            for index, station_cfg in enumerate(self.station_cfg):
+                channel = (station_cfg.output_host, station_cfg.output_port)
+                if channel not in self.links:
+                    self.links[channel] = OutputLink(channel[0], channel[1], batch=station_cfg.output_batch)
+                self.channels[index] = channel
+        for link in self.links.values():
+            link.start()
+        record_folder = args.record or cfg.record_folder
+        self.recorder = ReadingRecorder(record_folder, [station.name for station in stations]) if record_folder else None
+        if self.recorder is not None:
+            self.recorder.start()
+        self.modbus = None
+        if cfg.modbus_port:                                     # One register block per station, marks are read only
+            from Modbus_Utils import ModbusServer
+            self.modbus = ModbusServer(None, cfg.modbus_host, cfg.modbus_port, tubes=len(stations))
+            self.modbus.start()
+        self.csv_file = open(args.csv, 'w', newline='') if args.csv else None
+        self.writer = csv.writer(self.csv_file) if self.csv_file else None
+        if self.writer:
+            self.writer.writerow(['time', 'station', 'intf1', 'intf2'])
+        self.registry = Registry()
+        self.latency = [self.registry.histogram('level_meter_frame_latency_ms', 'Time from capture to the end of the last stage',
+                                                station=station.name) for station in stations]
+        self.metrics = MetricsServer(self.registry, cfg.metrics_host, cfg.metrics_port) if cfg.metrics_port else None
+        if self.metrics is not None:
+            self.metrics.start()
+        self.last = [(None, None, True)] * len(stations)        # Last readings of each station, for the GUI
+
+    def publish(self, station: Station, t, readings, yposition, score, loading, latency_ms):
+        index = station.index
+        self.last[index] = (readings, score, loading)
+        self.latency[index].observe(latency_ms)
+        if loading:                                             # Preview frame, no readings until the model is ready
+            return
+        if not self.quiet:
+            print('Readings ' + station.name + ': ', readings, ' Time: ', round(t, 3))
+        if self.writer:
+            self.writer.writerow([round(t, 3), station.name, readings[0], readings[1]])
+        if self.recorder is not None:
+            self.recorder.add(t, readings, yposition, score, index)
+        if self.channels[index] is not None:
+            self.links[self.channels[index]].send_readings(readings)
+        if self.modbus is not None:
+            meniscus = Meniscus()
+            meniscus.reading, meniscus.yposition, meniscus.score = readings, yposition, score   # Already top first
+            self.modbus.set_tube(index, readings, meniscus, self.marks[index], True)
+
+    def close(self):
+        if self.csv_file:
+            self.csv_file.close()
+        for link in self.links.values():
+            link.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.modbus is not None:
+            self.modbus.close()
+        if self.metrics is not None:
+            self.metrics.close()
+
+
+class SupervisorWindow:
+    # One panel per station with its annotated frame, readings and process state. Frames are read from the
+    # station display rings, already rendered at the panel size by the station process
+    def __init__(self, supervisor: Supervisor, outputs: Outputs, display_size, deadline=None):
+        import tkinter as tk
+        from GUI_Utils import CanvasImage, frame_create, label_create
+        self.supervisor = supervisor
+        self.outputs = outputs
+        self.display_size = display_size
+        self.deadline = deadline
+        self.window = tk.Tk()
+        self.window.title('Level Meter Supervisor')
+        self.window.protocol('WM_DELETE_WINDOW', self.window.quit)
+        self.panels = []
+        for station in supervisor.stations:
+            frame = frame_create(self.window, station.name, 0, station.index, 1, 1)
+            canvas = tk.Canvas(frame, width=display_size[0], height=display_size[1])
+            canvas.grid(row=0, column=0, columnspan=2)
+            values = [tk.StringVar(), tk.StringVar(), tk.StringVar()]
+            for row, (label, var) in enumerate(zip(('Interface 1', 'Interface 2', 'State'), values), 1):
+                label_create(frame, 12, row, 1, 2, 2, label, var)
+            self.panels.append((CanvasImage(canvas), values, [0]))
+        self.window.after(10, self.tick)
+
+    def tick(self):
+        for message in self.supervisor.poll(0):
+            self.outputs.publish(*message)
+        for station, (image, values, shown) in zip(self.supervisor.stations, self.panels):
+            if station.display.latest() != shown[0]:
+                frame = station.display.read()
+                if frame is not None:
+                    shown[0] = frame[0]
+                    image.show(frame[2], (self.display_size[0] - frame[2].shape[1]) / 2, 0)
+            readings, _, loading = self.outputs.last[station.index]
+            values[0].set('' if readings is None or readings[0] is None else str(round(readings[0], 2)) + ' ml')
+            values[1].set('' if readings is None or readings[1] is None else str(round(readings[1], 2)) + ' ml')
+            values[2].set(station_state(station, loading))
+        if (self.deadline and time.monotonic() > self.deadline) or not self.supervisor.running():
+            self.window.quit()
+            return
+        self.window.after(30, self.tick)
+
+    def run(self):
+        self.window.mainloop()
+        self.window.destroy()
+
+
+def station_state(station: Station, loading):                  # Short process state shown in the GUI
+    if station.finished:
+        return 'finished'
+    if station.process is None or not station.process.is_alive():
+        return 'restarting (' + str(station.restarts) + ')'
+    return 'model loading' if loading else 'running'
+
+
+def run(args):
+    cfg = load_config(args.config)
+    cfg.stations += args.station
+    stations = create_stations(cfg, args.config)
+    if not stations:
+        raise ValueError("No stations, add Station= lines to the config file or --station", args.config)
+    display_size = (cfg.canvas_width, cfg.canvas_height) if args.gui else None
+    supervisor = Supervisor(stations, cfg.shared_detector and not args.own_detectors, cfg.backend, cfg.threads,
+                            display_size, loop=args.loop)
+    outputs = Outputs(cfg, stations, args)
+    register_supervisor(outputs.registry, supervisor)
+    deadline = time.monotonic() + args.seconds if args.seconds else None
+    supervisor.start()
+    start = time.perf_counter()
+    try:
+        if args.gui:
+            SupervisorWindow(supervisor, outputs, display_size, deadline).run()
+        else:
+            while supervisor.running() and not (deadline and time.monotonic() > deadline):
+                for message in supervisor.poll(0.1):
+                    outputs.publish(*message)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.perf_counter() - start
+    supervisor.close()
+    outputs.close()
+    for station in stations:
+        print('Station ', station.name, ': ', station.frames, ' frames (', round(station.frames / elapsed, 2) if elapsed else 0,
+              ' fps), ', station.restarts, ' restarts')
+    if supervisor.shared_detector:
+        print('Shared detector restarts: ', supervisor.detector_restarts)
+
+
+if __name__ == "__main__":
+    run(parse_args())
@@ -0,0 +1,104 @@
+import time
+import cv2
+import numpy as np
+
+
+class TubeLocator:
+    # Auto ROI. Finds the tube in the backlit ROI from its column intensity profile (the glass and the liquid
+    # are darker than the white panel) and narrows the ROI to a window around it. Only the horizontal range
+    # changes, so marks (pixels from the ROI top) stay valid. The window width is at least aspect times the
+    # ROI height, the proportions of the training images, because the detector stretches every crop to a
+    # square input. The tube is searched again every period seconds and after `misses` analysed frames
+    # without a meniscus.
+    def __init__(self, aspect=0.375, margin=0.25, period=60.0, misses=10, min_contrast=8.0, clock=time.monotonic):
+        self.aspect = aspect                                    # Min window width / ROI height
+        self.margin = margin                                    # Extra width on each side, fraction of the tube width
+        self.period = period
+        self.misses = misses
+        self.min_contrast = min_contrast                        # Gray levels the tube must be darker than the panel
+        self.clock = clock
+        self.window = None                                      # (left, right) columns inside the ROI, None for the whole ROI
+        self.tube = None                                        # (left, right) columns of the tube found inside the ROI
+        self.roi = None                                         # ROI the window was found in
+        self.searched_at = None                                 # Clock time of the last search
+        self.missed = 0                                         # Analysed frames without a meniscus in a row
+        self.searches = 0
+
+    def due(self, roi):                                         # True when the next frame should be searched
+        return self.searched_at is None or roi != self.roi or self.missed >= self.misses or \
+            (self.period and self.clock() - self.searched_at >= self.period)
+
+    def locate(self, image, roi):                               # Searches the tube in the RGB crop of the whole ROI
+        self.searches += 1
+        self.searched_at = self.clock()
+        self.roi = roi
+        self.missed = 0
+        self.tube = tube_columns(image, self.min_contrast)
+        if self.tube is None:                                   # No tube against the backlight, keep the whole ROI
+            self.window = None                                  # until a detection shows where it is
+            return None
+        return self.fit(*self.tube)
+
+    def fit(self, left, right):                                 # Window around the tube columns inside self.roi
+        x1, x2, y1, y2 = self.roi
+        width, height = x2 - x1, y2 - y1
+        needed = (right - left) * (1 + 2 * self.margin)
+        size = int(min(width, max(needed, self.aspect * height)))
+        start = int(min(max((left + right) / 2 - size / 2, 0), width - size))
+        self.window = (start, start + size)
+        return self.window
+
+    def crop_roi(self, roi):                                    # ROI narrowed to the window, the ROI itself without one
+        if self.window is None or roi != self.roi:
+            return roi
+        x1, x2, y1, y2 = roi
+        return x1 + self.window[0], x1 + self.window[1], y1, y2
+
+    def observe(self, packet):
+        # Counts analysed frames without any meniscus. Detections in a frame of the whole ROI (the searched
+        # frame, or every frame while the profile found nothing) place the window on the detected boxes,
+        # which is more reliable than the profile when the background is not a uniform panel
+        if packet.loading or packet.meniscus is None:
+            return
+        columns = [box for box in packet.meniscus.columns if box is not None]
+        if not columns:
+            self.missed += 1
+            return
+        self.missed = 0
+        if packet.roi == self.roi:
+            self.tube = (min(box[0] for box in columns), max(box[1] for box in columns))
+            self.fit(*self.tube)
+
+    def pixels_saved(self):                                     # Fraction of the ROI pixels not sent to the detector
+        if self.window is None or self.roi is None:
+            return 0.0
+        return 1.0 - (self.window[1] - self.window[0]) / (self.roi[1] - self.roi[0])
+
+
+def column_profile(image, step=4):                              # Mean gray level of every column, rows subsampled
+    gray = cv2.cvtColor(np.ascontiguousarray(image[::step]), cv2.COLOR_RGB2GRAY)
+    profile = cv2.blur(gray.mean(axis=0, dtype=np.float32).reshape(1, -1), (max(3, image.shape[1] // 100), 1))
+    return profile.ravel()
+
+
+def tube_columns(image, min_contrast=8.0, max_gap=0.03):
+    # (left, right) columns of the darkest group of columns against the panel, None if nothing is darker than
+    # min_contrast. Dark runs closer than max_gap of the width are merged, a tube is two walls around a
+    # liquid that may be almost as bright as the panel
+    profile = column_profile(image)
+    darkness = np.percentile(profile, 90) - profile             # Most of the ROI is backlit panel
+    threshold = max(min_contrast, 0.25 * float(darkness.max()))
+    dark = darkness > threshold
+    if not dark.any():
+        return None
+    edges = np.flatnonzero(np.diff(np.r_[0, dark.astype(np.int8), 0]))
+    runs = [[start, end] for start, end in zip(edges[::2], edges[1::2])]
+    merged = [runs[0]]
+    for start, end in runs[1:]:
+        if start - merged[-1][1] <= max_gap * len(profile):
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    weight = [float(darkness[start:end].clip(0).sum()) for start, end in merged]
+    left, right = merged[int(np.argmax(weight))]
+    return int(left), int(right)
@@ -1,13 +1,22 @@
 import cv2
 import numpy as np
+from Calibration_Utils import *
+from Edge_Utils import EdgeDetector
 
+DEFAULT_EDGE = EdgeDetector()                                   # Median of the last white pixel over 5 centered columns
+OPEN_KERNEL = np.ones((2, 2), np.uint8)                         # Kernels of the box preprocessing, allocated once
+DILATE_KERNEL = np.ones((3, 3), np.uint8)
+BOX_PADDING = 8                                                 # Adaptive threshold block (11x11) and open kernel reach
 
-class Mark(object):                                             # Marks are the top and bottom of the test tube or burette scale
+
+class Mark(object):                                             # Marks are points of the test tube or burette scale, at least top and bottom
     def __init__(self, capacity, dist, diam):
         self.yposition = []                                     # Array that holds the vertical position in pixels of the marks
         self.capacity = capacity                                # Capacity in milliliters of each mark
         self.distance = dist                                    # Distance from camera to object (tube)
         self.tube_diameter =diam                                # Tube inner diameter
+        self.lens_correction = True                             # Polynomial lens correction, off when frames are undistorted
+        self.calibration = Calibration()                        # Pixel to volume lookup table built from the marks
 
     def mark_pos(self, event, x, y, flags, parameters):
         if event == cv2.EVENT_LBUTTONDOWN:                      # Act only on a mouse left button click on the image
@@ -24,14 +33,21 @@ class Meniscus(object):                                         # Class that hol
         self.yposition = [0, 0]                                 # as vertical position (ypos), score (indicates
         self.score = [0, 0]                                     # the model confidence on the detection) and
         self.reading = [None, None]                             # reading in ml or cubic centimeters.
+        self.columns = [None, None]                             # (xmin, xmax) of each box in pixels, to locate the tube
+
 
+class Tube(object):                                             # One of several tubes side by side in the same frame
+    def __init__(self, name, roi, marks: Mark, channel=0):
+        self.name = name
+        self.roi = roi                                          # (x1, x2, y1, y2) in the rotated frame
+        self.marks = marks                                      # Marks positions are relative to the tube ROI
+        self.channel = channel                                  # TCP port the readings are sent to, 0 for none
 
-def meniscus_draw(image, boxes, scores, marks: Mark, max_boxes=20, min_score_thresh=.5):
+
+def meniscus_draw(image, boxes, scores, marks: Mark, max_boxes=20, min_score_thresh=.5, edge: EdgeDetector = None):
+    if edge is None:
+        edge = DEFAULT_EDGE
     meniscus = Meniscus()
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)              # Convert image to BW and apply adaptive threshold
-    processed_img = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
-    kernel = np.ones((2, 2), np.uint8)
-    processed_img = cv2.morphologyEx(processed_img, cv2.MORPH_OPEN, kernel, iterations=1)
     for i in range(boxes.shape[0]):                             # Loop through boxes (highest scores come first)
         if max_boxes == i:                                      # If found the maximum amount of boxes end loop
             break
@@ -41,45 +57,44 @@ def meniscus_draw(image, boxes, scores, marks: Mark, max_boxes=20, min_score_thr
             ymax = int(ymax * image.shape[0])
             xmin = int(xmin * image.shape[1])
             xmax = int(xmax * image.shape[1])
-            detail = processed_img[ymin:ymax, xmin:xmax]        # Crop the bounding box from binary img to analyze it
-            kernel = np.ones((3, 3), np.uint8)
-            detail = cv2.dilate(detail, kernel, iterations=1)
-            meniscus.yposition[i] = detect_lower_edge(detail, ymin, i)      # Detect lower edge and reading
+            if ymax <= ymin or xmax <= xmin:                    # Degenerate box, nothing to analyze
+                continue
+            detail, gray = box_detail(image, ymin, ymax, xmin, xmax)
+            meniscus.yposition[i] = edge.detect(detail, ymin, gray)     # Detect lower edge and reading
             meniscus.score[i] = scores[i]
-    meniscus = calculate_volumes(meniscus, marks)               # Calculate volume and save in array
+            meniscus.columns[i] = (xmin, xmax)
+    meniscus = calculate_volumes(meniscus, marks, image.shape[0])  # Calculate volume and save in array
     return image, meniscus
 
 
-def detect_lower_edge(img, y, index):
-    # Evaluates pixels in a vertical line to detect the bottom of the meniscus,
-    # gets the last value that is black/white in a threshold or edged image (cropped
-    # with the bounding box. Evaluates multiple vertical lines in the center of the
-    # meniscus to avoid intermittent movement of the detected bottom due to changes
-    # in illumination.
-    POINTS_TO_AVERAGE = 5
-    center = int(img.shape[1]/2) - int(POINTS_TO_AVERAGE/2)
-    delta = [0] * POINTS_TO_AVERAGE                             # array of zeroes with length of the points to avg
-    for j in range(POINTS_TO_AVERAGE):
-        center = center + j
-        center_array = img[:, center:center + 1].flatten()
-        for index, value in enumerate(center_array):
-            if value == 255:
-                delta[j] = index
-    avg_delta = int(sum(delta)/POINTS_TO_AVERAGE)
-    return y + avg_delta
-
-
-def calculate_volumes(meniscus, marks: Mark):
-    if len(marks.yposition) == 2:                                                   # Only if two marks are defined and y is in between them
+def box_detail(image, ymin, ymax, xmin, xmax):
+    # Converts to BW and applies adaptive threshold only around a bounding box. The box is padded so the
+    # threshold and the morphological open see the same neighbourhood as on the whole image, then the box
+    # is cropped from the binary image and dilated. Returns the binary and grayscale crops of the box
+    top, bottom = max(ymin - BOX_PADDING, 0), min(ymax + BOX_PADDING, image.shape[0])
+    left, right = max(xmin - BOX_PADDING, 0), min(xmax + BOX_PADDING, image.shape[1])
+    gray = cv2.cvtColor(image[top:bottom, left:right], cv2.COLOR_RGB2GRAY)     # Frames are RGB (FrameSource.retrieve)
+    processed_img = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 11, 2)
+    processed_img = cv2.morphologyEx(processed_img, cv2.MORPH_OPEN, OPEN_KERNEL, iterations=1)
+    box = (slice(ymin - top, ymax - top), slice(xmin - left, xmax - left))
+    detail = cv2.dilate(processed_img[box], DILATE_KERNEL, iterations=1)
+    return detail, gray[box]
+
+
+def calculate_volumes(meniscus, marks: Mark, height=None):
+    # Converts the meniscus positions to volumes with the calibration lookup table of the marks.
+    # height is the ROI height in pixels, the table covers every row of the ROI
+    if len(marks.yposition) >= 2:                                                   # Only if at least two marks are defined
+        ys = np.array(meniscus.yposition, dtype=np.float64)
+        if height is None:
+            height = int(max(max(marks.yposition), ys.max())) + 2
+        volumes = marks.calibration.volumes(ys, marks, height)                      # O(1) lookup, table rebuilt only on changes
+        if volumes is None:
+            meniscus.reading = [None, None]                                         # Marks cannot be interpolated
+            return meniscus
         for index, y in enumerate(meniscus.yposition):
             if y != 0:
-                y = position_correction(y, marks)
-                total_volume_pix = abs(marks.yposition[1] - marks.yposition[0])     # Total usable pixel range
-                if marks.yposition[0] > marks.yposition[1]:                         # Non Inverted scale subtract from top mark
-                    volume = marks.capacity[1] - ((y - marks.yposition[1]) * (marks.capacity[1] - marks.capacity[0]) / total_volume_pix)
-                else:                                                               # Inverted scale, add from top mark
-                    volume = marks.capacity[0] + ((y - marks.yposition[0]) * (marks.capacity[1] - marks.capacity[0]) / total_volume_pix)
-                meniscus.reading[index] = round(volume, 2)                          # Round volume to 2 decimals and store into class element
+                meniscus.reading[index] = round(float(volumes[index]), 2)           # Round volume to 2 decimals and store into class element
             else:
                 meniscus.reading[index] = None
     else:
@@ -87,16 +102,24 @@ def calculate_volumes(meniscus, marks: Mark):
     return meniscus
 
 
-def position_correction(y, marks: Mark):                                            # Correct the yposition on the image
-    tube_diameter = marks.tube_diameter                                             # using the information of diameter of
-    distance = marks.distance                                                       # the tube and the distance from the
-    lens_correction = -2.6e-5 * y**2 + 5.12e-2 * y - 3.31                           # camera lens
-    y_corr = y + lens_correction
-    ypx = (marks.yposition[1] - marks.yposition[0])/2 - (y_corr - marks.yposition[0])
-    parallax_corr = ((tube_diameter / 2) * ypx) / distance
-    y_corr = int(y_corr - parallax_corr)
-    # print('Position: ', y, ' / Lens: ', round(lens_correction, 2), ' / Parallax: ', round(parallax_corr, 2), ' / Corrected: ', y_corr)
-    return y_corr
+def reading_order(meniscus):
+    # Readings are ordered in array by confidence, indices that reorder them so the first is the meniscus on top
+    # and the second is bottom
+    if any(x is None for x in meniscus.reading):                                    # If any of the readings is None
+        return [0, 1]                                                               # the first one can be the only one with value
+    top = meniscus.yposition.index(min(meniscus.yposition))                         # Image has its origin position (0, 0) on top left corner
+    return [top, 1 - top]
+
+
+def order_readings(meniscus):
+    return [meniscus.reading[index] for index in reading_order(meniscus)]
+
+
+def ordered_meniscus(meniscus):
+    # Readings, positions and scores in the order of order_readings, so each column of a row (CSV, record,
+    # registers) describes the same interface
+    order = reading_order(meniscus)
+    return [meniscus.reading[i] for i in order], [meniscus.yposition[i] for i in order], [meniscus.score[i] for i in order]
 
 
 def draw_levels(img, meniscus, canvas_height, cam_height, line_width=1, font_size=1):   # Draws a horizontal line at the bottom of the meniscus
@@ -107,7 +130,7 @@ def draw_levels(img, meniscus, canvas_height, cam_height, line_width=1, font_siz
             end = (img.shape[1], line)                                                  # End of horizontal line (img.shape[1] is the width of img)
             cv2.line(img, start, end, (255, 0, 0), line_width)
             confidence = 'C= ' + str(round(meniscus.score[index] * 100, 0)) + '%'       # Prints confidence value from the Tensorflow Object Detection API
-            position = 'Y= ' + str(y) + 'px'                                            # Prints position on the image in pixels
+            position = 'Y= ' + str(round(y, 1)) + 'px'                                  # Prints position on the image in pixels
             cv2.putText(img, confidence, (img.shape[1]-90*font_size, line - 3*font_size), cv2.FONT_HERSHEY_PLAIN, font_size, (255, 0, 0), line_width, cv2.LINE_AA)
             cv2.putText(img, position, (10, line + 14*font_size), cv2.FONT_HERSHEY_PLAIN, font_size, (255, 0, 0), line_width, cv2.LINE_AA)
             if meniscus.reading[index] is not None:                                     # Put volume only if there is a value
@@ -133,3 +156,21 @@ def draw_marks(img, marks: Mark, canvas_height, cam_height, line_width=1, font_s
         cv2.putText(img, position, (10, line + 14*font_size), cv2.FONT_HERSHEY_PLAIN, font_size, (0, 255, 0), line_width, cv2.LINE_AA)
         capacity = 'V= ' + str(marks.capacity[index]) + 'ml'                            # Prints the mark in volume scale in cubic centimeters
         cv2.putText(img, capacity, (10, line - 3*font_size), cv2.FONT_HERSHEY_PLAIN, font_size, (0, 255, 0), line_width, cv2.LINE_AA)
+
+
+def draw_tubes(img, tube_results, scale, line_width=1, font_size=1):
+    # Draws the ROI, name and meniscus levels of every tube on a frame resized by scale from the rotated frame
+    for tube, meniscus, readings in tube_results:
+        x1, x2, y1, y2 = [int(value * scale) for value in tube.roi]
+        cv2.rectangle(img, (x1, y1), (x2, y2), (0, 0, 0), line_width)
+        cv2.putText(img, tube.name, (x1 + 3, y1 + 14*font_size), cv2.FONT_HERSHEY_PLAIN, font_size, (0, 0, 0), line_width, cv2.LINE_AA)
+        for index, y in enumerate(meniscus.yposition):
+            if y != 0:
+                line = int(y * scale) + y1                                              # Meniscus position is relative to the tube ROI
+                cv2.line(img, (x1, line), (x2, line), (255, 0, 0), line_width)
+                if meniscus.reading[index] is not None:
+                    volume = str(meniscus.reading[index]) + 'ml'
+                    cv2.putText(img, volume, (x1 + 3, line - 3*font_size), cv2.FONT_HERSHEY_PLAIN, font_size, (255, 0, 0), line_width, cv2.LINE_AA)
+        for y in tube.marks.yposition:
+            line = int(y * scale) + y1
+            cv2.line(img, (x1, line), (x2, line), (0, 255, 0), line_width)
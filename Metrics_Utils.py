@@ -0,0 +1,227 @@
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+STAGES = (('capture', 'crop'), ('crop', 'inference'), ('inference', 'post'), ('post', 'render'))   # FramePacket stamps
+STAGE_HELP = 'Time from the end of the previous stage to the end of each stage, queue waits included'
+
+
+class Histogram:                                                # Cumulative histogram in the Prometheus sense
+    def __init__(self, name, help_, buckets=LATENCY_BUCKETS_MS, labels=None):
+        self.name = name
+        self.help = help_
+        self.buckets = tuple(buckets)
+        self.labels = labels or {}
+        self.counts = [0] * (len(self.buckets) + 1)             # Last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):                                   # About a microsecond, cheap enough to leave on
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):                                      # Approximate quantile, linear inside the bucket
+        with self.lock:
+            counts, total = list(self.counts), self.count
+        if total == 0:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for index, count in enumerate(counts):
+            if seen + count >= rank and count:
+                low = self.buckets[index - 1] if index > 0 else 0.0
+                high = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+        return float(self.buckets[-1])
+
+    def lines(self, name):
+        with self.lock:
+            counts, total, sum_ = list(self.counts), self.count, self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append(name + '_bucket' + label_text(self.labels, le=bound) + ' ' + str(cumulative))
+        lines.append(name + '_sum' + label_text(self.labels) + ' ' + repr(round(sum_, 6)))
+        lines.append(name + '_count' + label_text(self.labels) + ' ' + str(total))
+        return lines
+
+
+class Registry:
+    # Metrics of the process. Histograms are pushed with observe(), counters and gauges are pulled from
+    # callables when the endpoint is scraped, so the pipeline threads only keep plain integer attributes
+    def __init__(self):
+        self.histograms = {}                                    # name -> list of Histogram (one per label set)
+        self.callbacks = []                                     # (name, type, help, callable returning value or {labels: value})
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help_, buckets=LATENCY_BUCKETS_MS, **labels):
+        with self.lock:
+            for histogram in self.histograms.setdefault(name, []):
+                if histogram.labels == labels:
+                    return histogram
+            histogram = Histogram(name, help_, buckets, labels)
+            self.histograms[name].append(histogram)
+            return histogram
+
+    def counter(self, name, help_, function):                   # Monotonic value, e.g. frames captured
+        self.callbacks.append((name, 'counter', help_, function))
+
+    def gauge(self, name, help_, function):                     # Current value, e.g. RSS
+        self.callbacks.append((name, 'gauge', help_, function))
+
+    def exposition(self):                                       # Prometheus text exposition format 0.0.4
+        lines = []
+        with self.lock:
+            histograms = {name: list(values) for name, values in self.histograms.items()}
+        for name, values in histograms.items():
+            lines.append('# HELP ' + name + ' ' + values[0].help)
+            lines.append('# TYPE ' + name + ' histogram')
+            for histogram in values:
+                lines += histogram.lines(name)
+        for name, type_, help_, function in self.callbacks:
+            try:
+                value = function()
+            except Exception:                                   # A failing metric never breaks the endpoint
+                continue
+            lines.append('# HELP ' + name + ' ' + help_)
+            lines.append('# TYPE ' + name + ' ' + type_)
+            samples = value if isinstance(value, dict) else {(): value}
+            for labels, sample in samples.items():
+                lines.append(name + label_text(dict(labels)) + ' ' + repr(float(sample)))
+        return '\n'.join(lines) + '\n'
+
+    def observe_packet(self, packet):
+        # Stage latencies of a FramePacket from its timestamps, the stages it went through only
+        stamps = packet.timestamps
+        for start, end in STAGES:
+            if start in stamps and end in stamps:
+                self.histogram('level_meter_stage_latency_ms', STAGE_HELP, stage=end).observe(
+                    (stamps[end] - stamps[start]) * 1000)
+        last = max(stamps, key=stamps.get)
+        self.histogram('level_meter_frame_latency_ms', 'Time from capture to the end of the last stage').observe(
+            (stamps[last] - stamps['capture']) * 1000)
+
+
+class MetricsServer(threading.Thread):                          # GET /metrics on a local port, serves the registry
+    def __init__(self, registry: Registry, host='127.0.0.1', port=9464):
+        super().__init__(name='metrics', daemon=True)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.exposition().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):                       # Scrapes are not printed with the readings
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self.server.server_address[1]
+
+    def run(self):
+        self.server.serve_forever(poll_interval=0.5)
+
+    def close(self):
+        if self.is_alive():                                     # shutdown() waits forever if serve_forever never ran
+            self.server.shutdown()
+        self.server.server_close()
+
+
+def register_supervisor(registry: Registry, supervisor):
+    # Pull metrics of the stations of a Supervisor, one label per station
+    def per_station(function):
+        return lambda: {(('station', station.name),): function(station) for station in supervisor.stations}
+    registry.counter('level_meter_station_frames_total', 'Readings received from each station process',
+                     per_station(lambda station: station.frames))
+    registry.counter('level_meter_station_restarts_total', 'Station processes restarted after a crash or hang',
+                     per_station(lambda station: station.restarts))
+    registry.gauge('level_meter_station_up', '1 while the station process is running',
+                   per_station(lambda station: int(station.process is not None and station.process.is_alive())))
+    if supervisor.shared_detector:
+        registry.counter('level_meter_detector_restarts_total', 'Shared detector process restarts',
+                         lambda: supervisor.detector_restarts)
+        registry.gauge('level_meter_detector_ready', '1 while the shared detector has the model loaded',
+                       lambda: int(supervisor.ready.is_set()))
+    registry.gauge('level_meter_resident_memory_mb', 'Resident memory of the process', rss_mb)
+
+
+def label_text(labels, **extra):                               # {stage="post",le="10"} or empty
+    labels = dict(labels, **{key: value for key, value in extra.items()})
+    if not labels:
+        return ''
+    return '{' + ','.join(key + '="' + str(value) + '"' for key, value in sorted(labels.items())) + '}'
+
+
+def rss_mb():                                                   # Resident memory of this process in MB
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20
+    except ImportError:
+        with open('/proc/self/statm') as f:                     # Linux without psutil
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+def register_pipeline(registry: Registry, capture=None, worker=None, frames=None, results=None, scheduler=None,
+                      engine=None, links=None, recorder=None, archiver=None,
+                      modbus=None, locator=None):
+    # Pull metrics of the pipeline parts that exist. links: {channel: OutputLink}, engine: callable returning
+    # the engine (it may still be loading), recorder: ReadingRecorder, archiver: FrameArchiver, modbus: ModbusServer,
+    # locator: TubeLocator
+    if capture is not None:
+        registry.counter('level_meter_frames_captured_total', 'Frames grabbed from the source', lambda: capture.grabbed)
+        registry.counter('level_meter_frames_skipped_total', 'Frames grabbed but not decoded, inference was busy',
+                         lambda: capture.skipped)
+    if worker is not None:
+        registry.counter('level_meter_frames_processed_total', 'Frames through detection and post processing',
+                         lambda: worker.processed)
+    if frames is not None and results is not None:
+        registry.counter('level_meter_frames_dropped_total', 'Frames replaced in a queue before being consumed',
+                         lambda: {(('queue', 'frames'),): frames.dropped, (('queue', 'results'),): results.dropped})
+    if scheduler is not None:
+        registry.counter('level_meter_detector_invocations_total', 'Full detector runs with motion gating',
+                         lambda: scheduler.detector_calls)
+    if engine is not None:
+        registry.counter('level_meter_inference_calls_total', 'Calls to the inference engine', lambda: engine().calls)
+        registry.gauge('level_meter_inference_latency_ms', 'Latency of the last inference call', lambda: engine().latency_ms)
+    if links:
+        for stat, type_, help_ in (('sent', 'counter', 'Readings written to the socket'),
+                                   ('dropped', 'counter', 'Readings dropped because the buffer was full'),
+                                   ('reconnects', 'counter', 'Successful reconnections of the output socket'),
+                                   ('connect_failures', 'counter', 'Failed connection attempts of the output socket'),
+                                   ('connected', 'gauge', '1 while the output socket is connected')):
+            function = (lambda stat=stat: {(('channel', channel),): link.stats()[stat] for channel, link in links.items()})
+            (registry.counter if type_ == 'counter' else registry.gauge)('level_meter_output_' + stat + ('_total' if type_ == 'counter' else ''),
+                                                                         help_, function)
+    if recorder is not None:
+        registry.counter('level_meter_readings_recorded_total', 'Readings written to the record folder',
+                         lambda: recorder.written)
+        registry.counter('level_meter_readings_record_dropped_total', 'Readings dropped because the record buffer was full',
+                         lambda: recorder.dropped)
+    if archiver is not None:
+        registry.counter('level_meter_frames_archived_total', 'Frames saved to the archive folder', lambda: archiver.archived)
+        registry.counter('level_meter_frames_archive_skipped_total', 'Archive triggers dropped because the writers were busy',
+                         lambda: archiver.skipped)
+        registry.gauge('level_meter_archive_size_mb', 'Size of the archive folder', lambda: archiver.size / 2**20)
+        registry.counter('level_meter_archive_failures_total', 'Archive saves that raised an error', lambda: archiver.failed)
+    if modbus is not None:
+        registry.counter('level_meter_modbus_requests_total', 'Modbus requests served', lambda: modbus.requests)
+        registry.gauge('level_meter_modbus_clients', 'Connected Modbus clients', lambda: modbus.clients)
+    if locator is not None:
+        registry.gauge('level_meter_roi_pixels_saved_ratio', 'Fraction of the ROI pixels left out by the auto ROI window',
+                       locator.pixels_saved)
+        registry.counter('level_meter_roi_searches_total', 'Tube searches of the auto ROI', lambda: locator.searches)
+    registry.gauge('level_meter_resident_memory_mb', 'Resident memory of the process', rss_mb)
@@ -0,0 +1,253 @@
+import asyncio
+import socket
+import struct
+import threading
+import time
+from Meniscus_Utils import Mark, ordered_meniscus
+
+# Input registers of each tube, 16 registers per tube (tube n starts at n * TUBE_REGISTERS). Floats are
+# IEEE 754 big endian, high word first. The x100 copies are for PLCs without float support.
+TUBE_REGISTERS = 16
+INTF1, INTF2, YPOS1, YPOS2 = 0, 2, 4, 6                         # float32, NaN without a value or detection
+SCORE1, SCORE2 = 8, 9                                           # Confidence in 0.1 %
+SEQUENCE = 10                                                   # uint32, incremented on every reading
+STATUS = 12                                                     # Status word, STATUS_ bits
+AGE = 13                                                        # Tenths of a second since the last reading, saturated
+INTF1_X100, INTF2_X100 = 14, 15                                 # int16 ml x 100, NO_VALUE without a value
+NO_VALUE = -32768
+STATUS_MODEL_READY = 1                                          # Readings come from the detector, not the loading preview
+STATUS_INTF1 = 2                                                # Interface 1 has a value
+STATUS_INTF2 = 4
+STATUS_MARKS = 8                                                # At least two marks, volumes can be calculated
+STATUS_STALE = 16                                               # No reading for more than stale seconds
+
+# Holding registers, the marks of the volume calculation (single tube). A write is applied when the marks
+# it leaves are valid (count 2 to MAX_MARKS, positions all increasing or all decreasing), otherwise it is rejected.
+MAX_MARKS = 8
+MARK_COUNT = 0
+MARK_PX = 1                                                     # MAX_MARKS uint16 positions in pixels inside the ROI
+MARK_ML = MARK_PX + MAX_MARKS                                   # MAX_MARKS float32 capacities
+HOLDING_REGISTERS = MARK_ML + 2 * MAX_MARKS
+
+READ_HOLDING, READ_INPUT, WRITE_SINGLE, WRITE_MULTIPLE = 3, 4, 6, 16
+ILLEGAL_FUNCTION, ILLEGAL_ADDRESS, ILLEGAL_VALUE = 1, 2, 3
+MAX_READ = 125                                                  # Modbus limit of registers per read
+
+
+class ModbusServer(threading.Thread):
+    # Modbus/TCP server running an asyncio loop on its own thread, any number of pollers are served
+    # concurrently. update() packs the readings of a packet into a new register block and swaps it in, so
+    # the caller never waits for a client and clients always read a consistent block.
+    def __init__(self, marks: Mark = None, host='127.0.0.1', port=502, tubes=1, stale=5.0):
+        super().__init__(name='modbus', daemon=True)
+        self.marks = marks                                      # Written through the holding registers, None for read only
+        self.host = host
+        self.stale = stale
+        self.registers = [0] * (TUBE_REGISTERS * tubes)
+        for tube in range(tubes):
+            self.registers[tube * TUBE_REGISTERS:(tube + 1) * TUBE_REGISTERS] = empty_block()
+        self.updated = [0.0] * tubes                            # Monotonic time of the last reading of each tube
+        self.sequence = [0] * tubes
+        self.marks_changed = 0                                  # Incremented on every accepted mark write
+        self.requests = 0
+        self.clients = 0
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, host, port))
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        self.loop.close()
+
+    def close(self):
+        if self.is_alive():
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+            self.join(2.0)
+        else:
+            self.server.close()
+
+    async def shutdown(self):                                   # Closes the listener and the client connections
+        self.server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def update(self, packet):                                   # Publishes the readings of an analysed FramePacket
+        if packet.tube_results:
+            for index, (tube, meniscus, readings) in enumerate(packet.tube_results[:len(self.updated)]):
+                self.set_tube(index, readings, meniscus, tube.marks, not packet.loading)
+        else:
+            self.set_tube(0, packet.readings, packet.meniscus, self.marks, not packet.loading)
+
+    def set_tube(self, tube, readings, meniscus, marks, ready):    # readings top interface first, as order_readings
+        _, yposition, score = ordered_meniscus(meniscus)        # Positions and scores of the same interfaces
+        self.sequence[tube] = (self.sequence[tube] + 1) & 0xFFFFFFFF
+        status = (STATUS_MODEL_READY if ready else 0) | (STATUS_INTF1 if readings[0] is not None else 0) | \
+                 (STATUS_INTF2 if readings[1] is not None else 0) | \
+                 (STATUS_MARKS if marks is not None and len(marks.yposition) >= 2 else 0)
+        block = float_registers(readings[0]) + float_registers(readings[1]) + \
+            float_registers(yposition[0] or None) + float_registers(yposition[1] or None) + \
+            [int(min(max(score[0], 0), 1) * 1000), int(min(max(score[1], 0), 1) * 1000)] + \
+            [self.sequence[tube] >> 16, self.sequence[tube] & 0xFFFF, status, 0, x100(readings[0]), x100(readings[1])]
+        registers = list(self.registers)
+        registers[tube * TUBE_REGISTERS:(tube + 1) * TUBE_REGISTERS] = block
+        self.registers = registers                              # Swapped as a whole, readers never see half an update
+        self.updated[tube] = time.monotonic()
+
+    def input_registers(self):                                  # Registers with the age and the status bits of now
+        registers = list(self.registers)
+        now = time.monotonic()
+        for tube, updated in enumerate(self.updated):
+            age = now - updated if updated else float('inf')
+            registers[tube * TUBE_REGISTERS + AGE] = int(min(age * 10, 0xFFFF))
+            if age > self.stale:
+                registers[tube * TUBE_REGISTERS + STATUS] |= STATUS_STALE
+        return registers
+
+    def holding_registers(self):                                # Current marks in the holding register layout
+        registers = [0] * HOLDING_REGISTERS
+        if self.marks is None:
+            return registers
+        positions, capacities = list(self.marks.yposition)[:MAX_MARKS], list(self.marks.capacity)[:MAX_MARKS]
+        registers[MARK_COUNT] = len(positions)
+        for index, position in enumerate(positions):
+            registers[MARK_PX + index] = int(position) & 0xFFFF
+        for index, capacity in enumerate(capacities):
+            registers[MARK_ML + 2 * index:MARK_ML + 2 * index + 2] = float_registers(capacity)
+        return registers
+
+    def write_holding(self, address, values):                   # Returns a Modbus exception code, 0 when applied
+        if self.marks is None:
+            return ILLEGAL_FUNCTION
+        if address + len(values) > HOLDING_REGISTERS:
+            return ILLEGAL_ADDRESS
+        registers = self.holding_registers()
+        registers[address:address + len(values)] = values
+        count = registers[MARK_COUNT]
+        positions = registers[MARK_PX:MARK_PX + count]
+        capacities = [register_float(registers, MARK_ML + 2 * index) for index in range(count)]
+        steps = [b - a for a, b in zip(positions, positions[1:])]
+        if not 2 <= count <= MAX_MARKS or not (all(step > 0 for step in steps) or all(step < 0 for step in steps)) or \
+                any(c != c for c in capacities):                # Marks may be set top or bottom first, never repeated
+            return ILLEGAL_VALUE
+        self.marks.yposition, self.marks.capacity = positions, capacities  # New lists, the worker sees old or new
+        self.marks_changed += 1
+        return 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.clients += 1
+        sock = writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        try:
+            while True:
+                header = await reader.readexactly(7)            # MBAP: transaction, protocol, length, unit
+                transaction, protocol, length, unit = struct.unpack('>HHHB', header)
+                if length < 2 or length > 254:
+                    break
+                pdu = await reader.readexactly(length - 1)
+                if protocol != 0:
+                    continue
+                response = self.respond(pdu)
+                writer.write(struct.pack('>HHHB', transaction, 0, len(response) + 1, unit) + response)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):   # Client left or server closing
+            pass
+        finally:
+            self.clients -= 1
+            writer.close()
+
+    def respond(self, pdu):                                     # Response PDU of a request PDU
+        self.requests += 1
+        function = pdu[0]
+        try:
+            if function in (READ_HOLDING, READ_INPUT):
+                address, count = struct.unpack('>HH', pdu[1:5])
+                registers = self.holding_registers() if function == READ_HOLDING else self.input_registers()
+                if not 1 <= count <= MAX_READ:
+                    return exception(function, ILLEGAL_VALUE)
+                if address + count > len(registers):
+                    return exception(function, ILLEGAL_ADDRESS)
+                return struct.pack('>BB' + 'H' * count, function, 2 * count, *registers[address:address + count])
+            if function == WRITE_SINGLE:
+                address, value = struct.unpack('>HH', pdu[1:5])
+                error = self.write_holding(address, [value])
+                return exception(function, error) if error else pdu[:5]
+            if function == WRITE_MULTIPLE:
+                address, count, size = struct.unpack('>HHB', pdu[1:6])
+                if not 1 <= count <= 123 or size != 2 * count or len(pdu) < 6 + size:
+                    return exception(function, ILLEGAL_VALUE)
+                error = self.write_holding(address, list(struct.unpack('>' + 'H' * count, pdu[6:6 + size])))
+                return exception(function, error) if error else pdu[:5]
+        except struct.error:
+            return exception(function, ILLEGAL_VALUE)
+        return exception(function, ILLEGAL_FUNCTION)
+
+
+class ModbusClient:                                             # Minimal blocking client, to check the server locally
+    def __init__(self, host='127.0.0.1', port=502, unit=1, timeout=2.0):
+        self.sock = socket.create_connection((host, port), timeout)
+        self.unit = unit
+        self.transaction = 0
+
+    def request(self, pdu):
+        self.transaction = (self.transaction + 1) & 0xFFFF
+        self.sock.sendall(struct.pack('>HHHB', self.transaction, 0, len(pdu) + 1, self.unit) + pdu)
+        header = self.receive(7)
+        response = self.receive(struct.unpack('>HHHB', header)[2] - 1)
+        if response[0] & 0x80:
+            raise ValueError("Modbus exception", response[1])
+        return response
+
+    def receive(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("Modbus server closed the connection")
+            data += chunk
+        return data
+
+    def read_input(self, address, count):
+        response = self.request(struct.pack('>BHH', READ_INPUT, address, count))
+        return list(struct.unpack('>' + 'H' * count, response[2:]))
+
+    def read_holding(self, address, count):
+        response = self.request(struct.pack('>BHH', READ_HOLDING, address, count))
+        return list(struct.unpack('>' + 'H' * count, response[2:]))
+
+    def write(self, address, values):
+        self.request(struct.pack('>BHHB' + 'H' * len(values), WRITE_MULTIPLE, address, len(values), 2 * len(values), *values))
+
+    def close(self):
+        self.sock.close()
+
+
+def empty_block():                                              # Tube registers before the first reading
+    block = [0] * TUBE_REGISTERS
+    for register in (INTF1, INTF2, YPOS1, YPOS2):
+        block[register:register + 2] = float_registers(None)
+    block[INTF1_X100] = block[INTF2_X100] = NO_VALUE & 0xFFFF
+    return block
+
+
+def float_registers(value):                                     # float32 as two registers, NaN for None
+    high, low = struct.unpack('>HH', struct.pack('>f', float('nan') if value is None else value))
+    return [high, low]
+
+
+def register_float(registers, address):
+    return struct.unpack('>f', struct.pack('>HH', registers[address], registers[address + 1]))[0]
+
+
+def x100(value):                                                # int16 register of a volume x 100
+    if value is None:
+        return NO_VALUE & 0xFFFF
+    return int(round(min(max(value * 100, -32767), 32767))) & 0xFFFF
+
+
+def exception(function, code):
+    return struct.pack('>BB', function | 0x80, code)
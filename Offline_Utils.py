@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import cv2
+from Inference_Utils import *
+from Pipeline_Utils import *
+
+engine = None                                                   # Detection engine of each worker process
+undistorters = {}                                               # Undistorter of each calibration file, per worker process
+
+
+def init_worker(backend, threads, batch_size):                  # Runs once in every worker process of the pool
+    global engine
+    if backend == 'tf':
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    engine = create_engine(backend, threads, batch_size)
+
+
+def frame_jobs(frame_count, step, chunk):
+    # Splits frames [0, frame_count) in ranges of `chunk` analysed frames. Ranges start on a multiple
+    # of step so every worker analyses the same frames a single process would
+    span = step * chunk
+    return [(start, min(start + span, frame_count)) for start in range(0, frame_count, span)]
+
+
+def analyse_range(job):
+    # Decodes frames [start, stop) of the video, keeps one frame every `step`, detects meniscus in batches
+    # and returns one row (frame, time, intf1, intf2, ypos1, ypos2, score1, score2) per analysed frame.
+    # Skipped frames are only grabbed, never decoded to an image
+    video, start, stop, step, fps, roi, marks, edge, calibration = job
+    undistort = None
+    if calibration:                                             # Maps are built (or loaded) once per worker process
+        undistort = undistorters.setdefault(calibration, Undistorter(calibration))
+    vid = cv2.VideoCapture(video)
+    vid.set(cv2.CAP_PROP_POS_FRAMES, start)
+    rows = []
+    packets = []
+    for index in range(start, stop):
+        if (index - start) % step:
+            if not vid.grab():
+                break
+            continue
+        ret, frame = vid.read()
+        if not ret:
+            break
+        packet = FramePacket(None, roi)
+        packet.t_capture = index / fps                          # Video time of the frame
+        packet.frame = crop_frame(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB), roi, undistort)
+        packet.index = index
+        packets.append(packet)
+        if len(packets) == engine.batch_size:
+            rows += analyse_batch(packets, marks, edge)
+            packets = []
+    if packets:
+        rows += analyse_batch(packets, marks, edge)
+    vid.release()
+    return rows
+
+
+def analyse_batch(packets, marks, edge):                              # One detector call for a batch of frames
+    rows = []
+    detections = engine.detect_batch([packet.frame for packet in packets])
+    for packet, detection in zip(packets, detections):
+        process_detections(packet, detection, marks, edge=edge)
+        readings, yposition, score = ordered_meniscus(packet.meniscus)     # Every column top interface first
+        rows.append([packet.index, round(packet.t_capture, 3), readings[0], readings[1]]
+                    + [round(float(y), 2) for y in yposition] + [round(float(value), 3) for value in score])
+    return rows
+
+
+def analyse_video(video, roi, marks, edge=None, calibration='', backend='tf', workers=None, batch_size=8, every=0.0, chunk=64, on_progress=None):
+    # Analyses a recorded video in a pool of worker processes, each one with its own detection engine.
+    # every: seconds of video between analysed frames (0 analyses all frames), calibration: camera calibration
+    # file to undistort the ROI with, empty for none. Returns the rows of all
+    # analysed frames sorted by frame number
+    vid = cv2.VideoCapture(video)
+    if not vid.isOpened():
+        raise ValueError("Unable to open video source", video)
+    frame_count = int(vid.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = vid.get(cv2.CAP_PROP_FPS) or 1.0
+    vid.release()
+    workers = workers or os.cpu_count()
+    threads = max(1, os.cpu_count() // workers)                 # Split the cores between the workers
+    step = max(1, int(round(every * fps)))
+    jobs = [(video, start, stop, step, fps, roi, marks, edge, calibration) for start, stop in frame_jobs(frame_count, step, chunk)]
+    rows = []
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(backend, threads, batch_size)) as pool:
+        for done, result in enumerate(pool.imap_unordered(analyse_range, jobs), 1):
+            rows += result
+            if on_progress:
+                on_progress(done, len(jobs))
+    rows.sort(key=lambda row: row[0])                           # Merge back in frame (timestamp) order
+    return rows
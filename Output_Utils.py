@@ -0,0 +1,120 @@
+import collections
+import select
+import socket
+import threading
+import time
+
+
+class OutputLink(threading.Thread):
+    # Keeps one long lived TCP connection to the reading consumer (Labview) and sends from a background
+    # thread, so send() never blocks the caller. Readings are buffered while disconnected (oldest are
+    # dropped when the buffer is full) and up to `batch` readings are coalesced in a single write.
+    def __init__(self, host, port, max_buffer=1000, batch=1, min_backoff=0.5, max_backoff=30.0, timeout=2.0):
+        super().__init__(name='output', daemon=True)
+        self.host = host
+        self.port = port
+        self.max_buffer = max_buffer
+        self.batch = max(1, batch)
+        self.min_backoff = min_backoff                          # Seconds to wait before the first reconnect attempt,
+        self.max_backoff = max_backoff                          # doubled on each failure up to max_backoff
+        self.timeout = timeout
+        self.buffer = collections.deque()
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.sock = None
+        self.connected = False
+        self.sent = 0                                           # Readings written to the socket
+        self.dropped = 0                                        # Readings discarded because the buffer was full
+        self.reconnects = 0                                     # Connections established after the first one
+        self.connect_failures = 0
+        self.connections = 0
+
+    def send(self, line):                                       # Queue one reading line, never blocks
+        with self.condition:
+            if len(self.buffer) >= self.max_buffer:
+                self.buffer.popleft()
+                self.dropped += 1
+            self.buffer.append(line)
+            self.condition.notify()
+
+    def send_readings(self, readings):                          # Same "intf1,intf2\r\n" line Labview always received
+        self.send(str(readings[0]) + ',' + str(readings[1]) + "\r\n")
+
+    def stats(self):
+        return {'sent': self.sent, 'dropped': self.dropped, 'reconnects': self.reconnects,
+                'connect_failures': self.connect_failures, 'buffered': len(self.buffer), 'connected': self.connected}
+
+    def run(self):
+        backoff = self.min_backoff
+        while not self.stopped.is_set():
+            if self.sock is None:
+                if not self.connect():
+                    self.stopped.wait(backoff)                  # Interrupted right away by close()
+                    backoff = min(backoff * 2, self.max_backoff)
+                    continue
+                backoff = self.min_backoff
+            lines = self.next_batch()
+            if lines:
+                self.write(lines)
+
+    def next_batch(self):                                       # Waits for readings and takes up to self.batch of them
+        with self.condition:
+            while not self.buffer and not self.stopped.is_set():
+                self.condition.wait(0.5)
+                if self.sock is not None and self.peer_closed():
+                    self.disconnect()
+                    return []
+            return [self.buffer.popleft() for _ in range(min(self.batch, len(self.buffer)))]
+
+    def write(self, lines):
+        try:
+            self.sock.sendall(''.join(lines).encode('ascii'))
+            self.sent += len(lines)
+        except OSError:                                         # Connection lost, put readings back and reconnect
+            self.disconnect()
+            with self.condition:
+                self.buffer.extendleft(reversed(lines))
+                while len(self.buffer) > self.max_buffer:
+                    self.buffer.popleft()
+                    self.dropped += 1
+
+    def connect(self):
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            self.sock = None
+            self.connect_failures += 1
+            return False
+        if self.connections > 0:
+            self.reconnects += 1
+        self.connections += 1
+        self.connected = True
+        return True
+
+    def peer_closed(self):                                      # The consumer closed its end, recv returns b''
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+            return bool(readable) and self.sock.recv(1, socket.MSG_PEEK) == b''
+        except OSError:
+            return True
+
+    def disconnect(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+        self.sock = None
+        self.connected = False
+
+    def close(self, flush_timeout=1.0):                         # Try to flush pending readings, then stop the thread
+        deadline = time.monotonic() + flush_timeout
+        while self.buffer and self.connected and time.monotonic() < deadline:
+            self.stopped.wait(0.05)
+        self.stopped.set()
+        with self.condition:
+            self.condition.notify()
+        if self.is_alive():
+            self.join(self.timeout + 1)
+        self.disconnect()
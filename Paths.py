@@ -21,11 +21,16 @@ paths = {
     'OUTPUT_PATH': os.path.join('Tensorflow', 'workspace', 'models', CUSTOM_MODEL_NAME, 'export'),
     'TFJS_PATH': os.path.join('Tensorflow', 'workspace', 'models', CUSTOM_MODEL_NAME, 'tfjsexport'),
     'TFLITE_PATH': os.path.join('Tensorflow', 'workspace', 'models', CUSTOM_MODEL_NAME, 'tfliteexport'),
+    'MODEL_CACHE_PATH': os.path.join('Tensorflow', 'workspace', 'models', CUSTOM_MODEL_NAME, 'cache'),
     'PROTOC_PATH': os.path.join('Tensorflow', 'protoc')
 }
 files = {
     'PIPELINE_CONFIG': os.path.join('Tensorflow', 'workspace', 'models', CUSTOM_MODEL_NAME, 'pipeline.config'),
     'TF_RECORD_SCRIPT': os.path.join(paths['SCRIPTS_PATH'], TF_RECORD_SCRIPT_NAME),
-    'LABELMAP': os.path.join(paths['ANNOTATION_PATH'], LABEL_MAP_NAME)
+    'LABELMAP': os.path.join(paths['ANNOTATION_PATH'], LABEL_MAP_NAME),
+    'CHECKPOINT': os.path.join(paths['CHECKPOINT_PATH'], 'ckpt-21'),
+    'TEST_RECORD': os.path.join(paths['ANNOTATION_PATH'], 'test.record'),
+    'TFLITE_FP16': os.path.join(paths['TFLITE_PATH'], 'detect_fp16.tflite'),
+    'TFLITE_INT8': os.path.join(paths['TFLITE_PATH'], 'detect_int8.tflite')
 }
 labels = [{'name':'meniscus', 'id':1}]
\ No newline at end of file
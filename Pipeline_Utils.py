@@ -0,0 +1,289 @@
+import queue
+import threading
+import time
+import cv2
+from Camera_Utils import Undistorter
+from Meniscus_Utils import *
+from Tracking_Utils import DetectionScheduler
+
+
+class FramePacket:                                              # A frame and its results travelling through the pipeline
+    def __init__(self, frame, roi):
+        self.t_capture = time.time()                            # Wall clock capture time, used to tag the readings
+        self.index = 0                                          # Frame number in the source
+        self.timestamps = {'capture': time.perf_counter()}      # Monotonic time at which each stage finished
+        self.frame = frame                                      # Cropped RGB frame
+        self.roi = roi                                          # ROI (x1, x2, y1, y2) used to crop the frame
+        self.image = None                                       # Frame with detections, ready to render
+        self.meniscus = None
+        self.readings = [None, None]                            # Readings ordered top interface first
+        self.tube_results = []                                  # (tube, meniscus, readings) of every tube in multi tube mode
+        self.loading = False                                    # True if the frame passed through before the model was ready
+
+    def stamp(self, stage):
+        self.timestamps[stage] = time.perf_counter()
+
+    def latency_ms(self, stage):                                # Time from capture to the end of a stage
+        return (self.timestamps[stage] - self.timestamps['capture']) * 1000
+
+
+class LatestQueue:                                              # Bounded queue where the newest item always wins,
+    def __init__(self, maxsize=1):                              # a put on a full queue discards the oldest item
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+        self.waiting = threading.Event()                        # Set while the consumer is blocked in get()
+
+    def put(self, item):
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):                                # Raises queue.Empty after timeout
+        self.waiting.set()                                      # Still waiting after a timeout, the caller retries
+        item = self.queue.get(timeout=timeout)
+        self.waiting.clear()
+        return item
+
+    def full(self):                                             # True while the consumer has not taken the last item
+        return self.queue.full()
+
+    def get_nowait(self):                                       # Returns None if there is nothing new
+        try:
+            return self.queue.get_nowait()
+        except queue.Empty:
+            return None
+
+
+class Stage(threading.Thread):                                  # Base class for the pipeline worker threads
+    def __init__(self, name):
+        super().__init__(name=name, daemon=True)
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+
+class CaptureThread(Stage):                                     # Reads, crops and rotates camera frames
+    def __init__(self, vid, out_queue: LatestQueue, get_roi, undistort: Undistorter = None, locator=None):
+        super().__init__('capture')
+        self.vid = vid
+        self.out_queue = out_queue
+        self.get_roi = get_roi                                  # Callable returning the current (x1, x2, y1, y2)
+        self.undistort = undistort                              # Lens undistortion of the ROI, None to only crop
+        self.locator = locator                                  # TubeLocator narrowing the ROI, None for the whole ROI
+        self.grabbed = 0                                        # Frames grabbed from the source
+        self.skipped = 0                                        # Frames grabbed but never decoded
+
+    def run(self):
+        while self.running:
+            if not self.vid.grab():                             # Blocks until the camera delivers a frame
+                time.sleep(0.01)
+                continue
+            self.grabbed += 1
+            if not self.out_queue.waiting.is_set():             # Inference still busy, only the grab the consumer
+                self.skipped += 1                               # asks for is decoded, so it is never older than
+                continue                                        # one frame when inference starts
+            ret, frame = self.vid.retrieve()
+            if not ret:
+                continue
+            roi, crop = locate_frame(frame, self.get_roi(), self.undistort, self.locator)
+            packet = FramePacket(crop, roi)
+            packet.stamp('crop')
+            self.out_queue.put(packet)
+
+
+class InferenceWorker(Stage):                                   # Runs detection and meniscus post processing
+    def __init__(self, detect, in_queue: LatestQueue, out_queue: LatestQueue, marks: Mark, max_boxes=2, min_score_thresh=0.2,
+                 tubes=None, detect_batch=None, edge: EdgeDetector = None, ready=None):
+        super().__init__('inference')
+        self.detect = detect                                    # Callable returning the detections dict of an image
+        self.tubes = tubes                                      # Several tubes in the frame, all detected in one batch
+        self.detect_batch = detect_batch                        # with this callable
+        self.edge = edge                                        # Lower edge detector settings
+        self.ready = ready                                      # Callable, False while the model loads (frames pass through)
+        self.processed = 0                                      # Frames through detection and post processing
+        self.in_queue = in_queue
+        self.out_queue = out_queue
+        self.marks = marks
+        self.max_boxes = max_boxes
+        self.min_score_thresh = min_score_thresh
+
+    def run(self):
+        while self.running:
+            try:
+                packet = self.in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if self.ready is not None and not self.ready():
+                pass_through(packet)
+            elif self.tubes:
+                process_tubes(self.detect_batch, packet, self.tubes, self.max_boxes, self.min_score_thresh, self.edge)
+            else:
+                process_frame(self.detect, packet, self.marks, self.max_boxes, self.min_score_thresh, self.edge)
+            self.processed += 1
+            self.out_queue.put(packet)
+
+
+def crop_frame(frame, roi, undistort: Undistorter = None):     # Crops the camera frame to the ROI and rotates it
+    if undistort is not None:                                   # Undistorts, rotates and crops in one remap
+        return undistort.remap(frame, roi)
+    x1, x2, y1, y2 = roi                                        # ROI in the rotated frame, column x of the rotated
+    height = frame.shape[0]                                     # frame is row height - 1 - x of the camera frame
+    return cv2.rotate(frame[height - x2:height - x1, y1:y2], cv2.ROTATE_90_CLOCKWISE)  # Only the ROI pixels are rotated
+
+
+def locate_frame(frame, roi, undistort: Undistorter = None, locator=None):
+    # Crops the frame to the ROI, or in auto ROI mode to the tube window inside it. When the locator is due
+    # the whole ROI is cropped and searched, that frame is analysed whole. Returns the ROI used and the crop
+    if locator is None:
+        return roi, crop_frame(frame, roi, undistort)
+    if locator.due(roi):
+        crop = crop_frame(frame, roi, undistort)
+        locator.locate(crop, roi)
+        return roi, crop
+    roi = locator.crop_roi(roi)
+    return roi, crop_frame(frame, roi, undistort)
+
+
+def pass_through(packet: FramePacket):                         # Preview frame without detections while the model loads
+    packet.image = packet.frame
+    packet.meniscus = Meniscus()
+    packet.readings = [None, None]
+    packet.loading = True
+    packet.stamp('post')
+    return packet
+
+
+def process_frame(detect, packet: FramePacket, marks: Mark, max_boxes=2, min_score_thresh=0.2, edge: EdgeDetector = None):
+    # Detects meniscus in the packet frame and fills the packet with the annotated image,
+    # the Meniscus class and the readings ordered top interface first
+    detections = detect(packet.frame)
+    packet.stamp('inference')
+    return process_detections(packet, detections, marks, max_boxes, min_score_thresh, edge)
+
+
+def process_detections(packet: FramePacket, detections, marks: Mark, max_boxes=2, min_score_thresh=0.2, edge: EdgeDetector = None):
+    # Post processing of detections already computed for the packet frame (batched inference)
+    packet.image, packet.meniscus = meniscus_draw(packet.frame, detections['detection_boxes'],
+                                                  detections['detection_scores'], marks,
+                                                  max_boxes=max_boxes, min_score_thresh=min_score_thresh, edge=edge)
+    packet.readings = order_readings(packet.meniscus)
+    packet.stamp('post')
+    return packet
+
+
+def render_packet(packet: FramePacket, marks: Mark, size, line_width=1, font_size=1):
+    # Resizes the packet image to size (width, height) and draws the levels, marks and tube ROIs on the resized
+    # copy, so the full resolution frame is never copied or drawn on. Positions are scaled from the ROI height
+    image = cv2.resize(packet.image, size)
+    roi_height = packet.roi[3] - packet.roi[2]
+    if packet.tube_results:
+        draw_tubes(image, packet.tube_results, size[1] / roi_height, line_width, font_size)
+    else:
+        draw_levels(image, packet.meniscus, size[1], roi_height, line_width, font_size)    # Line and text at the meniscus lower edge
+        draw_marks(image, marks, size[1], roi_height, line_width, font_size)               # Marks of the volume calculation
+        draw_center_lines(image, line_width)                                               # Centered reference lines
+    return image
+
+
+def create_marks(cfg):                                          # Mark class with the positions and capacities in the config file
+    marks = Mark(list(cfg.marks_ml), cfg.obj_distance, cfg.tube_diam)
+    if len(cfg.marks_px) >= 2:                                  # Two or more calibration points, one capacity each
+        marks.yposition = list(cfg.marks_px)
+    marks.lens_correction = not cfg.calibration_file           # Undistorted frames need no polynomial correction
+    return marks
+
+
+def process_tubes(detect_batch, packet: FramePacket, tubes, max_boxes=2, min_score_thresh=0.2, edge: EdgeDetector = None):
+    # Detects meniscus in every tube of the packet frame (the whole rotated frame) with a single batched
+    # detector call. Each tube ROI is resized to the model input inside the engine, results are routed back
+    # to the tube marks. packet.meniscus and packet.readings hold the results of the first tube
+    crops = [packet.frame[tube.roi[2]:tube.roi[3], tube.roi[0]:tube.roi[1]] for tube in tubes]
+    detections = detect_batch(crops)
+    packet.stamp('inference')
+    packet.tube_results = []
+    for tube, crop, detection in zip(tubes, crops, detections):
+        _, meniscus = meniscus_draw(crop, detection['detection_boxes'], detection['detection_scores'], tube.marks,
+                                    max_boxes=max_boxes, min_score_thresh=min_score_thresh, edge=edge)
+        packet.tube_results.append((tube, meniscus, order_readings(meniscus)))
+    packet.image = packet.frame
+    packet.meniscus, packet.readings = packet.tube_results[0][1], packet.tube_results[0][2]
+    packet.stamp('post')
+    return packet
+
+
+def create_archiver(cfg, marks: Mark):                         # Frame archiver of the config file, None without Archive_Folder
+    if not cfg.archive_folder:
+        return None
+    from Archive_Utils import FrameArchiver
+    return FrameArchiver(cfg.archive_folder, marks, cfg.archive_change, cfg.archive_heartbeat, cfg.archive_quota_mb,
+                         cfg.archive_format, line_width=cfg.line_width, font_size=cfg.font_size)
+
+
+def create_modbus(cfg, marks: Mark, tubes):                    # Modbus/TCP server of the config file, None without Modbus_Port
+    if not cfg.modbus_port:
+        return None
+    from Modbus_Utils import ModbusServer
+    return ModbusServer(None if tubes else marks, cfg.modbus_host, cfg.modbus_port, tubes=max(1, len(tubes)))
+
+
+def create_locator(cfg, tubes=None):                            # Auto ROI of the config file, None if off or with several tubes
+    if not cfg.auto_roi or tubes:
+        return None
+    from Locate_Utils import TubeLocator
+    return TubeLocator(cfg.auto_roi_aspect, period=cfg.auto_roi_period)
+
+
+def create_tubes(cfg, frame_size=None):
+    # Tube classes from the Tube= lines of the config file, each one with the format
+    # name,x1,x2,y1,y2,min_px,max_px,min_ml,max_ml,diameter,channel
+    # ROI is in pixels of the rotated frame, marks in pixels inside the ROI and channel is the TCP port
+    # the tube readings are sent to (0 for none). With frame_size (width, height of the rotated frame) the
+    # ROI must be inside the frame. Raises ValueError with the line if a field is missing or wrong
+    tubes = []
+    for line in cfg.tubes:
+        values = [value.strip() for value in line.split(',')]
+        if len(values) != 11 or not values[0]:
+            raise ValueError("Tube= needs name,x1,x2,y1,y2,min_px,max_px,min_ml,max_ml,diameter,channel", line)
+        try:
+            roi = tuple(int(value) for value in values[1:5])
+            yposition = [int(values[5]), int(values[6])]
+            volumes = [float(values[7]), float(values[8])]
+            diameter, channel = int(values[9]), int(values[10])
+        except ValueError:
+            raise ValueError("Tube= values must be numbers, pixels, diameter (mm) and channel integers", line)
+        if not (0 <= roi[0] < roi[1] and 0 <= roi[2] < roi[3]):
+            raise ValueError("Tube= ROI must have x1 < x2 and y1 < y2, not negative", line)
+        if frame_size and (roi[1] > frame_size[0] or roi[3] > frame_size[1]):
+            raise ValueError("Tube= ROI outside the " + str(frame_size[0]) + 'x' + str(frame_size[1]) + " rotated frame", line)
+        if diameter <= 0 or not 0 <= channel <= 65535:
+            raise ValueError("Tube= needs a positive diameter and a channel from 0 to 65535", line)
+        marks = Mark(volumes, cfg.obj_distance, diameter)
+        marks.yposition = yposition
+        marks.lens_correction = not cfg.calibration_file
+        tubes.append(Tube(values[0], roi, marks, channel))
+    return tubes
+
+
+def create_undistort(cfg):                                      # Lens undistortion when Calibration_File is set, else None
+    return Undistorter(cfg.calibration_file) if cfg.calibration_file else None
+
+
+def create_edge(cfg):                                           # Lower edge detector with the settings in the config file
+    return EdgeDetector(cfg.edge_mode, cfg.edge_band, cfg.edge_aggregate)
+
+
+def create_detect(detect, cfg, clock=time.monotonic):
+    # Wraps the detect callable in a DetectionScheduler when Gating=1, so the full detector only runs
+    # on motion, tracking loss or max age. Returns the callable and the scheduler (None without gating)
+    if not cfg.gating:
+        return detect, None
+    scheduler = DetectionScheduler(detect, motion_threshold=cfg.gating_motion, max_age=cfg.gating_max_age, clock=clock)
+    return scheduler, scheduler
@@ -0,0 +1,25 @@
+import numpy as np
+import tensorflow as tf
+
+FEATURES = {                                                    # Fields written by generate_tfrecord.py
+    'image/encoded': tf.io.FixedLenFeature([], tf.string),
+    'image/filename': tf.io.FixedLenFeature([], tf.string),
+    'image/object/bbox/xmin': tf.io.VarLenFeature(tf.float32),
+    'image/object/bbox/xmax': tf.io.VarLenFeature(tf.float32),
+    'image/object/bbox/ymin': tf.io.VarLenFeature(tf.float32),
+    'image/object/bbox/ymax': tf.io.VarLenFeature(tf.float32),
+}
+
+
+def read_record(file, limit=None):
+    # Yields (filename, image, boxes) for every example in a TFRecord file. Images are RGB uint8 arrays
+    # and boxes are normalized [ymin, xmin, ymax, xmax] rows, the same layout as detection_boxes
+    for idx, raw in enumerate(tf.data.TFRecordDataset(file)):
+        if limit is not None and idx == limit:
+            break
+        example = tf.io.parse_single_example(raw, FEATURES)
+        image = tf.io.decode_image(example['image/encoded'], channels=3, expand_animations=False).numpy()
+        coords = [tf.sparse.to_dense(example['image/object/bbox/' + key]).numpy()
+                  for key in ('ymin', 'xmin', 'ymax', 'xmax')]
+        boxes = np.stack(coords, axis=1).astype(np.float32)
+        yield example['image/filename'].numpy().decode(), image, boxes
@@ -0,0 +1,79 @@
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+
+class FrameRing:
+    # Ring of image slots in a multiprocessing.shared_memory block, one writer process and any number of
+    # readers, frames are copied into place and never pickled. Every slot has a sequence number that is odd
+    # while the slot is being written (a seqlock): readers copy the slot and retry if the number changed, so
+    # the writer never waits for them. `count` numbers the frames written, frame n goes to slot n % slots.
+    # The creator owns the block and unlinks it, other processes attach with FrameRing(*ring.spec())
+    def __init__(self, name=None, slots=4, slot_bytes=1920 * 1080 * 3):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        header = 8 * (1 + 3 * slots) + 4 * 3 * slots            # count, then sequence, frame count and time per slot, shapes
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=header + slots * slot_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        buffer = self.shm.buf
+        self.count = np.ndarray((1,), np.int64, buffer, 0)      # Frames written
+        self.sequence = np.ndarray((slots,), np.int64, buffer, 8)
+        self.counts = np.ndarray((slots,), np.int64, buffer, 8 * (1 + slots))      # Frame count held by each slot
+        self.times = np.ndarray((slots,), np.float64, buffer, 8 * (1 + 2 * slots))
+        self.shapes = np.ndarray((slots, 3), np.int32, buffer, 8 * (1 + 3 * slots))
+        self.data = np.ndarray((slots, slot_bytes), np.uint8, buffer, header)
+        if self.owner:
+            self.count[0] = 0
+            self.sequence[:] = 0
+            self.counts[:] = -1
+
+    def spec(self):                                             # Arguments to attach from another process
+        return self.shm.name, self.slots, self.slot_bytes
+
+    def write(self, image, t=0.0):                              # Copies a uint8 image into the next slot, returns its count
+        if image.nbytes > self.slot_bytes:
+            raise ValueError("Frame larger than the ring slots", image.shape)
+        count = int(self.count[0]) + 1
+        slot = count % self.slots
+        sequence = int(self.sequence[slot]) | 1                 # Absolute parity, a writer killed mid slot cannot flip it
+        self.sequence[slot] = sequence                          # Odd, readers of this slot retry
+        self.data[slot, :image.nbytes] = image.reshape(-1)
+        self.shapes[slot] = image.shape if image.ndim == 3 else image.shape + (1,)
+        self.times[slot] = t
+        self.counts[slot] = count
+        self.sequence[slot] = sequence + 1                      # Even again, the slot is consistent
+        self.count[0] = count                                   # Published last
+        return count
+
+    def read(self, count=None, retries=5):
+        # (count, time, image copy) of frame `count`, the newest frame if None. None if the frame was never
+        # written or has already been overwritten, or if the writer kept rewriting the slot
+        if count is None:
+            count = int(self.count[0])
+        if count <= 0:
+            return None
+        slot = count % self.slots
+        for _ in range(retries):
+            before = int(self.sequence[slot])
+            if before % 2 == 0:
+                if int(self.counts[slot]) != count:
+                    return None
+                shape = tuple(int(value) for value in self.shapes[slot])
+                t = float(self.times[slot])
+                image = self.data[slot, :shape[0] * shape[1] * shape[2]].reshape(shape).copy()
+                if int(self.sequence[slot]) == before:
+                    return count, t, image if shape[2] > 1 else image[:, :, 0]
+            time.sleep(0)                                       # Let the writer finish the slot
+        return None
+
+    def latest(self):                                           # Count of the newest frame, 0 before the first one
+        return int(self.count[0])
+
+    def close(self):                                            # Unlinks the block if this process created it
+        del self.count, self.sequence, self.counts, self.times, self.shapes, self.data
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,216 @@
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from Camera_Utils import set_cam_params
+
+SYNTHETIC = 'synthetic'                                         # Source name of the generated tube, e.g. "synthetic:1280x720"
+
+
+class FrameSource:
+    # Base class of the frame sources. grab() advances to the next frame without decoding it, retrieve()
+    # decodes the grabbed frame into a preallocated RGB buffer, so frames the pipeline drops are never decoded
+    # or converted. The returned frame is only valid until the next retrieve(), callers crop (copy) it first
+    def __init__(self):
+        self.vid = None                                         # cv2.VideoCapture of camera and file sources
+        self.is_file = False                                    # Recorded or generated frames with their own clock
+        self.width, self.height, self.fps = 0, 0, 0.0
+        self.raw = None                                         # Preallocated decoded (BGR) and RGB frames
+        self.rgb = None
+
+    def allocate(self):
+        self.raw = np.empty((self.height, self.width, 3), np.uint8)
+        self.rgb = np.empty((self.height, self.width, 3), np.uint8)
+        print('Resolution: ', self.width, 'x', self.height)
+
+    def grab(self):                                             # Returns False at the end of the source or on errors
+        return self.vid.isOpened() and self.vid.grab()
+
+    def retrieve(self):                                         # RGB frame of the last grab, in self.rgb
+        ret, frame = self.vid.retrieve(self.raw)
+        if not ret:
+            return False, None
+        if frame.shape != self.raw.shape:                       # Driver changed the resolution, follow it
+            self.height, self.width = frame.shape[:2]
+            self.raw = np.ascontiguousarray(frame)
+            self.rgb = np.empty_like(self.raw)
+        return True, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.rgb)
+
+    def get_frame(self):                                        # grab and retrieve, same interface as before
+        if not self.grab():
+            return False, None
+        return self.retrieve()
+
+    def position(self):                                         # Seconds, video time for files and generated frames
+        return time.monotonic()
+
+    def set(self, prop, value):                                 # Camera property (brightness, focus), ignored if unsupported
+        if self.vid is not None:
+            self.vid.set(prop, value)
+
+    def release(self):
+        if self.vid is not None and self.vid.isOpened():
+            print('Closing video feed...')
+            self.vid.release()
+
+    def __del__(self):                                          # If program closes, release the camera
+        self.release()
+
+
+class CameraSource(FrameSource):
+    # USB camera. DirectShow on Windows and V4L2 on Linux. fourcc selects the compressed MJPG stream most
+    # webcams need for high resolutions at full frame rate, buffer_size the frames queued in the driver
+    # (1 always delivers the newest frame)
+    def __init__(self, index=0, res_list=None, fourcc='MJPG', buffer_size=1):
+        super().__init__()
+        if res_list is None:                                    # Assign default value to res_list
+            res_list = [800, 600]                               # to avoid mutable default values
+        self.vid = cv2.VideoCapture(int(index), camera_api())
+        if not self.vid.isOpened():
+            raise ValueError("Unable to open video source", index)
+        if fourcc:                                              # Must be set before the resolution
+            self.vid.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+        if buffer_size:
+            self.vid.set(cv2.CAP_PROP_BUFFERSIZE, buffer_size)
+        w, h, _, _, _ = set_cam_params(self.vid, res_list[0], res_list[1], 100, 50, False)  # Set camera parameters
+        self.width, self.height = int(w), int(h)                # Camera resolution
+        self.fps = self.vid.get(cv2.CAP_PROP_FPS)
+        self.allocate()
+
+
+class FileSource(FrameSource):
+    # Recorded video. With realtime the frames are delivered at the recording frame rate like a camera would,
+    # frames that are already late are grabbed and skipped without decoding. Otherwise frames come as fast as
+    # they are read. loop restarts the recording at the end
+    def __init__(self, file, realtime=False, loop=False):
+        super().__init__()
+        self.vid = cv2.VideoCapture(file)
+        if not self.vid.isOpened():
+            raise ValueError("Unable to open video source", file)
+        self.is_file = True
+        self.realtime = realtime
+        self.loop = loop
+        self.width = int(self.vid.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.vid.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.fps = self.vid.get(cv2.CAP_PROP_FPS) or 30.0
+        self.index = -1                                         # Frame number of the last grab
+        self.offset = 0.0                                       # Video time of the loops already played
+        self.start = None                                       # Monotonic time of frame 0 in realtime mode
+        self.allocate()
+
+    def grab(self):
+        if self.realtime:
+            if self.start is None:
+                self.start = time.monotonic()
+            due = int((time.monotonic() - self.start) * self.fps)   # Frame that should be on screen now
+            if due <= self.index:                                   # Early, wait for the next frame time
+                time.sleep((self.index + 1) / self.fps - (time.monotonic() - self.start))
+            while self.index + 1 < due:                             # Late, drop frames without decoding them
+                if not self.next_frame():
+                    return False
+        return self.next_frame()
+
+    def next_frame(self):
+        if self.vid.grab():
+            self.index += 1
+            return True
+        if not self.loop or self.index < 0:
+            return False
+        self.offset += (self.index + 1) / self.fps              # Keep the video time growing over the loops
+        self.vid.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        if self.realtime:
+            self.start += (self.index + 1) / self.fps
+        self.index = -1
+        return self.next_frame()
+
+    def position(self):                                         # Video time of the last frame grabbed
+        return self.offset + max(self.index, 0) / self.fps
+
+
+class SyntheticSource(FrameSource):
+    # Generated frames of a tube with one or two liquids whose interfaces move up and down, to run and
+    # benchmark the meter without a camera. Frames are rendered upright and rotated 90 degrees counter
+    # clockwise like the mounted camera delivers them, only when retrieved
+    def __init__(self, width=1280, height=720, fps=30.0, realtime=True, frames=0, period=20.0, interfaces=2):
+        super().__init__()
+        self.is_file = True
+        self.width, self.height, self.fps = width, height, fps
+        self.realtime = realtime
+        self.frames = frames                                    # Frames to generate, 0 for endless
+        self.period = period                                    # Seconds of a full up and down movement
+        self.interfaces = interfaces
+        self.index = -1
+        self.start = None
+        self.allocate()
+        self.upright = np.empty((width, height, 3), np.uint8)   # Upright image, the tube is vertical
+        self.background = self.render_background()
+
+    def render_background(self):                                # Backlit white panel with the empty tube and its scale
+        rows, cols = self.upright.shape[:2]
+        background = np.full_like(self.upright, 235)
+        self.left, self.right = int(cols * 0.42), int(cols * 0.58)
+        self.top, self.bottom = int(rows * 0.08), int(rows * 0.94)
+        cv2.rectangle(background, (self.left, self.top), (self.right, self.bottom), (90, 90, 90), max(2, cols // 200))
+        for y in np.linspace(self.top + rows * 0.05, self.bottom - rows * 0.05, 11).astype(int):
+            cv2.line(background, (self.left, y), (self.left + (self.right - self.left) // 4, y), (60, 60, 60), 1)
+        return background
+
+    def levels(self, t):                                        # Rows of the interfaces at time t, top first
+        span = self.bottom - self.top
+        phase = np.sin(2 * np.pi * t / self.period)
+        levels = [self.top + span * (0.35 + 0.2 * phase)]
+        if self.interfaces > 1:
+            levels.append(self.top + span * (0.7 + 0.1 * np.cos(2 * np.pi * t / self.period)))
+        return [int(y) for y in levels]
+
+    def grab(self):
+        if self.frames and self.index + 1 >= self.frames:
+            return False
+        if self.realtime:
+            if self.start is None:
+                self.start = time.monotonic()
+            wait = (self.index + 1) / self.fps - (time.monotonic() - self.start)
+            if wait > 0:
+                time.sleep(wait)
+        self.index += 1
+        return True
+
+    def retrieve(self):
+        np.copyto(self.upright, self.background)
+        inner_left, inner_right = self.left + 3, self.right - 3
+        shades = [(200, 185, 120), (150, 170, 200)]             # Oil on top of water
+        levels = self.levels(self.position())
+        for index, y in enumerate(levels):
+            end = levels[index + 1] if index + 1 < len(levels) else self.bottom - 3
+            self.upright[y:end, inner_left:inner_right] = shades[index % 2]
+            center = (inner_left + inner_right) // 2            # Meniscus: dark concave band with its lowest point at y
+            axes = ((inner_right - inner_left) // 2, max(3, (inner_right - inner_left) // 8))
+            cv2.ellipse(self.upright, (center, y - axes[1]), axes, 0, 0, 180, (40, 40, 40), max(2, axes[1] // 3))
+        cv2.rotate(self.upright, cv2.ROTATE_90_COUNTERCLOCKWISE, dst=self.rgb)
+        return True, self.rgb
+
+    def position(self):
+        return max(self.index, 0) / self.fps
+
+
+def camera_api():                                               # Capture backend of the platform
+    if sys.platform.startswith('win'):
+        return cv2.CAP_DSHOW
+    if sys.platform.startswith('linux'):
+        return cv2.CAP_V4L2
+    return cv2.CAP_ANY
+
+
+def open_source(source, res_list=None, fourcc='MJPG', buffer_size=1, realtime=False, loop=False):
+    # Frame source from a name: a camera index, "synthetic" or "synthetic:WIDTHxHEIGHT", or a video file
+    source = str(source)
+    if source.isdigit():
+        return CameraSource(int(source), res_list, fourcc, buffer_size)
+    if source.split(':')[0] == SYNTHETIC:
+        size = source.split(':')[1] if ':' in source else 'x'.join(map(str, res_list or [1280, 720]))
+        width, height = (int(value) for value in size.split('x'))
+        return SyntheticSource(width, height, realtime=realtime)
+    if not os.path.isfile(source):
+        raise ValueError("Unable to open video source", source)
+    return FileSource(source, realtime, loop)
@@ -0,0 +1,192 @@
+import collections
+import glob
+import json
+import os
+import threading
+import time
+import numpy as np
+from Meniscus_Utils import ordered_meniscus
+
+READING_DTYPE = np.dtype([('time', '<f8'), ('tube', '<u2'), ('intf1', '<f4'), ('intf2', '<f4'),
+                          ('ypos1', '<f4'), ('ypos2', '<f4'), ('score1', '<f4'), ('score2', '<f4')])
+VALUE_COLUMNS = ('intf1', 'intf2', 'ypos1', 'ypos2', 'score1', 'score2')
+CHUNK_PATTERN = 'chunk_%06d.bin'
+META_FILE = 'meta.json'
+
+
+class ReadingRecorder(threading.Thread):
+    # Appends every reading to a folder of chunk files from a background thread. A chunk is a raw array of
+    # READING_DTYPE records, rows are written in bulk every flush_interval seconds and a new chunk is started
+    # every chunk_rows rows, so nothing is ever rewritten. A crash loses at most the rows not flushed yet, a
+    # partly written last record is ignored by ReadingStore. A folder that already has chunks is continued
+    # in a new chunk, its times may start over (replays are tagged with video time). Pending rows are bounded
+    # by max_buffer (oldest are dropped) in case the disk stalls.
+    def __init__(self, folder, tubes=('',), chunk_rows=100000, flush_interval=2.0, max_buffer=100000):
+        super().__init__(name='recorder', daemon=True)
+        self.folder = folder
+        self.tubes = list(tubes)                                # Tube names, the tube column holds the index
+        self.chunk_rows = chunk_rows
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.pending = collections.deque()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.written = 0                                        # Rows on disk
+        self.dropped = 0                                        # Rows discarded because the buffer was full
+        os.makedirs(folder, exist_ok=True)
+        self.chunk = len(chunk_files(folder))                   # A folder that already has chunks gets a new one
+        self.chunk_written = 0
+        self.write_meta()
+
+    def write_meta(self):
+        meta = {'version': 1, 'dtype': READING_DTYPE.descr, 'tubes': self.tubes, 'created': time.time()}
+        meta_file = os.path.join(self.folder, META_FILE)
+        if os.path.isfile(meta_file):
+            with open(meta_file, 'r') as f:
+                meta['created'] = json.load(f).get('created', meta['created'])
+        with open(meta_file, 'w') as f:
+            json.dump(meta, f)
+
+    def add(self, t, readings, yposition=(0, 0), score=(0, 0), tube=0):    # Queue one reading, never blocks on disk
+        row = (t, tube, none_nan(readings[0]), none_nan(readings[1]), yposition[0], yposition[1], score[0], score[1])
+        with self.lock:
+            if len(self.pending) >= self.max_buffer:
+                self.pending.popleft()
+                self.dropped += 1
+            self.pending.append(row)
+
+    def add_packet(self, packet):                               # All readings of an analysed FramePacket, top interface first
+        if packet.tube_results:
+            for index, (_, meniscus, _) in enumerate(packet.tube_results):
+                self.add(packet.t_capture, *ordered_meniscus(meniscus), index)
+        elif packet.meniscus is not None:
+            self.add(packet.t_capture, *ordered_meniscus(packet.meniscus))
+
+    def run(self):
+        while not self.stopped.wait(self.flush_interval):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            rows, self.pending = self.pending, collections.deque()
+        if not rows:
+            return
+        rows = np.array(list(rows), dtype=READING_DTYPE)
+        while rows.size:
+            room = self.chunk_rows - self.chunk_written
+            if room <= 0:                                       # Current chunk is full, start the next one
+                self.chunk += 1
+                self.chunk_written = 0
+                continue
+            with open(os.path.join(self.folder, CHUNK_PATTERN % self.chunk), 'ab') as f:
+                rows[:room].tofile(f)
+            self.chunk_written += min(room, rows.size)
+            self.written += min(room, rows.size)
+            rows = rows[room:]
+
+    def close(self):                                            # Writes the pending rows and stops the thread
+        self.stopped.set()
+        if self.is_alive():
+            self.join()
+        else:
+            self.flush()
+
+
+class ReadingStore:
+    # Reads a recorder folder. Chunks are memory mapped and a time range only touches the chunks and rows
+    # inside it, so millions of rows load in tens of milliseconds. Rows are normally in capture order, a
+    # chunk whose times go back (a looped replay) is filtered with a mask and the result sorted by time
+    def __init__(self, folder):
+        with open(os.path.join(folder, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        self.tubes = self.meta['tubes']
+        self.chunks = []
+        for file in chunk_files(folder):
+            rows = os.path.getsize(file) // READING_DTYPE.itemsize  # Drop a partly written last record
+            if rows:
+                self.chunks.append(np.memmap(file, dtype=READING_DTYPE, mode='r', shape=(rows,)))
+        self.bounds = [None] * len(self.chunks)                 # (first, last, sorted) of each chunk, set when first read
+
+    def chunk_bounds(self, index):                              # Time bounds of a chunk and whether its rows are in order
+        if self.bounds[index] is None:
+            times = self.chunks[index]['time']
+            ordered = bool(np.all(times[1:] >= times[:-1]))
+            self.bounds[index] = (float(times[0]), float(times[-1]), True) if ordered else \
+                (float(times.min()), float(times.max()), False)
+        return self.bounds[index]
+
+    def __len__(self):
+        return sum(chunk.size for chunk in self.chunks)
+
+    def time_range(self):
+        if not self.chunks:
+            return None, None
+        bounds = [self.chunk_bounds(index) for index in range(len(self.chunks))]
+        return min(first for first, _, _ in bounds), max(last for _, last, _ in bounds)
+
+    def read(self, start=None, end=None, tube=None, every=None, max_points=None):
+        # Rows with start <= time < end as a READING_DTYPE array. tube selects one tube (index or name).
+        # every averages the rows in buckets of that many seconds, max_points picks every so that at
+        # most that many buckets are returned over all the tubes
+        parts = []
+        for index, chunk in enumerate(self.chunks):
+            low, high, ordered = self.chunk_bounds(index)
+            if (start is not None and high < start) or (end is not None and low >= end):
+                continue
+            times = chunk['time']
+            if ordered:
+                first = 0 if start is None else np.searchsorted(times, start, 'left')
+                last = chunk.size if end is None else np.searchsorted(times, end, 'left')
+                parts.append(np.asarray(chunk[first:last]))
+            else:
+                inside = np.ones(chunk.size, bool)
+                if start is not None:
+                    inside &= times >= start
+                if end is not None:
+                    inside &= times < end
+                parts.append(np.asarray(chunk[inside]))
+        rows = np.concatenate(parts) if parts else np.zeros(0, READING_DTYPE)
+        if rows.size and np.any(rows['time'][1:] < rows['time'][:-1]):  # Unordered chunk or chunks that overlap
+            rows = rows[np.argsort(rows['time'], kind='stable')]
+        if tube is not None:
+            rows = rows[rows['tube'] == (self.tubes.index(tube) if isinstance(tube, str) else tube)]
+        if max_points and rows.size > max_points:               # downsample averages each tube on its own
+            tubes = np.unique(rows['tube']).size
+            every = max(every or 0, (rows['time'][-1] - rows['time'][0]) * tubes / max_points)
+        if every and rows.size:
+            rows = downsample(rows, every)
+        return rows
+
+
+def downsample(rows, every):
+    # Mean of each column over buckets of `every` seconds (NaN readings are ignored), time is the bucket
+    # start. Every tube is averaged on its own. Works on contiguous column copies, the strided fields of
+    # the record array are several times slower
+    times = np.ascontiguousarray(rows['time'])
+    tubes = np.ascontiguousarray(rows['tube'])
+    bucket = ((times - times[0]) * (1.0 / every)).astype(np.int64)     # Truncation, several times faster than //
+    order = None
+    if tubes.any():                                             # Several tubes, group them keeping the time order
+        order = np.argsort(tubes, kind='stable')
+        tubes, bucket = tubes[order], bucket[order]
+    starts = np.flatnonzero(np.r_[True, (bucket[1:] != bucket[:-1]) | (tubes[1:] != tubes[:-1])])
+    result = np.zeros(starts.size, READING_DTYPE)
+    result['time'] = times[0] + bucket[starts] * every
+    result['tube'] = tubes[starts]
+    for column in VALUE_COLUMNS:
+        values = rows[column] if order is None else rows[column][order]
+        values = np.ascontiguousarray(values)
+        valid = values == values                                # False for NaN
+        sums = np.add.reduceat(np.where(valid, values, 0), starts, dtype=np.float64)
+        counts = np.add.reduceat(valid, starts, dtype=np.int64)
+        result[column] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+    return result[np.argsort(result['time'], kind='stable')]
+
+
+def chunk_files(folder):
+    return sorted(glob.glob(os.path.join(folder, 'chunk_*.bin')))
+
+
+def none_nan(value):                                            # Readings without a value are stored as NaN
+    return np.nan if value is None else value
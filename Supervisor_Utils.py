@@ -0,0 +1,308 @@
+import multiprocessing
+import os
+import queue
+import time
+from Inference_Utils import MODEL_INPUT_SIZE, resize_to_input
+from Ring_Utils import FrameRing
+
+REQUEST_SLOTS = 2                                               # Crops a station can have at the shared detector
+DISPLAY_SLOTS = 3
+DETECT_TIMEOUT = 5.0                                            # Seconds a station waits for the shared detector
+
+
+class Station:
+    # A camera of the rig: name, frame source (as in Level_Meter_CLI) and config file with its ROI, marks and
+    # output port. Holds the supervisor side state of its worker process
+    def __init__(self, name, source, config_file, index=0):
+        self.name = name
+        self.source = source
+        self.config_file = config_file
+        self.index = index                                      # Station number, tube column of the recorder
+        self.process = None
+        self.display = None                                     # FrameRing of rendered frames, GUI only
+        self.request = None                                     # FrameRing of crops for the shared detector
+        self.responses = None                                   # Queue of the shared detector results
+        self.started_at = 0.0                                   # Monotonic time of the last start
+        self.last_message = None                                # Monotonic time of the last reading, None before the first
+        self.restart_at = 0.0                                   # Monotonic time the next start is allowed at
+        self.backoff = 0.0
+        self.restarts = 0
+        self.frames = 0
+        self.finished = False                                   # A video file station that reached the end
+
+
+class RemoteDetector:
+    # detect() of a station process when the detector is shared. The crop is copied into the station request
+    # ring already resized to the model input (boxes are normalized, so they stay valid for the crop), only
+    # its frame count goes through the request queue and the boxes and scores come back on the station
+    # response queue. Raises TimeoutError if the detector does not answer (crashed or restarting)
+    def __init__(self, index, ring: FrameRing, requests, responses, ready, timeout=DETECT_TIMEOUT):
+        self.index = index
+        self.ring = ring
+        self.requests = requests
+        self.responses = responses
+        self.ready = ready                                      # multiprocessing.Event set while the model is loaded
+        self.timeout = timeout
+
+    def __call__(self, image):
+        count = self.ring.write(resize_to_input(image, MODEL_INPUT_SIZE))   # Resized here, in parallel for all stations
+        self.requests.put((self.index, count))
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                answer, detections = self.responses.get(timeout=max(deadline - time.monotonic(), 0.001))
+            except queue.Empty:
+                raise TimeoutError("Shared detector did not answer", self.index)
+            if answer == count:                                 # Older answers were for requests that timed out
+                return detections
+
+
+def run_detector(backend, threads, batch_size, stop, ready, requests, ring_specs, response_queues):
+    # Shared detector process, one engine for every station. Requests waiting together are detected in a
+    # single batched call, so the stations share the cores instead of each loading the model
+    from Inference_Utils import create_engine
+    engine = create_engine(backend, threads, batch_size)
+    rings = [FrameRing(*spec) for spec in ring_specs]
+    ready.set()
+    while not stop.is_set():
+        try:
+            pending = [requests.get(timeout=0.2)]
+        except queue.Empty:
+            continue
+        while len(pending) < batch_size:
+            try:
+                pending.append(requests.get_nowait())
+            except queue.Empty:
+                break
+        crops = []
+        for index, count in pending:
+            crop = rings[index].read(count)
+            if crop is not None:                                # None if the station already moved on
+                crops.append((index, count, crop[2]))
+        if not crops:
+            continue
+        for (index, count, _), detection in zip(crops, engine.detect_batch([crop for _, _, crop in crops])):
+            response_queues[index].put((count, {'detection_boxes': detection['detection_boxes'],
+                                                'detection_scores': detection['detection_scores']}))
+    for ring in rings:
+        ring.close()
+
+
+def run_station(name, source, config_file, index, stop, results, display_spec, display_size, request_spec, requests,
+                responses, ready, backend, threads, realtime, loop):
+    # Station process. Captures, crops and measures one camera like Level_Meter_CLI and puts one message per
+    # frame on the results queue: (index, time, readings, ypositions, scores, loading, latency ms). With a
+    # display ring the annotated frame is rendered here, fitted into display_size, so the GUI only copies it
+    from Camera_Utils import percent_roi
+    from Inference_Utils import EngineLoader
+    from Level_Meter_CLI import load_config
+    from Meniscus_Utils import ordered_meniscus
+    from Pipeline_Utils import FramePacket, create_detect, create_edge, create_locator, create_marks, create_undistort, \
+        locate_frame, pass_through, process_frame, render_packet
+    from Source_Utils import open_source
+    cfg = load_config(config_file)
+    vid = open_source(source, list(map(int, str(cfg.resolution).split('x'))), cfg.camera_fourcc, cfg.camera_buffer,
+                      realtime, loop)
+    roi = percent_roi(vid.height, vid.width, cfg.roi_percent_x, cfg.roi_percent_y)
+    marks, edge, undistort, locator = create_marks(cfg), create_edge(cfg), create_undistort(cfg), create_locator(cfg)
+    display = FrameRing(*display_spec) if display_spec else None
+    loader = None
+    if request_spec:
+        remote = RemoteDetector(index, FrameRing(*request_spec), requests, responses, ready)
+        detect, _ = create_detect(remote, cfg, vid.position if vid.is_file else time.monotonic)
+    else:
+        loader = EngineLoader(backend, threads)                 # Own engine, loaded while the preview already runs
+        loader.start()
+        detect = None
+    while not stop.is_set():
+        ret, frame = vid.get_frame()
+        if not ret:
+            if vid.is_file:                                     # End of the recording, exit code 0 is not restarted
+                break
+            continue
+        packet = FramePacket(None, roi)
+        if vid.is_file:
+            packet.t_capture = vid.position()
+        packet.roi, packet.frame = locate_frame(frame, roi, undistort, locator)
+        packet.stamp('crop')
+        if loader is not None and detect is None and loader.ready():
+            detect, _ = create_detect(loader.engine.detect, cfg, vid.position if vid.is_file else time.monotonic)
+        try:
+            if detect is not None if loader is not None else ready.is_set():   # Own engine: ready once detect exists
+                process_frame(detect, packet, marks, edge=edge)
+            else:
+                pass_through(packet)
+        except TimeoutError:                                    # Shared detector restarting, preview until it is back
+            pass_through(packet)
+        if locator is not None:
+            locator.observe(packet)
+        if display is not None:
+            height, width = packet.image.shape[:2]
+            scale = min(display_size[0] / width, display_size[1] / height)
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            display.write(render_packet(packet, marks, size, cfg.line_width, cfg.font_size), packet.t_capture)
+        packet.stamp('render')
+        readings, yposition, score = ordered_meniscus(packet.meniscus)     # Top interface first in every field
+        results.put((index, packet.t_capture, readings, [float(y) for y in yposition], [float(s) for s in score],
+                     packet.loading, packet.latency_ms('render')))
+    vid.release()
+    if display is not None:
+        display.close()
+
+
+class Supervisor:
+    # Runs one worker process per station and, with shared_detector, one detector process serving all of
+    # them. Frames stay in shared memory rings, only the readings are pickled. poll() collects the readings
+    # and restarts processes that died (or stations silent for `watchdog` seconds) with an exponential
+    # backoff from restart_delay to max_delay. Processes are started with spawn so the parent (Tk, sockets)
+    # is never forked
+    def __init__(self, stations, shared_detector=True, backend='tf', threads=None, display_size=None,
+                 realtime=True, loop=False, restart_delay=1.0, max_delay=60.0, watchdog=30.0):
+        self.stations = stations
+        self.shared_detector = shared_detector
+        self.backend = backend
+        self.threads = threads or os.cpu_count()
+        self.display_size = display_size                        # (width, height) of each station in the GUI, None headless
+        self.realtime = realtime
+        self.loop = loop
+        self.restart_delay = restart_delay
+        self.max_delay = max_delay
+        self.watchdog = watchdog
+        self.context = multiprocessing.get_context('spawn')
+        self.stop = self.context.Event()
+        self.results = self.context.Queue()
+        self.requests = self.context.Queue() if shared_detector else None
+        self.ready = self.context.Event()                       # Shared model loaded
+        self.detector = None
+        self.detector_restarts = 0
+        self.detector_restart_at = 0.0
+        self.detector_backoff = 0.0
+
+    def start(self):
+        for station in self.stations:
+            if self.display_size:
+                station.display = FrameRing(slots=DISPLAY_SLOTS, slot_bytes=self.display_size[0] * self.display_size[1] * 3)
+            if self.shared_detector:
+                station.request = FrameRing(slots=REQUEST_SLOTS, slot_bytes=MODEL_INPUT_SIZE * MODEL_INPUT_SIZE * 3)
+                station.responses = self.context.Queue()
+            self.start_station(station)
+        if self.shared_detector:
+            self.start_detector()
+
+    def start_station(self, station: Station):
+        threads = 1 if self.shared_detector else max(1, self.threads // len(self.stations))   # Own engines split the cores
+        station.process = self.context.Process(
+            target=run_station, name='station ' + station.name, daemon=True,
+            args=(station.name, station.source, station.config_file, station.index, self.stop, self.results,
+                  station.display.spec() if station.display else None, self.display_size,
+                  station.request.spec() if station.request else None, self.requests, station.responses, self.ready,
+                  self.backend, threads, self.realtime, self.loop))
+        station.process.start()
+        station.started_at = time.monotonic()
+        station.last_message = None
+
+    def start_detector(self):
+        self.ready.clear()
+        self.detector = self.context.Process(
+            target=run_detector, name='detector', daemon=True,
+            args=(self.backend, self.threads, len(self.stations), self.stop, self.ready, self.requests,
+                  [station.request.spec() for station in self.stations], [station.responses for station in self.stations]))
+        self.detector.start()
+
+    def poll(self, timeout=0.1):
+        # Readings received since the last call, as (station, time, readings, ypositions, scores, loading,
+        # latency ms). Waits up to timeout for the first one, then checks the processes
+        messages = []
+        try:
+            messages.append(self.results.get(timeout=timeout))
+            while True:
+                messages.append(self.results.get_nowait())
+        except queue.Empty:
+            pass
+        now = time.monotonic()
+        for message in messages:
+            station = self.stations[message[0]]
+            station.last_message = now
+            station.frames += 1
+            station.backoff = 0.0                               # Working again, the next crash restarts right away
+        self.check(now)
+        return [(self.stations[message[0]],) + message[1:] for message in messages]
+
+    def check(self, now):                                       # Restarts dead or hung processes
+        for station in self.stations:
+            process = station.process
+            if station.finished or process is None:
+                continue
+            silent = now - (station.last_message or station.started_at)    # Since the start before the first reading
+            if process.is_alive() and silent <= self.watchdog:
+                continue
+            if not process.is_alive() and process.exitcode == 0 and not self.stop.is_set():
+                station.finished = True                         # Video file played to the end
+                continue
+            if process.is_alive():
+                print('Station ', station.name, ' silent for ', round(silent, 1), 's, restarting')
+                end_process(process)
+            if station.restart_at == 0.0 or station.restart_at < station.started_at:
+                station.backoff = min(max(station.backoff * 2, self.restart_delay), self.max_delay)
+                station.restart_at = now + station.backoff
+                print('Station ', station.name, ' stopped (exit code ', process.exitcode, '), restarting in ',
+                      round(station.backoff, 1), 's')
+            if now >= station.restart_at:
+                station.restarts += 1
+                self.start_station(station)
+        if self.detector is not None and not self.detector.is_alive():
+            if self.detector_restart_at == 0.0:
+                self.ready.clear()
+                self.detector_backoff = min(max(self.detector_backoff * 2, self.restart_delay), self.max_delay)
+                self.detector_restart_at = now + self.detector_backoff
+                print('Detector stopped (exit code ', self.detector.exitcode, '), restarting in ',
+                      round(self.detector_backoff, 1), 's')
+            elif now >= self.detector_restart_at:
+                self.detector_restarts += 1
+                self.detector_restart_at = 0.0
+                self.start_detector()
+        elif self.ready.is_set():
+            self.detector_backoff = 0.0
+
+    def running(self):                                          # False once every station finished its video file
+        return not all(station.finished for station in self.stations)
+
+    def close(self, timeout=10.0):                              # Stops the processes and frees the shared memory
+        self.stop.set()
+        processes = [station.process for station in self.stations if station.process is not None]
+        processes += [self.detector] if self.detector is not None else []
+        deadline = time.monotonic() + timeout
+        while any(process.is_alive() for process in processes) and time.monotonic() < deadline:
+            try:                                                # A process exits only once its queued readings
+                while True:                                     # are read
+                    self.results.get_nowait()
+            except queue.Empty:
+                time.sleep(0.05)
+        for process in processes:
+            if process.is_alive():
+                end_process(process)
+        for station in self.stations:
+            for ring in (station.display, station.request):
+                if ring is not None:
+                    ring.close()
+
+
+def end_process(process, timeout=2.0):                         # SIGTERM, then SIGKILL if the process is stuck
+    process.terminate()
+    process.join(timeout)
+    if process.is_alive():
+        process.kill()
+        process.join(timeout)
+
+
+def create_stations(cfg, config_file):
+    # Station classes from the Station= lines of the config file, each one with the format name,source,config
+    # source is a camera index, video file or synthetic[:WIDTHxHEIGHT], config the file with the ROI, marks and
+    # output port of that camera (empty for config_file)
+    stations = []
+    for index, line in enumerate(cfg.stations):
+        values = [value.strip() for value in line.split(',')]
+        if len(values) < 2 or not values[0]:
+            raise ValueError("Station= needs at least a name and a source", line)
+        stations.append(Station(values[0], values[1], values[2] if len(values) > 2 and values[2] else config_file, index))
+    return stations
@@ -0,0 +1,87 @@
+import time
+import cv2
+import numpy as np
+
+
+class DetectionScheduler(object):
+    # Drop-in replacement of a detect callable that runs the full detector only when needed. Between detector
+    # runs each frame is compared with the frame of the last detection (downscaled frame differencing) and the
+    # last boxes are tracked with template matching. The detector runs again when there is motion in the ROI,
+    # when the tracking confidence drops or when the last detection is older than max_age seconds.
+    def __init__(self, detect, motion_threshold=0.5, pixel_threshold=20, min_confidence=0.7, max_age=5.0, scale=0.25, clock=time.monotonic):
+        self.detect = detect                                    # Full detector, returns the detections dict
+        self.motion_threshold = motion_threshold                # Percent of changed pixels that counts as motion
+        self.pixel_threshold = pixel_threshold                  # Gray level difference of a changed pixel
+        self.min_confidence = min_confidence                    # Template matching score needed to keep tracking
+        self.max_age = max_age
+        self.scale = scale                                      # Downscale factor of the cheap checks
+        self.clock = clock                                      # Seconds, video time when replaying a recording
+        self.last = None                                        # Detections of the last detector run
+        self.reference = None                                   # Small gray frame of the last detector run
+        self.templates = []                                     # (template, y, x) of every box at the last detector run
+        self.last_time = 0.0
+        self.frames = 0
+        self.detector_calls = 0
+        self.reasons = {'init': 0, 'motion': 0, 'tracking': 0, 'age': 0}
+
+    def invocation_ratio(self):                                 # Fraction of frames that ran the full detector
+        return self.detector_calls / self.frames if self.frames else 0.0
+
+    def __call__(self, image):
+        self.frames += 1
+        small = cv2.resize(cv2.cvtColor(image, cv2.COLOR_RGB2GRAY), None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        reason = self.check(small)
+        if reason is None:
+            shift = self.track(small)
+            if shift is not None:
+                return self.shifted(shift, small.shape)
+            reason = 'tracking'
+        self.reasons[reason] += 1
+        self.detector_calls += 1
+        self.last = self.detect(image)
+        self.last_time = self.clock()
+        self.reference = small
+        self.templates = self.box_templates(small)
+        return self.last
+
+    def check(self, small):                                     # Reason to run the detector, None if not needed
+        if self.last is None or self.reference.shape != small.shape:
+            return 'init'                                       # First frame or the ROI changed
+        if self.clock() - self.last_time > self.max_age:
+            return 'age'
+        changed = cv2.absdiff(small, self.reference) > self.pixel_threshold
+        if 100.0 * np.count_nonzero(changed) / changed.size > self.motion_threshold:
+            return 'motion'
+        return None
+
+    def box_templates(self, small):                             # Gray patch of every box to track it on the next frames
+        templates = []
+        height, width = small.shape
+        for ymin, xmin, ymax, xmax in self.last['detection_boxes'][:2]:
+            y1, y2 = int(ymin * height), int(np.ceil(ymax * height))
+            x1, x2 = int(xmin * width), int(np.ceil(xmax * width))
+            if y2 - y1 >= 3 and x2 - x1 >= 3:
+                templates.append((small[y1:y2, x1:x2].copy(), y1, x1))
+        return templates
+
+    def track(self, small, margin=4):
+        # Mean (dy, dx) shift in small pixels of the tracked boxes, None when tracking confidence is too low
+        shifts = []
+        for template, y, x in self.templates:
+            th, tw = template.shape
+            top, left = max(y - margin, 0), max(x - margin, 0)
+            window = small[top:y + th + margin, left:x + tw + margin]
+            if window.shape[0] < th or window.shape[1] < tw:
+                return None
+            result = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, confidence, _, location = cv2.minMaxLoc(result)
+            if not confidence >= self.min_confidence:            # Also catches NaN on flat templates
+                return None
+            shifts.append((top + location[1] - y, left + location[0] - x))
+        return np.mean(shifts, axis=0) if shifts else (0.0, 0.0)
+
+    def shifted(self, shift, shape):                            # Last detections moved by the tracked shift
+        detections = dict(self.last)
+        offset = np.array([shift[0] / shape[0], shift[1] / shape[1]] * 2, dtype=np.float32)
+        detections['detection_boxes'] = np.clip(self.last['detection_boxes'] + offset, 0.0, 1.0)
+        return detections
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class TrendBuffer:
+    # Fixed size history of the readings of a whole run, preallocated once. Each entry holds the time of its
+    # first sample and the min and max of every series over `stride` samples. When the buffer is full,
+    # neighbouring entries are merged in place and stride doubles, so memory never grows and the plot still
+    # covers the run from its start (a wrapping ring would lose it) with the peaks kept by min/max.
+    def __init__(self, capacity=65536, series=2):
+        self.capacity = capacity - capacity % 2                 # Even, entries are merged in pairs
+        self.times = np.zeros(self.capacity)
+        self.low = np.full((self.capacity, series), np.nan, np.float32)
+        self.high = np.full((self.capacity, series), np.nan, np.float32)
+        self.size = 0                                           # Entries in use
+        self.stride = 1                                         # Samples per entry
+        self.count = 0                                          # Samples in the last entry
+        self.version = 0                                        # Changes on every append, the plot redraws only then
+
+    def append(self, t, values):                                # values: one reading per series, None for no value
+        values = np.array([np.nan if value is None else value for value in values], np.float32)
+        if self.size and self.count < self.stride:              # Last entry still collects samples
+            last = self.size - 1
+            np.fmin(self.low[last], values, out=self.low[last])     # fmin/fmax ignore the NaN of missing readings
+            np.fmax(self.high[last], values, out=self.high[last])
+            self.count += 1
+        else:
+            if self.size == self.capacity:
+                self.compact()
+            self.times[self.size] = t
+            self.low[self.size] = values
+            self.high[self.size] = values
+            self.size += 1
+            self.count = 1
+        self.version += 1
+
+    def compact(self):                                          # Merges entry pairs, halves the resolution
+        half = self.size // 2
+        self.times[:half] = self.times[0:self.size:2]
+        self.low[:half] = np.fmin(self.low[0:self.size:2], self.low[1:self.size:2])
+        self.high[:half] = np.fmax(self.high[0:self.size:2], self.high[1:self.size:2])
+        self.low[half:] = np.nan
+        self.high[half:] = np.nan
+        self.size = half
+        self.stride *= 2
+        self.count = self.stride                                # The last merged entry is complete
+
+    def view(self):                                             # Times, lows and highs of the entries in use, no copies
+        return self.times[:self.size], self.low[:self.size], self.high[:self.size]
+
+
+def decimate(times, low, high, width, t0, t1):
+    # Min/max decimation to `width` pixel columns between t0 and t1. Returns the column of each non empty
+    # bin and the min and max of every series in it, drawing a vertical segment per column from min to max
+    # shows the same envelope as plotting every sample
+    columns = ((times - t0) * ((width - 1) / max(t1 - t0, 1e-9))).astype(np.int64)
+    np.clip(columns, 0, width - 1, out=columns)
+    starts = np.flatnonzero(np.r_[True, columns[1:] != columns[:-1]])    # Times are sorted, so are the columns
+    return columns[starts], np.fmin.reduceat(low, starts, axis=0), np.fmax.reduceat(high, starts, axis=0)